@@ -0,0 +1,75 @@
+import datetime
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.utils.functional import cached_property
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+
+def get_cache():
+    # Общий для всех процессов кэш без вытеснения (например, отдельная база Redis с noeviction).
+    # Без него отметки хранятся в строке пользователя и проверяются запросом к БД
+    alias = getattr(settings, 'CORE_TOKEN_REVOCATION_CACHE', None)
+    return caches[alias] if alias is not None else None
+
+
+def revocation_key(user_id):
+    return f'core:token:revoked:{user_id}'
+
+
+def revoke_tokens(user_id):
+    # Все токены, выданные до этого момента, перестают приниматься. Возвращает момент отзыва.
+    # В кэше храним отметку, пока может жить самый долгий из них
+    revoked_at = time.time()
+    cache = get_cache()
+    if cache is None:
+        get_user_model().objects.filter(pk=user_id).update(
+            tokens_revoked_at=datetime.datetime.fromtimestamp(revoked_at, datetime.timezone.utc))
+    else:
+        timeout = max(api_settings.ACCESS_TOKEN_LIFETIME, api_settings.REFRESH_TOKEN_LIFETIME).total_seconds()
+        cache.set(revocation_key(user_id), revoked_at, timeout=int(timeout) + 1)
+    return revoked_at
+
+
+def get_revoked_at(user_id):
+    cache = get_cache()
+    if cache is not None:
+        return cache.get(revocation_key(user_id))
+    rows = list(get_user_model().objects.filter(pk=user_id).values_list('tokens_revoked_at', flat=True))
+    if not rows:
+        # Пользователь удалён
+        return float('inf')
+    return rows[0].timestamp() if rows[0] is not None else None
+
+
+def is_revoked(token):
+    revoked_at = get_revoked_at(token[api_settings.USER_ID_CLAIM])
+    if revoked_at is None:
+        return False
+    # auth_time переносится в access-токены при обновлении, iat - нет
+    return token.get('auth_time', token.get('iat', 0)) <= revoked_at
+
+
+class ClaimsUser(TokenUser):
+    # Пользователь из подписанных полей токена, без запроса к БД
+
+    @cached_property
+    def customer_id(self):
+        return self.token.get('customer_id')
+
+    @cached_property
+    def membership(self):
+        return self.token.get('membership')
+
+
+class StatelessJWTAuthentication(JWTStatelessUserAuthentication):
+    def get_user(self, validated_token):
+        super().get_user(validated_token)
+        if is_revoked(validated_token):
+            raise AuthenticationFailed('Токен отозван', code='token_revoked')
+        return ClaimsUser(validated_token)
@@ -0,0 +1,159 @@
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+REPLICA = 'replica'
+PIN_SALT = 'core.db.pin'
+
+# Модели каталога: в GET-запросах их можно читать с реплики. Корзины, заказы,
+# резервы и пользователи всегда читаются с основной БД
+CATALOG_MODELS = {
+    'store.product', 'store.collection', 'store.promotion', 'store.productimage', 'store.review',
+    'tags.tag', 'tags.taggeditem',
+}
+
+request_state = ContextVar('db_request_state', default=None)
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    # WAL: читатели не блокируют писателя; synchronous=normal в WAL не теряет целостность
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def has_replica():
+    return REPLICA in connections.settings
+
+
+def get_sticky_seconds():
+    return getattr(settings, 'CORE_REPLICA_STICKY_SECONDS', 5)
+
+
+def get_pin_cache():
+    # Общий для всех процессов кэш для отметок; без него отметка - подписанная cookie ответа
+    alias = getattr(settings, 'CORE_REPLICA_PIN_CACHE', None)
+    return caches[alias] if alias is not None else None
+
+
+def get_pin_cookie():
+    return getattr(settings, 'CORE_REPLICA_PIN_COOKIE', 'db_primary')
+
+
+def pin_key(user_id):
+    return f'core:db:primary:{user_id}'
+
+
+def pin(response, user_id, sticky_seconds):
+    pin_cache = get_pin_cache()
+    if pin_cache is not None:
+        pin_cache.set(pin_key(user_id), True, timeout=sticky_seconds)
+    else:
+        response.set_signed_cookie(get_pin_cookie(), str(user_id), salt=PIN_SALT, max_age=sticky_seconds,
+                                   httponly=True, samesite='Lax')
+
+
+def is_pinned(request, user_id):
+    pin_cache = get_pin_cache()
+    if pin_cache is not None:
+        return pin_cache.get(pin_key(user_id)) is not None
+    # Подпись проверяет и возраст: после sticky-секунд cookie не действует, даже если клиент её держит
+    value = request.get_signed_cookie(get_pin_cookie(), default=None, salt=PIN_SALT,
+                                      max_age=get_sticky_seconds())
+    return value == str(user_id)
+
+
+class RequestState:
+    def __init__(self, request):
+        self.request = request
+        self.read_only = request.method in ('GET', 'HEAD')
+        # replica_reads представления: None - по списку моделей каталога, False - только основная БД,
+        # True - любые чтения этого представления с реплики
+        self.replica_reads = None
+        self.wrote = False
+        self.used_replica = False
+        self.pinned = {}
+
+    def get_user_id(self):
+        # DRF выставляет request.user на исходном запросе после аутентификации
+        user = getattr(self.request, 'user', None)
+        return user.id if user is not None and user.is_authenticated else None
+
+    def is_pinned(self):
+        # Пользователь недавно писал в БД - реплика могла ещё не догнать, читаем с основной
+        user_id = self.get_user_id()
+        if user_id is None:
+            return False
+        if user_id not in self.pinned:
+            self.pinned[user_id] = is_pinned(self.request, user_id)
+        return self.pinned[user_id]
+
+
+def is_request_pinned():
+    # Текущий запрос должен читать только с основной БД (пользователь недавно писал)
+    state = request_state.get()
+    return state is not None and has_replica() and state.is_pinned()
+
+
+def request_used_replica():
+    state = request_state.get()
+    return state is not None and state.used_replica
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = request_state.get()
+        if state is None or not state.read_only or state.wrote or state.replica_reads is False:
+            return 'default'
+        if state.replica_reads is None and model._meta.label_lower not in CATALOG_MODELS:
+            return 'default'
+        if not has_replica() or state.is_pinned():
+            return 'default'
+        state.used_replica = True
+        return REPLICA
+
+    def db_for_write(self, model, **hints):
+        state = request_state.get()
+        if state is not None:
+            state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # На реплике те же данные, что и на основной БД
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA
+
+
+class ReplicaRoutingMiddleware:
+    # Хранит состояние запроса для ReplicaRouter: метод, настройку представления
+    # и была ли запись - после записи чтения пользователя закрепляются за основной БД
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state = RequestState(request)
+        token = request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_state.reset(token)
+
+        user_id = state.get_user_id()
+        sticky_seconds = get_sticky_seconds()
+        if state.wrote and user_id is not None and sticky_seconds and has_replica():
+            pin(response, user_id, sticky_seconds)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = request_state.get()
+        if state is not None:
+            state.replica_reads = getattr(getattr(view_func, 'cls', None), 'replica_reads', None)
@@ -0,0 +1,128 @@
+import mimetypes
+import os
+import re
+import stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def get_setting(name, default):
+    return getattr(settings, f'CORE_MEDIA_{name}', default)
+
+
+def get_etag(stats):
+    # Как у nginx: время изменения и размер, без чтения файла
+    return f'"{stats.st_mtime_ns:x}-{stats.st_size:x}"'
+
+
+def get_cache_control(path):
+    # Файлы с хэшем содержимого в имени не меняются - кэшируются навсегда
+    if any(re.match(pattern, path) for pattern in get_setting('IMMUTABLE', [])):
+        return f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    return f"public, max-age={get_setting('MAX_AGE', 60 * 60)}"
+
+
+def parse_range(header, size):
+    # Один диапазон bytes=a-b, bytes=a- или bytes=-n; иначе None - отдаём файл целиком
+    match = RANGE_RE.match(header.strip())
+    if match is None or match[0] == 'bytes=-':
+        return None
+    start, end = match.groups()
+    if start == '':
+        length = min(int(end), size)
+        return (size - length, size - 1) if length else (size, None)
+    start = int(start)
+    if end and int(end) < start:
+        # Синтаксически неверный диапазон (RFC 9110) игнорируется, а не даёт 416
+        return None
+    end = min(int(end), size - 1) if end else size - 1
+    if start > end:
+        # Начало за концом файла - диапазон невыполним
+        return start, None
+    return start, end
+
+
+class FileRange:
+    # Файл, читаемый только в пределах [start, start + length)
+    def __init__(self, file, start, length):
+        self.file = file
+        self.remaining = length
+        file.seek(start)
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def serve(request, path, document_root=None):
+    # Раздача медиафайлов без DEBUG: ETag/If-None-Match, Cache-Control и Range.
+    # С CORE_MEDIA_SENDFILE отдачу файла делает веб-сервер перед Django
+    try:
+        full_path = safe_join(document_root or settings.MEDIA_ROOT, path)
+        stats = os.stat(full_path)
+    except (OSError, ValueError):
+        raise Http404
+    if not stat.S_ISREG(stats.st_mode):
+        raise Http404
+
+    etag = get_etag(stats)
+    response = get_conditional_response(request, etag=etag, last_modified=int(stats.st_mtime))
+    if response is None:
+        response = send_file(request, path, full_path, stats, etag)
+    response.headers.setdefault('ETag', etag)
+    response['Last-Modified'] = http_date(stats.st_mtime)
+    response['Cache-Control'] = get_cache_control(path)
+    return response
+
+
+def send_file(request, path, full_path, stats, etag):
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+
+    mode = get_setting('SENDFILE', None)
+    if mode is not None:
+        # Веб-сервер сам отдаст файл, включая Range и сжатие. Путь в процентной кодировке:
+        # не-ASCII заголовок Django закодировал бы по MIME, и сервер не нашёл бы файл
+        response = HttpResponse(content_type=content_type)
+        if mode == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = quote(get_setting('ACCEL_PREFIX', '/protected-media/') + path)
+        else:
+            response['X-Sendfile'] = quote(full_path)
+        return response
+
+    size = stats.st_size
+    byte_range = None
+    if 'HTTP_RANGE' in request.META and request.headers.get('If-Range', etag) == etag:
+        byte_range = parse_range(request.META['HTTP_RANGE'], size)
+    if byte_range is not None and byte_range[1] is None:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    file = open(full_path, 'rb')
+    if byte_range is None:
+        # FileResponse с настоящим файлом WSGI-сервер отдаёт через wsgi.file_wrapper (sendfile)
+        response = FileResponse(file, content_type=content_type)
+    else:
+        start, end = byte_range
+        response = FileResponse(FileRange(file, start, end - start + 1), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -6,3 +6,5 @@ from django.contrib.auth.models import AbstractUser
 
 class User(AbstractUser):
     email = models.EmailField(unique=True)
+    # Токены, выданные до этого момента, не принимаются (если не задан CORE_TOKEN_REVOCATION_CACHE)
+    tokens_revoked_at = models.DateTimeField(null=True, blank=True, editable=False)
@@ -0,0 +1,48 @@
+from rest_framework.utils import encoders
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Типы, которые orjson не знает (Decimal, ленивые строки и т.п.), и datetime -
+# через кодировщик DRF, чтобы вывод совпадал с обычным JSONRenderer байт в байт
+ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME) if orjson else 0
+
+
+def escape_separators(content):
+    # Как в JSONRenderer: U+2028/U+2029 экранируются, чтобы JSON оставался подмножеством JavaScript
+    if b'\xe2\x80' in content:
+        content = content.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+    return content
+
+
+class FastJSONRenderer(JSONRenderer):
+    # orjson, если установлен; с отступами и без него - обычный JSONRenderer DRF
+    default = encoders.JSONEncoder().default
+
+    def use_orjson(self, accepted_media_type, renderer_context):
+        return orjson is not None and self.compact and not self.ensure_ascii and \
+            self.get_indent(accepted_media_type, renderer_context or {}) is None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None or not self.use_orjson(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+        return escape_separators(orjson.dumps(data, default=self.default, option=ORJSON_OPTIONS))
+
+
+class StreamingJSONRenderer(FastJSONRenderer):
+    # ?format=json-stream: представления с FastReadMixin отдают непостраничный список потоком,
+    # остальные ответы рендерятся как обычно
+    format = 'json-stream'
+
+    def iter_render(self, batches, accepted_media_type=None, renderer_context=None):
+        # JSON-массив по частям: в памяти только текущая пачка элементов, а не весь ответ
+        yield b'['
+        separator = b''
+        for batch in batches:
+            for item in batch:
+                yield separator + self.render(item, accepted_media_type, renderer_context)
+                separator = b','
+        yield b']'
@@ -1,5 +1,10 @@
+import time
+
 from djoser.serializers import UserSerializer as BaseUserSerializer
 from djoser.serializers import UserCreateSerializer as BaseUserCreateSerializer
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer as BaseTokenObtainPairSerializer
+
+from store.models import Customer
 
 
 class UserCreateSerializer(BaseUserCreateSerializer):
@@ -9,4 +14,16 @@ class UserCreateSerializer(BaseUserCreateSerializer):
 
 class UserSerializer(BaseUserSerializer):
     class Meta(BaseUserSerializer.Meta):
-        fields = ['id', 'username', 'email', 'first_name', 'last_name']
\ No newline at end of file
+        fields = ['id', 'username', 'email', 'first_name', 'last_name']
+
+class TokenObtainPairSerializer(BaseTokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        # Поля копируются и в access-токены, полученные через refresh
+        customer = Customer.objects.filter(user_id=user.id).values('id', 'membership').first() or {}
+        token['is_staff'] = user.is_staff
+        token['customer_id'] = customer.get('id')
+        token['membership'] = customer.get('membership')
+        token['auth_time'] = time.time()
+        return token
@@ -0,0 +1,25 @@
+import datetime
+
+from django.conf import settings
+from django.db.models.signals import post_delete, pre_save
+from django.dispatch import receiver
+from core.authentication import revoke_tokens
+
+# Поля пользователя, которые зашиты в токен или решают, можно ли ему войти
+TOKEN_FIELDS = {'is_active', 'is_staff'}
+
+
+@receiver(pre_save, sender=settings.AUTH_USER_MODEL)
+def revoke_tokens_on_change(sender, instance, update_fields=None, **kwargs):
+    if instance.pk is None or (update_fields is not None and not TOKEN_FIELDS & set(update_fields)):
+        return
+    previous = sender.objects.filter(pk=instance.pk).values(*TOKEN_FIELDS).first()
+    if previous and any(previous[field] != getattr(instance, field) for field in TOKEN_FIELDS):
+        revoked_at = revoke_tokens(instance.pk)
+        # Иначе сохранение экземпляра затрёт отметку, записанную revoke_tokens в БД
+        instance.tokens_revoked_at = datetime.datetime.fromtimestamp(revoked_at, datetime.timezone.utc)
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def revoke_tokens_on_delete(sender, instance, **kwargs):
+    revoke_tokens(instance.pk)
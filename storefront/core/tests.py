@@ -1,3 +1,318 @@
-from django.test import TestCase
+import datetime
+import io
+import os
+import shutil
+import tempfile
+import uuid
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import caches
+from django.db import connection, connections, router
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APITestCase
+from rest_framework.views import APIView
+
+from . import db, parsers, renderers
+from .authentication import StatelessJWTAuthentication
+from .models import User
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                            'LOCATION': 'core-tests'}}
+
+
+@override_settings(CACHES={**LOCMEM_CACHE, 'tokens': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                                     'LOCATION': 'core-tests-tokens'}},
+                   CORE_TOKEN_REVOCATION_CACHE='tokens')
+class StatelessAuthenticationTest(APITestCase):
+    def setUp(self):
+        caches['tokens'].clear()
+        # Классы аутентификации читаются из настроек при импорте представлений
+        patcher = mock.patch.object(APIView, 'authentication_classes', [StatelessJWTAuthentication])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='secret')
+
+    def get_token(self):
+        response = self.client.post('/auth/jwt/create/', {'username': 'buyer', 'password': 'secret'})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def get_orders(self, access):
+        self.client.credentials(HTTP_AUTHORIZATION=f'JWT {access}')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/orders/')
+        return response, [query['sql'] for query in context.captured_queries]
+
+    def test_claims_replace_user_and_customer_lookup(self):
+        response, queries = self.get_orders(self.get_token()['access'])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([sql for sql in queries if 'core_user' in sql or 'store_customer' in sql])
+
+    def test_deactivated_user_tokens_are_revoked(self):
+        tokens = self.get_token()
+        self.user.is_active = False
+        self.user.save()
+
+        response, _ = self.get_orders(tokens['access'])
+        self.assertEqual(response.status_code, 401)
+
+        # Обновлённый access-токен наследует время входа и тоже отклоняется
+        refreshed = self.client.post('/auth/jwt/refresh/', {'refresh': tokens['refresh']})
+        response, _ = self.get_orders(refreshed.data['access'])
+        self.assertEqual(response.status_code, 401)
+
+    def test_login_after_revocation(self):
+        self.get_token()
+        self.user.is_staff = True
+        self.user.save()
+
+        response, _ = self.get_orders(self.get_token()['access'])
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(CORE_TOKEN_REVOCATION_CACHE=None)
+    def test_revocation_without_shared_cache(self):
+        # Без общего кэша отметка отзыва в строке пользователя
+        tokens = self.get_token()
+        response, queries = self.get_orders(tokens['access'])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue([sql for sql in queries if 'core_user' in sql])
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNotNone(User.objects.get(pk=self.user.pk).tokens_revoked_at)
+        self.assertEqual(self.get_orders(tokens['access'])[0].status_code, 401)
+
+        other = User.objects.create_user(username='other', email='other@example.com', password='secret')
+        access = self.client.post('/auth/jwt/create/', {'username': 'other', 'password': 'secret'}).data['access']
+        other.delete()
+        self.assertEqual(self.get_orders(access)[0].status_code, 401)
+
+
+class FastJSONTest(SimpleTestCase):
+    data = {
+        'price': Decimal('84.99'),
+        'cart': uuid.uuid4(),
+        'placed_at': datetime.datetime(2024, 1, 2, 3, 4, 5, 678901, tzinfo=datetime.timezone.utc),
+        'date': datetime.date(2024, 1, 2),
+        'title': 'Товар\u2028',
+        'error': gettext_lazy('Обязательное поле.'),
+        'items': [{'id': 1, 'quantity': 2}],
+        1: None,
+    }
+
+    def test_same_output_as_json_renderer(self):
+        expected = JSONRenderer().render(self.data)
+        self.assertEqual(renderers.FastJSONRenderer().render(self.data), expected)
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(renderers.FastJSONRenderer().render(self.data), expected)
+
+    def test_indent_falls_back_to_json_renderer(self):
+        self.assertEqual(renderers.FastJSONRenderer().render(self.data, 'application/json; indent=4'),
+                         JSONRenderer().render(self.data, 'application/json; indent=4'))
+
+    def test_streaming_renderer(self):
+        batches = [[{'id': 1}, {'id': 2}], [], [{'id': 3}]]
+        content = b''.join(renderers.StreamingJSONRenderer().iter_render(iter(batches)))
+        self.assertEqual(content, b'[{"id":1},{"id":2},{"id":3}]')
+
+    def test_parser(self):
+        parser = parsers.FastJSONParser()
+        self.assertEqual(parser.parse(io.BytesIO('{"title": "Товар", "price": 1.5}'.encode())),
+                         {'title': 'Товар', 'price': 1.5})
+        with self.assertRaises(ParseError):
+            parser.parse(io.BytesIO(b'{"title": NaN}'))
+
+
+class DatabaseSettingsTest(TestCase):
+    def test_sqlite_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_catalog_reads_go_to_replica_only_in_get_requests(self):
+        from store.models import Cart, Product
+
+        def route(method):
+            seen = {}
+
+            def view(request):
+                seen['product'] = router.db_for_read(Product)
+                seen['cart'] = router.db_for_read(Cart)
+                seen['write'] = router.db_for_write(Product)
+                seen['after_write'] = router.db_for_read(Product)
+
+            db.ReplicaRoutingMiddleware(view)(getattr(RequestFactory(), method)('/'))
+            return seen
+
+        with mock.patch.object(db, 'has_replica', return_value=True):
+            self.assertEqual(route('get'), {'product': 'replica', 'cart': 'default',
+                                            'write': 'default', 'after_write': 'default'})
+            self.assertEqual(route('post')['product'], 'default')
+        self.assertEqual(route('get')['product'], 'default')
+        self.assertEqual(router.db_for_read(Product), 'default')
+
+
+@override_settings(CACHES={**LOCMEM_CACHE, 'responses': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+                   STORE_RESPONSE_CACHE='responses', CORE_REPLICA_STICKY_SECONDS=60)
+class ReplicaRoutingTest(TransactionTestCase):
+    # Реплика - снимок тестовой БД в отдельном файле SQLite, который после снимка не обновляется,
+    # поэтому по данным ответа видно, из какой БД они прочитаны. Кэш ответов отключён
+    # (кроме test_response_cache_with_replica), иначе ответ с основной БД достался бы остальным
+    def setUp(self):
+        from store.models import Collection, Product
+        caches['default'].clear()
+        self.product = Product.objects.create(title='Старое название', price=100, inventory=10,
+                                              collection=Collection.objects.create(title='Категория'))
+        self.staff = User.objects.create_user(username='admin', email='admin@example.com', is_staff=True)
+
+        path = os.path.join(tempfile.mkdtemp(), 'replica.sqlite3')
+        with connection.cursor() as cursor:
+            cursor.execute('VACUUM INTO %s', [path])
+        connections.settings[db.REPLICA] = {**connections.settings['default'], 'NAME': path}
+        self.addCleanup(self.remove_replica, path)
+
+        Product.objects.filter(id=self.product.id).update(title='Новое название')
+
+    def remove_replica(self, path):
+        connections[db.REPLICA].close()
+        del connections[db.REPLICA]
+        del connections.settings[db.REPLICA]
+        os.remove(path)
+
+    def get_title(self, client=None):
+        response = (client or self.client).get(f'/products/{self.product.id}/')
+        self.assertEqual(response.status_code, 200)
+        return response.data['title']
+
+    def test_catalog_read_from_replica(self):
+        self.assertEqual(self.get_title(), 'Старое название')
+        response = self.client.get('/collections/')
+        self.assertEqual(len(response.data), 1)
+
+    def test_reads_stick_to_primary_after_write(self):
+        staff = APIClient()
+        staff.force_authenticate(self.staff)
+        self.assertEqual(self.get_title(staff), 'Старое название')
+
+        response = staff.patch(f'/products/{self.product.id}/', {'price': 150})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_title(staff), 'Новое название')
+        # Остальные пользователи по-прежнему читают с реплики
+        self.assertEqual(self.get_title(), 'Старое название')
+
+        # Отметка - подписанная cookie: без неё или с подделанной снова реплика
+        self.assertEqual(staff.cookies[db.get_pin_cookie()]['max-age'], db.get_sticky_seconds())
+        staff.cookies[db.get_pin_cookie()] = str(self.staff.id)
+        self.assertEqual(self.get_title(staff), 'Старое название')
+
+    @override_settings(CORE_REPLICA_PIN_CACHE='default')
+    def test_pin_in_shared_cache(self):
+        staff = APIClient()
+        staff.force_authenticate(self.staff)
+        staff.patch(f'/products/{self.product.id}/', {'price': 150})
+        self.assertNotIn(db.get_pin_cookie(), staff.cookies)
+        self.assertEqual(self.get_title(staff), 'Новое название')
+
+        caches['default'].delete(db.pin_key(self.staff.id))
+        self.assertEqual(self.get_title(staff), 'Старое название')
+
+    @override_settings(STORE_RESPONSE_CACHE='default')
+    def test_response_cache_with_replica(self):
+        staff = APIClient()
+        staff.force_authenticate(self.staff)
+        response_cache = caches['default']
+        with mock.patch.object(response_cache, 'set', wraps=response_cache.set) as cache_set:
+            self.assertEqual(self.get_title(), 'Старое название')
+        # Ответ с реплики хранится не дольше допустимого отставания
+        self.assertEqual(cache_set.call_args.kwargs['timeout'], 60)
+
+        staff.patch(f'/products/{self.product.id}/', {'price': 150})
+        # Запрос без закрепления снова читает реплику под новой версией...
+        self.assertEqual(self.get_title(), 'Старое название')
+        # ...но писатель не получает этот ответ из кэша
+        self.assertEqual(self.get_title(staff), 'Новое название')
+
+    def test_viewset_override(self):
+        from store.views import ProductViewSet
+        with mock.patch.object(ProductViewSet, 'replica_reads', False, create=True):
+            self.assertEqual(self.get_title(), 'Новое название')
+
+
+class MediaServingTest(TestCase):
+    content = b'0123456789'
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        for name in ('docs/file.txt', 'docs/в файл.txt', 'store/images/variants/0123456789abcdef/list.0123abcd.webp'):
+            os.makedirs(os.path.dirname(os.path.join(media_root, name)), exist_ok=True)
+            with open(os.path.join(media_root, name), 'wb') as file:
+                file.write(self.content)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def get(self, path='/media/docs/file.txt', **headers):
+        return self.client.get(path, headers=headers)
+
+    def test_full_response_and_conditional_get(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+
+        not_modified = self.get(If_None_Match=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+
+        variant = self.get('/media/store/images/variants/0123456789abcdef/list.0123abcd.webp')
+        self.assertEqual(variant['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(self.get('/media/../manage.py').status_code, 400)
+        self.assertEqual(self.get('/media/docs/').status_code, 404)
+
+    def test_ranges(self):
+        response = self.get(Range='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(response['Content-Length'], '4')
+
+        self.assertEqual(b''.join(self.get(Range='bytes=-3').streaming_content), b'789')
+        self.assertEqual(b''.join(self.get(Range='bytes=7-').streaming_content), b'789')
+        self.assertEqual(self.get(Range='bytes=10-').status_code, 416)
+        self.assertEqual(self.get(Range='bytes=10-20').status_code, 416)
+        reversed_range = self.get(Range='bytes=5-3')
+        self.assertEqual(reversed_range.status_code, 200)
+        self.assertEqual(b''.join(reversed_range.streaming_content), b'0123456789')
+        # Файл изменился с момента первого запроса части - отдаётся целиком
+        self.assertEqual(self.get(Range='bytes=2-5', If_Range='"old"').status_code, 200)
+        self.assertEqual(self.get(Range='bytes=0-1,4-5').status_code, 200)
+
+    def test_offload_to_web_server(self):
+        with self.settings(CORE_MEDIA_SENDFILE='x-accel-redirect'):
+            response = self.get()
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/docs/file.txt')
+        self.assertEqual(response.content, b'')
+        self.assertIn('ETag', response)
+
+        with self.settings(CORE_MEDIA_SENDFILE='x-sendfile'):
+            response = self.get()
+        self.assertTrue(response['X-Sendfile'].endswith(os.path.join('docs', 'file.txt')))
+
+    def test_offload_non_ascii_name(self):
+        with self.settings(CORE_MEDIA_SENDFILE='x-accel-redirect'):
+            response = self.get('/media/docs/в файл.txt')
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/docs/%D0%B2%20%D1%84%D0%B0%D0%B9%D0%BB.txt')
+
+        with self.settings(CORE_MEDIA_SENDFILE='x-sendfile'):
+            response = self.get('/media/docs/в файл.txt')
+        self.assertTrue(response['X-Sendfile'].endswith('/docs/%D0%B2%20%D1%84%D0%B0%D0%B9%D0%BB.txt'))
@@ -0,0 +1,139 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Case, F, IntegerField, Q, When
+
+from .models import LikeCounter, LikedItem
+
+logger = logging.getLogger(__name__)
+
+# (content_type_id, object_id) -> изменение счётчика, ещё не записанное в LikeCounter
+_buffer = {}
+_lock = threading.Lock()
+# Записи в LikeCounter (flush и rebuild) по одной: иначе сдвиг попадёт поверх пересчёта
+_write_lock = threading.Lock()
+_timer = None
+_last_flush = time.monotonic()
+
+# Получатели изменений: функция от списка (content_type_id, object_id) после каждой записи
+flush_listeners = []
+
+
+def get_flush_interval():
+    # Секунды между записями пачки; 0 - писать сразу после коммита лайка
+    return getattr(settings, 'LIKES_COUNTER_FLUSH_INTERVAL', 5)
+
+
+def get_buffer_size():
+    return getattr(settings, 'LIKES_COUNTER_BUFFER_SIZE', 1000)
+
+
+def add(content_type_id, object_id, delta):
+    # Вызывать внутри транзакции лайка: в буфер попадёт только зафиксированное изменение
+    transaction.on_commit(lambda: buffer(content_type_id, object_id, delta))
+
+
+def buffer(content_type_id, object_id, delta):
+    global _timer
+    key = (content_type_id, object_id)
+    with _lock:
+        _buffer[key] = _buffer.get(key, 0) + delta
+        due = len(_buffer) >= get_buffer_size() or time.monotonic() - _last_flush >= get_flush_interval()
+        if not due and _timer is None:
+            # Последние изменения запишутся по таймеру, даже если новых лайков не будет
+            _timer = threading.Timer(get_flush_interval(), flush_in_thread)
+            _timer.daemon = True
+            _timer.start()
+    if due:
+        flush_safely()
+
+
+def flush_safely():
+    # Лайк уже зафиксирован: ошибка записи счётчиков не должна превращаться в ошибку запроса.
+    # Изменения остаются в буфере до следующей записи
+    try:
+        flush()
+    except Exception:
+        logger.exception('Не удалось записать счётчики лайков')
+
+
+def flush_in_thread():
+    try:
+        flush_safely()
+    finally:
+        close_old_connections()
+
+
+def flush():
+    # Пачка изменений - два запроса: строки для новых объектов и одно UPDATE со сдвигом счётчиков
+    with _write_lock:
+        pending = drain()
+        return write(pending)
+
+
+def drain():
+    global _buffer, _timer, _last_flush
+    with _lock:
+        pending, _buffer = _buffer, {}
+        if _timer is not None:
+            _timer.cancel()
+            _timer = None
+        _last_flush = time.monotonic()
+    return pending
+
+
+def write(pending):
+    pending = {key: delta for key, delta in pending.items() if delta}
+    if not pending:
+        return 0
+
+    try:
+        with transaction.atomic():
+            # Для удалённого объекта отрицательное изменение строку не создаёт
+            LikeCounter.objects.bulk_create(
+                [LikeCounter(content_type_id=content_type_id, object_id=object_id)
+                 for (content_type_id, object_id), delta in pending.items() if delta > 0],
+                ignore_conflicts=True,
+            )
+            keys = Q()
+            deltas = []
+            for (content_type_id, object_id), delta in pending.items():
+                condition = Q(content_type_id=content_type_id, object_id=object_id)
+                keys |= condition
+                deltas.append(When(condition, then=F('count') + delta))
+            LikeCounter.objects.filter(keys).update(count=Case(*deltas, output_field=IntegerField()))
+    except Exception:
+        # Не потерять изменения: вернуть в буфер до следующей записи
+        with _lock:
+            for key, delta in pending.items():
+                _buffer[key] = _buffer.get(key, 0) + delta
+        raise
+
+    for listener in flush_listeners:
+        listener(list(pending))
+    return len(pending)
+
+
+def rebuild():
+    # Точные значения по строкам лайков, например после падения процесса с непустым буфером.
+    # Буфер этого процесса уже учтён в строках лайков - сбрасываем его, иначе изменения
+    # засчитаются дважды. Буферы других процессов нужно записать до пересчёта
+    with _write_lock:
+        drain()
+        with transaction.atomic():
+            LikeCounter.objects.all().delete()
+            LikeCounter.objects.bulk_create(
+                [LikeCounter(content_type_id=content_type_id, object_id=object_id, count=count)
+                 for content_type_id, object_id, count in LikedItem.objects.count_likes().iterator()],
+                batch_size=1000,
+            )
+
+
+@atexit.register
+def flush_on_exit():
+    # При завершении процесса БД может быть уже недоступна - тогда изменения восстановит rebuild()
+    flush_safely()
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from likes import counters
+from likes.models import LikeCounter
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики лайков по таблице лайков'
+
+    def handle(self, *args, **options):
+        counters.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Счётчиков: {LikeCounter.objects.count()}'))
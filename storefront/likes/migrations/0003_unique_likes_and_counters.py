@@ -0,0 +1,61 @@
+# Generated by Django 4.2.4 on 2026-10-18 20:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def remove_duplicate_likes(apps, schema_editor):
+    # Перед ограничением уникальности оставляем самый ранний лайк пользователя на объект
+    LikedItem = apps.get_model('likes', 'LikedItem')
+    first_ids = LikedItem.objects.values('user_id', 'content_type_id', 'object_id') \
+        .annotate(first_id=models.Min('id')).values('first_id')
+    LikedItem.objects.exclude(id__in=first_ids).delete()
+
+
+def fill_counters(apps, schema_editor):
+    LikedItem = apps.get_model('likes', 'LikedItem')
+    LikeCounter = apps.get_model('likes', 'LikeCounter')
+    rows = LikedItem.objects.order_by().values('content_type_id', 'object_id').annotate(count=models.Count('id'))
+    LikeCounter.objects.bulk_create([LikeCounter(**row) for row in rows.iterator()], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('likes', '0002_likeditem_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LikeCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(remove_duplicate_likes, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='likeditem',
+            name='likes_user_object_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='likeditem',
+            constraint=models.UniqueConstraint(fields=('user', 'content_type', 'object_id'), name='likes_unique_user_object'),
+        ),
+        migrations.AddField(
+            model_name='likecounter',
+            name='content_type',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype'),
+        ),
+        migrations.AddIndex(
+            model_name='likecounter',
+            index=models.Index(fields=['content_type', '-count', 'object_id'], name='likes_counter_top_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='likecounter',
+            constraint=models.UniqueConstraint(fields=('content_type', 'object_id'), name='likes_counter_unique_object'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -6,11 +6,72 @@ from store.models import Product
 # Create your models here.
 
 
+class LikedItemManager(models.Manager):
+    def for_objects(self, obj_type, obj_ids):
+        content_type = ContentType.objects.get_for_model(obj_type)
+        return self.filter(content_type=content_type, object_id__in=obj_ids)
+
+    def get_like_counts(self, obj_type, obj_ids):
+        # {id объекта: число лайков} из таблицы счётчиков - без подсчёта строк лайков
+        content_type = ContentType.objects.get_for_model(obj_type)
+        counts = dict.fromkeys(obj_ids, 0)
+        counts.update(LikeCounter.objects.filter(content_type=content_type, object_id__in=obj_ids)
+                      .values_list('object_id', 'count'))
+        return counts
+
+    def count_likes(self):
+        # Точный пересчёт по строкам лайков: (content_type_id, object_id, число)
+        return self.order_by().values('content_type_id', 'object_id').annotate(count=models.Count('id')) \
+            .values_list('content_type_id', 'object_id', 'count')
+
+    def like(self, user_id, obj):
+        # Идемпотентно: повторный лайк ничего не меняет; (лайк, создан ли)
+        return self.get_or_create(user_id=user_id, content_type=ContentType.objects.get_for_model(obj),
+                                  object_id=obj.pk)
+
+    def unlike(self, user_id, obj):
+        content_type = ContentType.objects.get_for_model(obj)
+        return self.filter(user_id=user_id, content_type=content_type, object_id=obj.pk).delete()[0] > 0
+
+    def get_liked_ids(self, user_id, obj_type, obj_ids):
+        # id объектов из obj_ids, которые лайкнул пользователь
+        if user_id is None:
+            return set()
+        return set(self.for_objects(obj_type, obj_ids).filter(user_id=user_id).values_list('object_id', flat=True))
+
+
 class LikedItem(models.Model):
+    objects = LikedItemManager()
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey('content_type', 'object_id')
 
+    class Meta:
+        constraints = [
+            # Один лайк пользователя на объект; индекс ограничения заменяет likes_user_object_idx
+            models.UniqueConstraint(fields=['user', 'content_type', 'object_id'], name='likes_unique_user_object'),
+        ]
+        indexes = [
+            models.Index(fields=['content_type', 'object_id'], name='likes_object_idx'),
+        ]
+
+
+class LikeCounter(models.Model):
+    # Число лайков объекта; пополняется пачками из likes.counters, поэтому может
+    # отставать от LikedItem на LIKES_COUNTER_FLUSH_INTERVAL секунд
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['content_type', 'object_id'], name='likes_counter_unique_object'),
+        ]
+        indexes = [
+            # Самые популярные объекты типа
+            models.Index(fields=['content_type', '-count', 'object_id'], name='likes_counter_top_idx'),
+        ]
+
 
 # product = models.ForeignKey(Product, on_delete=models.CASCADE)
@@ -0,0 +1,16 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import counters
+from .models import LikedItem
+
+
+@receiver(post_save, sender=LikedItem)
+def count_like(sender, instance, created, **kwargs):
+    if created:
+        counters.add(instance.content_type_id, instance.object_id, 1)
+
+
+@receiver(post_delete, sender=LikedItem)
+def count_unlike(sender, instance, **kwargs):
+    counters.add(instance.content_type_id, instance.object_id, -1)
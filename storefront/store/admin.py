@@ -3,7 +3,7 @@ from django.db.models.aggregates import Count
 from django.db.models.query import QuerySet
 from django.utils.html import format_html, urlencode
 from django.urls import reverse
-from . import models
+from . import images, models
 
 # Register your models here.
 
@@ -26,6 +26,9 @@ class ProductImageInline(admin.TabularInline):
     readonly_fields = ['thumbnail']
 
     def thumbnail(self, instance):
+        if instance.content_hash:
+            url = images.get_storage().url(images.variant_name(instance.content_hash, 'thumbnail', 'webp'))
+            return format_html('<img src="{}" class="thumbnail">', url)
         if instance.image.name != '':
             return format_html(f'<img src="{instance.image.url}" class="thumbnail">')
         return ''
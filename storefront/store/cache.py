@@ -0,0 +1,128 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from rest_framework.response import Response
+
+from core import db
+from .fast import FastReadMixin
+
+PRODUCTS = 'products'
+COLLECTIONS = 'collections'
+LIST = 'list'
+
+
+def get_cache():
+    # Алиас из CACHES: locmem вытесняет по LRU (MAX_ENTRIES), общий кэш - по TIMEOUT
+    return caches[getattr(settings, 'STORE_RESPONSE_CACHE', 'default')]
+
+
+def get_version_timeout():
+    # Версия заводится для любого pk из URL, в том числе несуществующего, - без срока
+    # такие ключи копились бы бесконечно. После истечения версия начнётся заново с time_ns()
+    return getattr(settings, 'STORE_RESPONSE_VERSION_TIMEOUT', 24 * 60 * 60)
+
+
+def version_key(namespace, pk):
+    return f'store:{namespace}:version:{pk}'
+
+
+def get_version(namespace, pk):
+    cache = get_cache()
+    key = version_key(namespace, pk)
+    version = cache.get(key)
+    if version is None:
+        # Версия могла быть вытеснена - начинаем с нового значения, а не с нуля,
+        # чтобы не воскресить ответы, закэшированные под старой версией
+        version = time.time_ns()
+        cache.add(key, version, timeout=get_version_timeout())
+        version = cache.get(key, version)
+    return version
+
+
+def bump(namespace, *pks):
+    cache = get_cache()
+    for pk in pks:
+        key = version_key(namespace, pk)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), timeout=get_version_timeout())
+
+
+def invalidate(namespace, *pks, lists=True):
+    # Сбрасываем после коммита, иначе параллельный запрос закэширует старые данные
+    if lists:
+        pks = pks + (LIST,)
+    transaction.on_commit(lambda: bump(namespace, *pks))
+
+
+class CachedResponseMixin(FastReadMixin):
+    # Кэширует list/retrieve; ключ - версия объекта (или списка) и полный URL запроса
+    cache_namespace = None
+    cache_vary_on_user = False
+
+    def personalize(self, request, data):
+        # Поля пользователя поверх общего закэшированного ответа: (данные, отпечаток для ETag).
+        # Общий ответ один на всех - дешевле, чем cache_vary_on_user
+        return data, ''
+
+    def get_response_cache_key(self, request, version):
+        # Полный URL со схемой и хостом: в ответе абсолютные ссылки (next/previous, картинки)
+        key = f'{version}:{request.build_absolute_uri()}'
+        if self.cache_vary_on_user:
+            key += f':{request.user.id}'
+        digest = hashlib.md5(key.encode()).hexdigest()
+        return f'store:{self.cache_namespace}:response:{digest}'
+
+    def cached_response(self, request, version, build):
+        cache = get_cache()
+        key = self.get_response_cache_key(request, version)
+        etag = quote_etag(key.rsplit(':', 1)[1])
+
+        # Закреплённый за основной БД пользователь не берёт из кэша ответ, собранный с реплики
+        data = None if db.is_request_pinned() else cache.get(key)
+        if data is None:
+            data = build()
+            # Ответ с реплики мог отстать от записи, уже сменившей версию, - храним его не дольше
+            # допустимого отставания реплики, а не до следующей смены версии
+            timeout = db.get_sticky_seconds() if db.request_used_replica() else DEFAULT_TIMEOUT
+            cache.set(key, data, timeout=timeout)
+
+        data, personal = self.personalize(request, data)
+        if personal:
+            # Своя часть ответа меняется без смены версии объекта - только ETag с её учётом
+            etag = quote_etag(hashlib.md5(f'{etag}:{personal}'.encode()).hexdigest())
+
+        # Только ETag: он меняется с версией при любой записи. last_update массовые обновления
+        # (цены, остатки) не трогают, и If-Modified-Since отдал бы 304 со старыми данными
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+
+        response = Response(data)
+        response['ETag'] = etag
+        return response
+
+    def list(self, request, *args, **kwargs):
+        if self.streams_list(request):
+            # Поток собирается по ходу отдачи, готовых данных для кэша нет
+            return super().list(request, *args, **kwargs)
+
+        def build():
+            return super(CachedResponseMixin, self).list(request, *args, **kwargs).data
+
+        return self.cached_response(request, get_version(self.cache_namespace, LIST), build)
+
+    def retrieve(self, request, *args, **kwargs):
+        def build():
+            data, _ = self.get_object_data()
+            return data
+
+        lookup = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        return self.cached_response(request, get_version(self.cache_namespace, lookup), build)
@@ -0,0 +1,205 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import django
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних задержек обработки хранить для метрик
+LATENCY_WINDOW = 1000
+
+
+def get_setting(name, default):
+    return getattr(settings, f'STORE_EVENT_{name}', default)
+
+
+class Job:
+    # Вызов одного получателя сигнала; у каждого получателя свои попытки и таймаут
+    def __init__(self, signal, receiver, sender, kwargs):
+        self.signal = signal
+        self.receiver = receiver
+        self.sender = sender
+        self.kwargs = kwargs
+        self.attempt = 0
+        self.enqueued_at = time.monotonic()
+
+    @property
+    def name(self):
+        return getattr(self.receiver, '__qualname__', repr(self.receiver))
+
+
+class Dispatcher:
+    # Очередь в памяти процесса и пул потоков: получатели выполняются после коммита
+    # и не задерживают ответ. Очередь не переживает перезапуск процесса
+    def __init__(self, workers, retries, timeout, retry_delay):
+        self.queue = queue.Queue()
+        self.retries = retries
+        self.timeout = timeout
+        self.retry_delay = retry_delay
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.counters = dict.fromkeys(['enqueued', 'processed', 'failed', 'retried', 'timed_out'], 0)
+        self.delayed = 0
+        # Вызовы, превысившие таймаут и ещё не завершившиеся
+        self.overdue = 0
+        # Получатель, превысивший таймаут, продолжает занимать поток - поэтому пул с запасом
+        self.executor = ThreadPoolExecutor(max_workers=workers * 2, thread_name_prefix='events-call')
+        for index in range(workers):
+            threading.Thread(target=self.work, name=f'events-{index}', daemon=True).start()
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def submit(self, job):
+        self.count('enqueued')
+        self.queue.put(job)
+
+    def work(self):
+        while True:
+            job = self.queue.get()
+            try:
+                self.process(job)
+            finally:
+                self.queue.task_done()
+
+    def process(self, job):
+        job.attempt += 1
+        started = threading.Event()
+        future = self.executor.submit(call, job, started)
+        # Таймаут считается от начала вызова, а не от постановки в очередь пула
+        started.wait()
+        try:
+            future.result(timeout=self.timeout)
+        except TimeoutError:
+            # Поток не прервать: вызов продолжается, и повтор мог бы выполнить его дважды.
+            # Итог учитываем, когда вызов всё-таки завершится
+            self.count('timed_out')
+            logger.warning('Событие %s выполняется дольше %s с', job.name, self.timeout)
+            with self.lock:
+                self.overdue += 1
+            future.add_done_callback(lambda future: self.finish_overdue(job, future))
+            return
+        except Exception:
+            pass
+        self.finish(job, future)
+
+    def finish(self, job, future):
+        error = future.exception()
+        if error is not None:
+            self.fail(job, error)
+            return
+        self.count('processed')
+        with self.lock:
+            self.latencies.append(time.monotonic() - job.enqueued_at)
+
+    def finish_overdue(self, job, future):
+        try:
+            self.finish(job, future)
+        finally:
+            with self.lock:
+                self.overdue -= 1
+
+    def fail(self, job, error):
+        if job.attempt > self.retries:
+            self.count('failed')
+            logger.error('Событие %s не обработано после %s попыток: %s', job.name, job.attempt, error)
+            return
+        self.count('retried')
+        logger.warning('Событие %s: попытка %s не удалась (%s)', job.name, job.attempt, error)
+        # Экспоненциальная пауза между попытками, не занимая поток обработчика
+        with self.lock:
+            self.delayed += 1
+        timer = threading.Timer(self.retry_delay * 2 ** (job.attempt - 1), self.resubmit, [job])
+        timer.daemon = True
+        timer.start()
+
+    def resubmit(self, job):
+        with self.lock:
+            self.delayed -= 1
+        self.queue.put(job)
+
+    def join(self):
+        # Ждёт, пока очередь, отложенные повторы и долгие вызовы опустеют (для тестов и завершения команд)
+        while True:
+            self.queue.join()
+            with self.lock:
+                if not self.delayed and not self.overdue:
+                    return
+            time.sleep(0.01)
+
+    def get_metrics(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            metrics = dict(self.counters, queue_depth=self.queue.qsize(), delayed=self.delayed,
+                           overdue=self.overdue)
+        if latencies:
+            metrics['latency_avg'] = sum(latencies) / len(latencies)
+            metrics['latency_p95'] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            metrics['latency_max'] = latencies[-1]
+        return metrics
+
+
+def call(job, started):
+    # Поток пула держит своё соединение с БД - закрываем устаревшие до и после вызова
+    started.set()
+    close_old_connections()
+    try:
+        job.receiver(signal=job.signal, sender=job.sender, **job.kwargs)
+    finally:
+        close_old_connections()
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = Dispatcher(workers=get_setting('WORKERS', 4), retries=get_setting('RETRIES', 3),
+                                     timeout=get_setting('TIMEOUT', 10), retry_delay=get_setting('RETRY_DELAY', 1))
+        return _dispatcher
+
+
+def get_metrics():
+    if _dispatcher is None:
+        return {}
+    return _dispatcher.get_metrics()
+
+
+def send(signal, sender, **kwargs):
+    # Замена signal.send_robust внутри транзакции: получатели вызываются только после коммита
+    # (при откате - никогда), каждый отдельной задачей в пуле потоков
+    transaction.on_commit(lambda: enqueue(signal, sender, kwargs))
+
+
+def get_receivers(signal, sender):
+    # Получатели сигнала для sender - приватный API Django, форма ответа зависит от версии:
+    # до 5.0 список, с 5.0 пара (синхронные, асинхронные). Асинхронные вызываем из потока пула
+    receivers = signal._live_receivers(sender)
+    if django.VERSION < (5, 0):
+        return list(receivers)
+    sync_receivers, async_receivers = receivers
+    return list(sync_receivers) + [async_to_sync(receiver) for receiver in async_receivers]
+
+
+def enqueue(signal, sender, kwargs):
+    receivers = get_receivers(signal, sender)
+    if not receivers:
+        return
+    if not get_setting('WORKERS', 4):
+        # Без пула (STORE_EVENT_WORKERS = 0) - сразу в текущем потоке, как send_robust
+        signal.send_robust(sender, **kwargs)
+        return
+    dispatcher = get_dispatcher()
+    for receiver in receivers:
+        dispatcher.submit(Job(signal, receiver, sender, kwargs))
@@ -0,0 +1,233 @@
+from django.core.exceptions import ValidationError
+from django.db.models import Prefetch
+from django.http import Http404, StreamingHttpResponse
+from rest_framework import fields
+from rest_framework.response import Response
+
+COLUMN, NESTED, MANY, COMPUTED = range(4)
+
+
+def as_string(value, context):
+    return str(value)
+
+
+def as_datetime(value, context, field=fields.DateTimeField()):
+    return field.to_representation(value)
+
+
+def as_date(value, context):
+    return value.isoformat()
+
+
+def file_url(storage):
+    # Как FileField в DRF: абсолютный URL, если в контексте есть запрос
+    def convert(value, context):
+        if not value:
+            return None
+        url = storage.url(value)
+        request = context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+    return convert
+
+
+class FastSerializer:
+    # Сериализатор только для чтения: план полей строится один раз при объявлении класса,
+    # строки берутся из .values() и сразу собираются в словари - без моделей и полей DRF.
+    # Вывод должен совпадать с соответствующим ModelSerializer байт в байт
+    model = None
+    fields = ()
+    # Поле ответа -> путь для .values(), если отличается от имени
+    sources = {}
+    # Поле ответа -> функция (значение, контекст); для None не вызывается
+    converters = {}
+    # Поле ответа -> функция от уже собранных полей строки
+    computed = {}
+    # Поле ответа -> сериализатор связанного объекта по FK (колонки через JOIN)
+    nested = {}
+    # Поле ответа -> сериализатор обратной связи (отдельный запрос на все строки сразу)
+    many = {}
+    # Аннотации, которые выводятся, только если есть в queryset (как read_only поля DRF)
+    optional = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        plan = []
+        for name in cls.fields:
+            source = cls.sources.get(name, name)
+            if name in cls.nested:
+                plan.append((NESTED, name, source, cls.nested[name]))
+            elif name in cls.many:
+                plan.append((MANY, name, source, cls.many[name]))
+            elif name in cls.computed:
+                plan.append((COMPUTED, name, source, cls.computed[name]))
+            else:
+                plan.append((COLUMN, name, source, cls.converters.get(name)))
+        cls.plan = tuple(plan)
+        cls.bound_plans = {}
+
+    def __init__(self, context=None):
+        self.context = context or {}
+
+    @classmethod
+    def bind(cls, prefix='', annotations=()):
+        # План с полными ключами строки .values(): для вложенных объектов - с префиксом связи
+        key = (prefix, frozenset(name for name in cls.optional if name in annotations))
+        if key not in cls.bound_plans:
+            bound = []
+            for kind, name, source, extra in cls.plan:
+                if kind == COLUMN and name in cls.optional and name not in key[1]:
+                    continue
+                if kind == NESTED:
+                    extra = extra.bind(f'{prefix}{source}__')
+                    source = f'{prefix}{source}__id'
+                elif kind == COLUMN:
+                    source = prefix + source
+                elif kind == MANY and prefix:
+                    raise TypeError('Обратные связи поддерживаются только на верхнем уровне')
+                bound.append((kind, name, source, extra))
+            cls.bound_plans[key] = tuple(bound)
+        return cls.bound_plans[key]
+
+    @classmethod
+    def columns(cls, bound):
+        result = []
+        for kind, name, source, extra in bound:
+            if kind == COLUMN:
+                result.append(source)
+            elif kind == NESTED:
+                result.extend(cls.columns(extra))
+        return result
+
+    def values(self, queryset, *extra):
+        bound = self.bind(annotations=queryset.query.annotations)
+        columns = list(dict.fromkeys([*self.columns(bound), *extra]))
+        return queryset.prefetch_related(None).values(*columns)
+
+    def to_representation(self, rows, queryset):
+        bound = self.bind(annotations=queryset.query.annotations)
+        context = self.context
+        data = [self.build(row, bound, context) for row in rows]
+        for kind, name, source, serializer_class in bound:
+            if kind == MANY:
+                self.fill_many(data, rows, name, source, serializer_class, queryset)
+        return data
+
+    @classmethod
+    def build(cls, row, bound, context):
+        data = {}
+        for kind, name, source, extra in bound:
+            if kind == COLUMN:
+                value = row[source]
+                data[name] = value if extra is None or value is None else extra(value, context)
+            elif kind == NESTED:
+                data[name] = None if row[source] is None else cls.build(row, extra, context)
+            elif kind == COMPUTED:
+                data[name] = extra(data)
+            else:
+                data[name] = []
+        return data
+
+    def fill_many(self, data, rows, name, relation, serializer_class, queryset):
+        related = queryset.model._meta.get_field(relation)
+        foreign_key = related.field.attname
+        children = self.get_related_queryset(queryset, relation, related.related_model)
+
+        serializer = serializer_class(self.context)
+        children = children.filter(**{f'{foreign_key}__in': [row['id'] for row in rows]})
+        child_rows = list(serializer.values(children, foreign_key))
+
+        groups = {}
+        for child_row, child in zip(child_rows, serializer.to_representation(child_rows, children)):
+            groups.setdefault(child_row[foreign_key], []).append(child)
+        for item, row in zip(data, rows):
+            item[name] = groups.get(row['id'], [])
+
+    @staticmethod
+    def get_related_queryset(queryset, relation, model):
+        # Берём queryset из Prefetch представления - с его сортировкой и ограничениями
+        for lookup in queryset._prefetch_related_lookups:
+            if isinstance(lookup, Prefetch) and lookup.prefetch_to == relation and lookup.queryset is not None:
+                return lookup.queryset
+        return model._default_manager.all()
+
+    def serialize(self, queryset):
+        return self.to_representation(list(self.values(queryset)), queryset)
+
+
+class FastReadMixin:
+    # fast_serializer_class включает быстрый вывод list/retrieve для GET вместо serializer_class
+    fast_serializer_class = None
+    # Размер пачки строк, когда непостраничный список запрошен потоком (?format=json-stream)
+    stream_batch_size = 500
+
+    def get_fast_serializer_class(self):
+        if self.request is None or self.request.method not in ('GET', 'HEAD'):
+            return None
+        return self.fast_serializer_class
+
+    def get_fast_serializer(self):
+        serializer_class = self.get_fast_serializer_class()
+        if serializer_class is None:
+            return None
+        return serializer_class(self.get_serializer_context())
+
+    def get_ordering_columns(self, queryset):
+        # Для курсорной пагинации значения полей сортировки должны быть в строке
+        ordering = list(queryset.query.order_by) or list(getattr(self, 'keyset_ordering', None) or []) \
+            or list(queryset.model._meta.ordering)
+        return [field.lstrip('-') for field in ordering if isinstance(field, str)]
+
+    def streams_list(self, request):
+        # Непостраничный список с ?format=json-stream отдаётся потоком StreamingHttpResponse
+        return self.paginator is None and hasattr(request.accepted_renderer, 'iter_render') \
+            and self.get_fast_serializer_class() is not None
+
+    def list(self, request, *args, **kwargs):
+        serializer = self.get_fast_serializer()
+        if serializer is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = serializer.values(queryset, *self.get_ordering_columns(queryset))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(serializer.to_representation(page, queryset))
+
+        if self.streams_list(request):
+            batches = self.iter_batches(serializer, rows, queryset)
+            content = request.accepted_renderer.iter_render(batches, request.accepted_media_type, self.get_renderer_context())
+            return StreamingHttpResponse(content, content_type=request.accepted_media_type)
+        return Response(serializer.to_representation(list(rows), queryset))
+
+    def iter_batches(self, serializer, rows, queryset):
+        batch = []
+        for row in rows.iterator(chunk_size=self.stream_batch_size):
+            batch.append(row)
+            if len(batch) == self.stream_batch_size:
+                yield serializer.to_representation(batch, queryset)
+                batch = []
+        if batch:
+            yield serializer.to_representation(batch, queryset)
+
+    def get_object_data(self):
+        # (данные ответа, объект или строка .values()) для retrieve
+        serializer = self.get_fast_serializer()
+        if serializer is None:
+            instance = self.get_object()
+            return self.get_serializer(instance).data, instance
+
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            queryset = queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+            rows = list(serializer.values(queryset)[:1])
+        except (TypeError, ValueError, ValidationError):
+            rows = []
+        if not rows:
+            raise Http404
+        self.check_object_permissions(self.request, rows[0])
+        return serializer.to_representation(rows, queryset)[0], rows[0]
+
+    def retrieve(self, request, *args, **kwargs):
+        data, _ = self.get_object_data()
+        return Response(data)
@@ -1,10 +1,22 @@
 from django_filters.rest_framework import FilterSet
+from rest_framework.filters import BaseFilterBackend, SearchFilter
 from .models import Product
+from . import search
 
 class ProductFilter(FilterSet):
     class Meta:
         model = Product
         fields = {
             'collection_id': ['exact'],
-            'price': ['gt', 'lt']
-        }
\ No newline at end of file
+            'price': ['gt', 'lt'],
+            'effective_price': ['gt', 'lt'],
+        }
+
+
+class ProductSearchFilter(BaseFilterBackend):
+    # Полнотекстовый поиск по индексу (FTS5 / tsvector / индекс в памяти) вместо LIKE '%...%'
+    search_param = SearchFilter.search_param
+
+    def filter_queryset(self, request, queryset, view):
+        text = request.query_params.get(self.search_param, '')
+        return search.search(queryset, text)
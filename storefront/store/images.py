@@ -0,0 +1,186 @@
+import hashlib
+import io
+import os
+import re
+import tempfile
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image, ImageOps
+
+from .models import ProductImage
+
+# Имя варианта: store/images/variants/<хэш содержимого>/<вариант>.<отпечаток настроек>.<формат>.
+# Содержимое файла по имени никогда не меняется, поэтому его можно кэшировать навсегда: другие
+# размеры или качество в настройках дают другое имя, а не перезапись старого файла
+VARIANTS_DIR = 'store/images/variants'
+VARIANT_NAME_RE = re.compile(rf'^{VARIANTS_DIR}/(?P<hash>[0-9a-f]{{16}})/'
+                             rf'(?P<variant>\w+)\.(?P<fingerprint>[0-9a-f]{{8}})\.(?P<format>\w+)$')
+HASH_LENGTH = 16
+FINGERPRINT_LENGTH = 8
+
+# Расширение файла -> формат Pillow
+FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+CONTENT_TYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+
+
+def get_variants():
+    # Вариант -> наибольшие ширина и высота; пропорции сохраняются
+    return getattr(settings, 'STORE_IMAGE_VARIANTS',
+                   {'thumbnail': (150, 150), 'list': (400, 400), 'detail': (1200, 1200)})
+
+
+def get_quality():
+    return getattr(settings, 'STORE_IMAGE_QUALITY', 80)
+
+
+def get_storage():
+    return ProductImage._meta.get_field('image').storage
+
+
+def hash_file(file):
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+def strip_metadata(file):
+    # Перекодирует загрузку без EXIF/XMP (в них бывают GPS и данные камеры); поворот из EXIF
+    # применяется к пикселям. Размеры уже проверены validate_image_dimensions
+    file.seek(0)
+    with Image.open(file) as source:
+        image_format = source.format
+        image = ImageOps.exif_transpose(source)
+    output = io.BytesIO()
+    image.save(output, image_format, **({'quality': 90} if image_format in ('JPEG', 'WEBP') else {}))
+    return SimpleUploadedFile(file.name, output.getvalue(), content_type=Image.MIME[image_format])
+
+
+def variant_fingerprint(variant, extension):
+    # Всё, от чего зависит содержимое файла варианта, кроме исходной картинки
+    width, height = get_variants()[variant]
+    key = f'{width}x{height}:{FORMATS[extension]}:{get_quality()}'
+    return hashlib.sha256(key.encode()).hexdigest()[:FINGERPRINT_LENGTH]
+
+
+def variant_name(content_hash, variant, extension):
+    return f'{VARIANTS_DIR}/{content_hash}/{variant}.{variant_fingerprint(variant, extension)}.{extension}'
+
+
+def variant_urls(storage):
+    # Конвертер для сериализаторов: хэш содержимого -> {вариант: {формат: URL}}.
+    # Файла может ещё не быть - его создаст serve_image_variant при первом запросе
+    def convert(content_hash, context):
+        if not content_hash:
+            return {}
+        request = context.get('request')
+        urls = {}
+        for variant in get_variants():
+            urls[variant] = {}
+            for extension in FORMATS:
+                url = storage.url(variant_name(content_hash, variant, extension))
+                urls[variant][extension] = request.build_absolute_uri(url) if request is not None else url
+        return urls
+    return convert
+
+
+def render(source, size, extension):
+    image = ImageOps.exif_transpose(source)
+    image.thumbnail(size, Image.LANCZOS)
+    if extension == 'jpeg' and image.mode != 'RGB':
+        # JPEG без прозрачности - подкладываем белый фон
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.convert('RGBA').getchannel('A'))
+        image = background
+    output = io.BytesIO()
+    image.save(output, FORMATS[extension], quality=get_quality(),
+               optimize=extension == 'jpeg', progressive=extension == 'jpeg')
+    return output.getvalue()
+
+
+def generate(product_image, variants=None, extensions=None):
+    # Создаёт недостающие варианты; возвращает имена созданных файлов
+    storage = get_storage()
+    names = {}
+    for variant in variants or get_variants():
+        for extension in extensions or FORMATS:
+            name = variant_name(product_image.content_hash, variant, extension)
+            if not storage.exists(name):
+                names[name] = (variant, extension)
+    if not names:
+        return []
+
+    with product_image.image.open('rb') as file, Image.open(file) as source:
+        source.load()
+        for name, (variant, extension) in names.items():
+            write(storage, name, render(source, get_variants()[variant], extension))
+    return list(names)
+
+
+def write(storage, name, data):
+    # Запись с перезаписью под фиксированным именем: storage.save при параллельной генерации
+    # добавил бы второй копии суффикс. Содержимое одинаковое - неважно, чья запись последняя
+    try:
+        path = storage.path(name)
+    except NotImplementedError:
+        # Удалённое хранилище без локальных путей
+        storage.delete(name)
+        storage.save(name, ContentFile(data))
+        return
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.chmod(temp_path, storage.file_permissions_mode or 0o644)
+        # Атомарная замена: читатель видит либо старый файл, либо новый целиком
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def delete_variants(content_hash):
+    # Вызывается после удаления ProductImage; одинаковые картинки других товаров делят варианты
+    if not content_hash or ProductImage.objects.filter(content_hash=content_hash).exists():
+        return
+    # Удаляем все файлы каталога, включая варианты под прежними настройками
+    storage = get_storage()
+    directory = f'{VARIANTS_DIR}/{content_hash}'
+    try:
+        _, files = storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in files:
+        storage.delete(f'{directory}/{name}')
+    try:
+        os.rmdir(storage.path(directory))
+    except (NotImplementedError, OSError):
+        pass
+
+
+def generate_variants(sender, image_id, **kwargs):
+    # Получатель product_image_saved: выполняется в пуле store.events после коммита
+    product_image = ProductImage.objects.filter(id=image_id).exclude(content_hash='').first()
+    if product_image is not None:
+        generate(product_image)
+
+
+def generate_by_name(name):
+    # Ленивое создание по имени файла варианта: None, если имя или картинка неизвестны
+    match = VARIANT_NAME_RE.match(name)
+    if match is None or match['variant'] not in get_variants() or match['format'] not in FORMATS:
+        return None
+    if match['fingerprint'] != variant_fingerprint(match['variant'], match['format']):
+        # Имя от прежних настроек: под ним нельзя создать файл с новыми размерами или качеством
+        return None
+    product_image = ProductImage.objects.filter(content_hash=match['hash']).first()
+    if product_image is None:
+        return None
+    generate(product_image, [match['variant']], [match['format']])
+    return name
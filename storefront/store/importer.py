@@ -0,0 +1,220 @@
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .models import CatalogImport, Collection, Product
+from . import cache, outbox, pricing, search
+
+DEFAULT_INVENTORY = 100
+
+
+class CatalogReader:
+    # Потоковый разбор файла вида {"Категория": [{товар}, ...], ...}: в памяти держим
+    # только текущий кусок файла и один товар, а не весь JSON целиком
+
+    def __init__(self, file, chunk_size=64 * 1024):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def read_more(self):
+        if self.eof:
+            return False
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.read_more():
+                raise ValueError('Неожиданный конец файла')
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f'Ожидался символ {char!r} на позиции {self.pos}')
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.read_more():
+                    raise
+                continue
+            # Число на границе куска могло быть обрезано - дочитываем
+            if end == len(self.buffer) and self.read_more():
+                continue
+            self.pos = end
+            return value
+
+    def __iter__(self):
+        self.expect('{')
+        if self.peek() == '}':
+            return
+        while True:
+            collection = self.value()
+            self.expect(':')
+            self.expect('[')
+            if self.peek() != ']':
+                while True:
+                    yield collection, self.value()
+                    if self.peek() != ',':
+                        break
+                    self.pos += 1
+            self.expect(']')
+            if self.peek() != ',':
+                break
+            self.pos += 1
+        self.expect('}')
+
+
+def build_description(characteristics):
+    lines = []
+    for group, values in characteristics.items():
+        lines.append(f'{group}:\n')
+        for key, value in values.items():
+            lines.append(f'\t{key}: {value}\n')
+    return ''.join(lines)
+
+
+def get_collection_id(title, collections):
+    if title not in collections:
+        collection = Collection.objects.filter(title=title).first()
+        if collection is None:
+            collection = Collection.objects.create(title=title)
+        collections[title] = collection.id
+    return collections[title]
+
+
+def save_batch(batch):
+    # Естественный ключ товара - (категория, название): повторный импорт обновляет, а не дублирует
+    existing = {
+        (collection_id, title): product_id
+        for product_id, collection_id, title in Product.objects.filter(
+            collection_id__in={key[0] for key in batch},
+            title__in={key[1] for key in batch},
+        ).values_list('id', 'collection_id', 'title')
+    }
+
+    now = timezone.now()
+    created, updated = [], []
+    for key, product in batch.items():
+        if key in existing:
+            product.id = existing[key]
+            product.last_update = now
+            updated.append(product)
+        else:
+            product.inventory = DEFAULT_INVENTORY
+            created.append(product)
+
+    with transaction.atomic():
+        Product.objects.bulk_create(created)
+        Product.objects.bulk_update(updated, ['description', 'price', 'slug', 'last_update'])
+        pricing.reprice(Product.objects.filter(id__in=[product.id for product in created + updated]))
+        # bulk-операции не шлют сигналов - индекс и кэш обновляем сами
+        search.index_products(created + updated)
+        cache.invalidate(cache.PRODUCTS, *[product.id for product in updated])
+        cache.invalidate(cache.COLLECTIONS, *{product.collection_id for product in created})
+        outbox.record_many(outbox.CATALOG_CHANGED,
+                           [{'model': 'product', 'id': product.id} for product in created + updated])
+    return len(created), len(updated)
+
+
+def import_catalog(file, batch_size=1000, progress=None):
+    collections = {}
+    batch = {}
+    stats = {'processed': 0, 'created': 0, 'updated': 0}
+
+    def flush():
+        created, updated = save_batch(batch)
+        stats['created'] += created
+        stats['updated'] += updated
+        batch.clear()
+        if progress is not None:
+            progress(dict(stats))
+
+    for collection_title, item in CatalogReader(file):
+        title = item['Наименование товара'][:50]
+        collection_id = get_collection_id(collection_title, collections)
+        batch[(collection_id, title)] = Product(
+            title=title,
+            slug=slugify(title, allow_unicode=True)[:50],
+            description=build_description(item.get('Характеристики', {})),
+            price=item['Цена товара'],
+            collection_id=collection_id,
+        )
+        stats['processed'] += 1
+        if len(batch) >= batch_size:
+            flush()
+
+    if batch:
+        flush()
+    return stats
+
+
+def get_stale_after():
+    # Импорт без новых пачек дольше стольких секунд считается прерванным (процесс упал)
+    return timedelta(seconds=getattr(settings, 'STORE_IMPORT_STALE_AFTER', 10 * 60))
+
+
+def get_status():
+    catalog_import = CatalogImport.objects.order_by('-id').first()
+    if catalog_import is None:
+        return {'state': 'idle'}
+    status = {'state': catalog_import.state, 'processed': catalog_import.processed,
+              'created': catalog_import.created, 'updated': catalog_import.updated}
+    if catalog_import.state == CatalogImport.STATE_FAILED:
+        status['error'] = catalog_import.error
+    return status
+
+
+def start_import(path):
+    # Блокировка - ограничение store_catalog_import_single_active в БД: второй импорт,
+    # пока идёт первый, не создастся ни в одном процессе. None, если импорт уже идёт
+    with transaction.atomic():
+        CatalogImport.objects.filter(is_active=True, updated_at__lt=timezone.now() - get_stale_after()) \
+            .update(state=CatalogImport.STATE_FAILED, is_active=False, error='Импорт прерван')
+        try:
+            with transaction.atomic():
+                catalog_import = CatalogImport.objects.create(path=str(path))
+        except IntegrityError:
+            return None
+        outbox.record(outbox.CATALOG_IMPORT, id=catalog_import.id)
+    return catalog_import
+
+
+def run_import(import_id, batch_size=1000):
+    # Вызывается обработчиком outbox. Повторная доставка события (истекла аренда, пока импорт
+    # идёт) ничего не делает: выполнение захватывает тот, кто перевёл импорт в running
+    def update(**fields):
+        CatalogImport.objects.filter(id=import_id).update(updated_at=timezone.now(), **fields)
+
+    claimed = CatalogImport.objects.filter(id=import_id, state=CatalogImport.STATE_PENDING) \
+        .update(state=CatalogImport.STATE_RUNNING, updated_at=timezone.now())
+    if not claimed:
+        return
+    try:
+        path = CatalogImport.objects.values_list('path', flat=True).get(id=import_id)
+        with open(path, mode='r', encoding='UTF-8') as file:
+            stats = import_catalog(file, batch_size=batch_size, progress=lambda stats: update(**stats))
+    except Exception as error:
+        update(state=CatalogImport.STATE_FAILED, is_active=False, error=str(error))
+    else:
+        update(state=CatalogImport.STATE_DONE, is_active=False, **stats)
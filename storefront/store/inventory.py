@@ -0,0 +1,101 @@
+import random
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.db.models import Case, F, IntegerField, Q, Sum, When
+from django.utils import timezone
+
+from .models import InventoryReservation, Product
+from . import cache, outbox
+
+
+def get_reservation_timeout():
+    # Сколько секунд держать резерв после добавления в корзину (None - резерв выключен)
+    return getattr(settings, 'STORE_CART_RESERVATION_TIMEOUT', None)
+
+
+def lock_products(product_ids):
+    # Блокируем строки всегда в порядке id, чтобы параллельные заказы не ловили deadlock
+    return list(Product.objects.select_for_update().filter(id__in=product_ids).order_by('id'))
+
+
+def get_reserved_quantities(product_ids, exclude_cart_id=None):
+    reservations = InventoryReservation.objects.filter(product_id__in=product_ids,
+                                                       expires_at__gt=timezone.now())
+    if exclude_cart_id is not None:
+        reservations = reservations.exclude(cart_id=exclude_cart_id)
+    return dict(reservations.values('product_id').annotate(total=Sum('quantity'))
+                .values_list('product_id', 'total'))
+
+
+def get_available(products, exclude_cart_id=None):
+    reserved = get_reserved_quantities([product.id for product in products], exclude_cart_id)
+    return {product.id: product.inventory - reserved.get(product.id, 0) for product in products}
+
+
+def decrement_inventory(quantities):
+    # Одно UPDATE на все товары; условие inventory >= qty не даст уйти в минус
+    if not quantities:
+        return True
+    in_stock = Q()
+    decrements = []
+    for product_id, quantity in quantities.items():
+        in_stock |= Q(id=product_id, inventory__gte=quantity)
+        decrements.append(When(id=product_id, then=F('inventory') - quantity))
+    updated = Product.objects.filter(in_stock).update(
+        inventory=Case(*decrements, output_field=IntegerField())
+    )
+    cache.invalidate(cache.PRODUCTS, *quantities)
+    outbox.record(outbox.INVENTORY_CHANGED,
+                  items=[[product_id, -quantity] for product_id, quantity in quantities.items()])
+    return updated == len(quantities)
+
+
+# Резервирует quantity единиц товара за корзиной, False - если свободного остатка не хватает
+def reserve(cart_id, product_id, quantity):
+    timeout = get_reservation_timeout()
+    if timeout is None:
+        return True
+
+    with transaction.atomic():
+        products = lock_products([product_id])
+        if not products:
+            return False
+        if quantity > get_available(products, exclude_cart_id=cart_id)[product_id]:
+            return False
+
+        if quantity == 0:
+            release(cart_id, product_id)
+        else:
+            InventoryReservation.objects.update_or_create(
+                cart_id=cart_id, product_id=product_id,
+                defaults={'quantity': quantity,
+                          'expires_at': timezone.now() + timedelta(seconds=timeout)}
+            )
+    return True
+
+
+def release(cart_id, product_id=None):
+    reservations = InventoryReservation.objects.filter(cart_id=cart_id)
+    if product_id is not None:
+        reservations = reservations.filter(product_id=product_id)
+    reservations.delete()
+
+
+def release_expired():
+    return InventoryReservation.objects.filter(expires_at__lte=timezone.now()).delete()[0]
+
+
+# Повторяет транзакцию func, если БД отклонила её из-за блокировки
+# (SQLite - "database is locked", Postgres - deadlock/serialization failure).
+# Внутри внешней транзакции повтор невозможен, поэтому ошибка пробрасывается сразу.
+def retry_on_conflict(func, attempts=10, delay=0.005):
+    for attempt in range(attempts):
+        try:
+            return func()
+        except OperationalError:
+            if connection.in_atomic_block or attempt == attempts - 1:
+                raise
+            time.sleep(random.uniform(0, delay * 2 ** attempt))
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store import outbox
+
+
+class Command(BaseCommand):
+    help = 'Обрабатывает события из таблицы outbox пачками; печатает скорость и задержку обработки'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Пауза в секундах, когда необработанных событий нет')
+        parser.add_argument('--once', action='store_true', help='Завершиться, когда очередь опустеет')
+
+    def handle(self, *args, **options):
+        totals = {'claimed': 0, 'processed': 0, 'failed': 0}
+        started = time.monotonic()
+
+        def progress(stats):
+            for name in totals:
+                totals[name] += stats[name]
+            latency = '' if stats['latency_max'] is None else \
+                f", задержка: средняя {stats['latency_avg']:.3f} с, макс. {stats['latency_max']:.3f} с"
+            self.stdout.write(f"Пачка: {stats['claimed']} событий, ошибок {stats['failed']}, "
+                              f"{stats['rate']:.0f} событий/с{latency}")
+
+        try:
+            outbox.run(batch_size=options['batch_size'], interval=options['interval'],
+                       idle_exit=options['once'], progress=progress)
+        except KeyboardInterrupt:
+            pass
+
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.stdout.write(self.style.SUCCESS(
+            f"Обработано: {totals['processed']}, ошибок: {totals['failed']}, "
+            f"{totals['claimed'] / elapsed:.0f} событий/с"
+        ))
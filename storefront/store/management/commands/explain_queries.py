@@ -0,0 +1,130 @@
+import re
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from core.models import User
+from store.models import Cart, Collection, Order, Product
+
+# Небольшие справочники, которые дешевле читать целиком
+EXPECTED_SCANS = {'store_collection', 'store_promotion', 'django_content_type'}
+
+SQLITE_SCAN_RE = re.compile(r'^SCAN (\w+)\b(?! USING (?:COVERING )?INDEX| VIRTUAL TABLE)')
+WHERE_RE = re.compile(r'\bWHERE\b')
+POSTGRES_SCAN_RE = re.compile(r'Seq Scan on (\w+)')
+
+
+def get_endpoints():
+    # GET-запросы, на которых держится основная нагрузка; {имя} подставляется из первой строки в БД
+    product = Product.objects.order_by('id').values('id', 'collection_id').first() or {}
+    cart = Cart.objects.values_list('id', flat=True).first()
+    order = Order.objects.values_list('id', flat=True).first()
+    collection = Collection.objects.values_list('id', flat=True).first()
+    ids = {'product': product.get('id'), 'collection': collection or product.get('collection_id'),
+           'cart': cart, 'order': order}
+
+    endpoints = [
+        '/products/',
+        '/products/?pagination=cursor',
+        '/products/?collection_id={collection}',
+        '/products/?ordering=price',
+        '/products/?ordering=-last_update',
+        '/products/?price__gt=100&price__lt=1000',
+        '/products/?search=телефон',
+        '/products/{product}/',
+        '/products/{product}/reviews/',
+        '/products/{product}/reviews/?pagination=cursor',
+        '/collections/',
+        '/carts/{cart}/',
+        '/carts/{cart}/items/',
+        '/orders/',
+        '/orders/?view=summary',
+        '/orders/?pagination=cursor',
+        '/orders/{order}/',
+        '/tagged_items/',
+        '/liked_items/',
+    ]
+    for url in endpoints:
+        names = re.findall(r'{(\w+)}', url)
+        if all(ids[name] is not None for name in names):
+            yield url.format(**ids)
+
+
+def explain(connection, sql, params):
+    # Запрос без WHERE и так читает всю таблицу - отмечаем только просмотры при наличии условий
+    tables = set(connection.introspection.table_names()) if WHERE_RE.search(sql) else set()
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            lines = [row[-1] for row in cursor.fetchall()]
+            scans = [match.group(1) for match in map(SQLITE_SCAN_RE.match, lines) if match]
+        elif connection.vendor == 'postgresql':
+            cursor.execute(f'EXPLAIN {sql}', params)
+            lines = [row[0] for row in cursor.fetchall()]
+            scans = [table for line in lines for table in POSTGRES_SCAN_RE.findall(line)]
+        else:
+            raise CommandError(f'EXPLAIN для {connection.vendor} не поддерживается')
+    return lines, [table for table in scans if table in tables]
+
+
+class Command(BaseCommand):
+    help = 'Выполняет EXPLAIN для запросов основных эндпоинтов и отмечает полные просмотры таблиц'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='Пользователь, от имени которого делаются запросы '
+                                               '(по умолчанию - владелец первого заказа)')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument('--ignore', action='append', default=[],
+                            help='Таблица, полный просмотр которой не считается ошибкой')
+        parser.add_argument('--fail-on-scan', action='store_true',
+                            help='Завершиться с ошибкой, если найден полный просмотр таблицы')
+        parser.add_argument('--verbose-plan', action='store_true', help='Печатать план каждого запроса')
+
+    def get_user(self, username):
+        if username:
+            return User.objects.get(username=username)
+        user_id = Order.objects.values_list('customer__user_id', flat=True).first()
+        return User.objects.filter(id=user_id).first() if user_id else None
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        ignored = EXPECTED_SCANS | set(options['ignore'])
+
+        client = APIClient()
+        user = self.get_user(options['username'])
+        if user is not None:
+            client.force_authenticate(user)
+
+        queries = []
+
+        def collect(execute, sql, params, many, context):
+            if sql.lstrip().upper().startswith('SELECT'):
+                queries.append((sql, params))
+            return execute(sql, params, many, context)
+
+        problems = 0
+        for url in get_endpoints():
+            queries.clear()
+            # Запросы идут через тестовый клиент с хостом testserver
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']), \
+                    connection.execute_wrapper(collect):
+                status = client.get(url).status_code
+            self.stdout.write(f'{url} [{status}]: запросов {len(queries)}')
+
+            for sql, params in dict.fromkeys((sql, tuple(params or ())) for sql, params in queries):
+                lines, scans = explain(connection, sql, params)
+                scans = [table for table in scans if table not in ignored]
+                if scans:
+                    problems += 1
+                    self.stdout.write(self.style.WARNING(f"  полный просмотр: {', '.join(scans)}"))
+                    self.stdout.write(f'    {sql}')
+                if options['verbose_plan'] or scans:
+                    for line in lines:
+                        self.stdout.write(f'    | {line}')
+
+        if problems and options['fail_on_scan']:
+            raise CommandError(f'Запросов с полным просмотром таблиц: {problems}')
+        self.stdout.write(self.style.SUCCESS(f'Готово, запросов с полным просмотром: {problems}'))
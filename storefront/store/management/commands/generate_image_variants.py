@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from store import images
+from store.models import ProductImage
+
+
+class Command(BaseCommand):
+    help = 'Считает хэши содержимого для старых картинок товаров и создаёт их уменьшенные варианты'
+
+    def handle(self, *args, **options):
+        created = 0
+        for product_image in ProductImage.objects.order_by('id').iterator():
+            if not product_image.content_hash:
+                if not product_image.image or not product_image.image.storage.exists(product_image.image.name):
+                    self.stdout.write(self.style.WARNING(f'Нет файла картинки {product_image.id}'))
+                    continue
+                with product_image.image.open('rb') as file:
+                    product_image.content_hash = images.hash_file(file)
+                ProductImage.objects.filter(id=product_image.id).update(content_hash=product_image.content_hash)
+            created += len(images.generate(product_image))
+        self.stdout.write(self.style.SUCCESS(f'Создано вариантов: {created}'))
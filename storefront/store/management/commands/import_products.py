@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from store.importer import import_catalog
+
+
+class Command(BaseCommand):
+    help = 'Потоковый импорт каталога товаров из JSON (формат TexnomartParser.json)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help='По умолчанию STORE_IMPORT_FILE')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        def progress(stats):
+            self.stdout.write(f"Обработано: {stats['processed']}, "
+                              f"создано: {stats['created']}, обновлено: {stats['updated']}")
+
+        path = options['path'] or settings.STORE_IMPORT_FILE
+        with open(path, mode='r', encoding='UTF-8') as file:
+            stats = import_catalog(file, batch_size=options['batch_size'], progress=progress)
+
+        self.stdout.write(self.style.SUCCESS(f"Импорт завершён: {stats['processed']} товаров"))
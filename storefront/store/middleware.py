@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+
+from .models import Customer
+from . import cache
+
+
+def get_customer_cache_key(user_id):
+    return f'store:customer:{user_id}'
+
+
+def resolve_customer(user):
+    if user is None or not user.is_authenticated:
+        return None
+
+    # Необязательный общий кэш на несколько секунд поверх кэша на время запроса
+    timeout = getattr(settings, 'STORE_CUSTOMER_CACHE_TIMEOUT', 0)
+    key = get_customer_cache_key(user.id)
+    if timeout:
+        customer = cache.get_cache().get(key)
+        if customer is not None:
+            return customer
+
+    customer = Customer.objects.filter(user_id=user.id).first()
+    if timeout and customer is not None:
+        cache.get_cache().set(key, customer, timeout)
+    return customer
+
+
+def get_customer(request):
+    # Покупатель ищется один раз за запрос; DRF-аутентификация к этому моменту уже выставила user
+    request = getattr(request, '_request', request)
+    if not hasattr(request, '_cached_customer'):
+        request._cached_customer = resolve_customer(getattr(request, 'user', None))
+    return request._cached_customer
+
+
+def get_customer_id(request):
+    # При StatelessJWTAuthentication id покупателя уже есть в токене - без запроса к БД
+    customer_id = getattr(getattr(request, 'user', None), 'customer_id', None)
+    if customer_id is not None:
+        return customer_id
+    customer = get_customer(request)
+    return customer.id if customer else None
+
+
+def forget_customer(user_id):
+    cache.get_cache().delete(get_customer_cache_key(user_id))
+
+
+class CustomerMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.customer = SimpleLazyObject(lambda: get_customer(request))
+        return self.get_response(request)
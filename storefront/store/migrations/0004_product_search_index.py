@@ -0,0 +1,45 @@
+from django.db import migrations, OperationalError
+
+# Копия store.search на момент миграции: миграция не должна зависеть от текущего кода
+FTS_TABLE = 'store_product_fts'
+POSTGRES_CONFIG = 'simple'
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.indexes import GinIndex
+        from django.contrib.postgres.search import SearchVector
+        Product = apps.get_model('store', 'Product')
+        # Выражение должно совпадать с store.search.PostgresBackend.get_vector()
+        vector = SearchVector('title', config=POSTGRES_CONFIG, weight='A') + \
+            SearchVector('description', config=POSTGRES_CONFIG, weight='D')
+        schema_editor.add_index(Product, GinIndex(vector, name='store_product_search_idx'))
+    elif connection.vendor == 'sqlite':
+        try:
+            schema_editor.execute(f"CREATE VIRTUAL TABLE {FTS_TABLE} "
+                                  f"USING fts5(title, description, tokenize='unicode61')")
+        except OperationalError:
+            # SQLite собран без FTS5 - поиск пойдёт через индекс в памяти
+            return
+        schema_editor.execute(f"INSERT INTO {FTS_TABLE} (rowid, title, description) "
+                              f"SELECT id, title, COALESCE(description, '') FROM store_product")
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS store_product_search_idx')
+    elif connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0003_inventoryreservation'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.4 on 2026-10-18 19:58
+
+from django.db import migrations, models
+
+from store import pricing
+
+
+def reprice_products(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    pricing.reprice(Product.objects.using(schema_editor.connection.alias).all())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0004_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='effective_price',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, editable=False, max_digits=10, verbose_name='Цена со скидкой'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='price_with_tax',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10, verbose_name='Цена с налогом'),
+        ),
+        migrations.RunPython(reprice_products, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.4 on 2026-10-18 20:25
+
+from django.db import migrations, models
+import store.validators
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0008_productimage_content_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=models.ImageField(upload_to='store/images', validators=[store.validators.validate_file_size, store.validators.validate_image_dimensions]),
+        ),
+    ]
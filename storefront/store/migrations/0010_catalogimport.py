@@ -0,0 +1,36 @@
+# Generated by Django 4.2.4 on 2026-10-18 20:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_productimage_dimensions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255, verbose_name='Файл')),
+                ('state', models.CharField(choices=[('pending', 'Ожидает'), ('running', 'Выполняется'), ('done', 'Завершён'), ('failed', 'Ошибка')], default='pending', max_length=10, verbose_name='Состояние')),
+                ('is_active', models.BooleanField(default=True)),
+                ('processed', models.PositiveIntegerField(default=0, verbose_name='Обработано')),
+                ('created', models.PositiveIntegerField(default=0, verbose_name='Создано')),
+                ('updated', models.PositiveIntegerField(default=0, verbose_name='Обновлено')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('started_at', models.DateTimeField(auto_now_add=True, verbose_name='Запущен')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Изменён')),
+            ],
+            options={
+                'verbose_name': 'Импорт каталога',
+                'verbose_name_plural': 'Импорты каталога',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='catalogimport',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('is_active',), name='store_catalog_import_single_active'),
+        ),
+    ]
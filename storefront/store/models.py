@@ -1,13 +1,21 @@
+from decimal import Decimal
 from uuid import uuid4
 
-from django.db import models
+from django.contrib.contenttypes.fields import GenericRelation
+from django.db import connections, models, router, transaction
+from django.db.models import Case, Count, ExpressionWrapper, F, Sum, Value, When
+from django.db.models.functions import Coalesce
 from django.core.validators import MinValueValidator
 from django.conf import settings
+from django.utils import timezone
 
-from .validators import validate_file_size
+from .validators import validate_file_size, validate_image_dimensions
+from . import pricing
 
 # Create your models here.
 
+TOTAL_FIELD = models.DecimalField(max_digits=12, decimal_places=2)
+
 
 class Promotion(models.Model):
     title = models.CharField(max_length=50, verbose_name='Название', default=None)
@@ -43,6 +51,12 @@ class Product(models.Model):
                                 validators=[MinValueValidator(1)],
                                 verbose_name='Цена')
 
+    # Считаются в store.pricing при сохранении товара и при изменении акции
+    effective_price = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False,
+                                          db_index=True, verbose_name='Цена со скидкой')
+    price_with_tax = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False,
+                                         verbose_name='Цена с налогом')
+
     inventory = models.IntegerField(validators=[MinValueValidator(0)],
                                     verbose_name='Кол-во на складе')
 
@@ -53,17 +67,38 @@ class Product(models.Model):
     # promotion = models.ManyToManyField(Promotion, blank=True)
     promotion = models.ForeignKey(Promotion, on_delete=models.CASCADE, null=True, blank=True, verbose_name='Акции')
 
+    # Теги и лайки товара: prefetch_related одним запросом и фильтры вида tagged_items__tag__label
+    tagged_items = GenericRelation('tags.TaggedItem', related_query_name='product')
+    liked_items = GenericRelation('likes.LikedItem', related_query_name='product')
+    like_counter = GenericRelation('likes.LikeCounter', related_query_name='product')
+
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        pricing.apply_prices(self)
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'effective_price', 'price_with_tax'}
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = 'Товар'
         verbose_name_plural = 'Товары'
         ordering = ['title']
+        indexes = [
+            # Сортировка списка по умолчанию (id - для курсорной пагинации)
+            models.Index(fields=['title', 'id'], name='store_product_title_idx'),
+            # ?collection_id= с той же сортировкой и естественный ключ импорта
+            models.Index(fields=['collection', 'title'], name='store_product_coll_title_idx'),
+            models.Index(fields=['price'], name='store_product_price_idx'),
+            models.Index(fields=['last_update'], name='store_product_updated_idx'),
+        ]
 
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
-    image = models.ImageField(upload_to='store/images', validators=[validate_file_size])
+    image = models.ImageField(upload_to='store/images', validators=[validate_file_size, validate_image_dimensions])
+    # Начало sha256 содержимого - из него строятся имена уменьшенных вариантов (store.images)
+    content_hash = models.CharField(max_length=16, blank=True, db_index=True, editable=False)
 
 class Customer(models.Model):
     # Статусы покупателей
@@ -93,7 +128,19 @@ class Customer(models.Model):
         verbose_name_plural = 'Покупатели'
 
 
+class CartManager(models.Manager):
+    # Итоги корзины считаются одним агрегирующим запросом; цена со скидкой уже хранится в товаре
+    def with_totals(self):
+        return self.annotate(
+            total_price=Coalesce(Sum(F('items__quantity') * F('items__product__effective_price')),
+                                 Value(Decimal(0)), output_field=TOTAL_FIELD),
+            total_quantity=Coalesce(Sum('items__quantity'), Value(0)),
+            items_count=Count('items'),
+        )
+
+
 class Cart(models.Model):
+    objects = CartManager()
     id = models.UUIDField(primary_key=True, default=uuid4)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -102,7 +149,56 @@ class Cart(models.Model):
         verbose_name_plural = 'Корзины'
 
 
+class CartItemManager(models.Manager):
+    def with_line_totals(self):
+        return self.annotate(line_total=ExpressionWrapper(F('quantity') * F('product__effective_price'),
+                                                          output_field=TOTAL_FIELD))
+
+    def add(self, cart_id, quantities):
+        # Добавляет {product_id: кол-во} в корзину одним INSERT ... ON CONFLICT DO UPDATE,
+        # поэтому параллельные добавления одного товара не упираются в unique_together
+        connection = connections[router.db_for_write(self.model)]
+        if connection.vendor in ('sqlite', 'postgresql') and connection.features.can_return_columns_from_insert:
+            return self._upsert(connection, cart_id, quantities)
+
+        with transaction.atomic(using=connection.alias):
+            items = {item.product_id: item for item in self.select_for_update()
+                     .filter(cart_id=cart_id, product_id__in=quantities)}
+            self.filter(id__in=[item.id for item in items.values()]).update(
+                quantity=Case(*[When(product_id=product_id, then=F('quantity') + quantity)
+                                for product_id, quantity in quantities.items()])
+            )
+            self.bulk_create([self.model(cart_id=cart_id, product_id=product_id, quantity=quantity)
+                              for product_id, quantity in quantities.items() if product_id not in items])
+            return list(self.filter(cart_id=cart_id, product_id__in=quantities))
+
+    def _upsert(self, connection, cart_id, quantities):
+        meta = self.model._meta
+        quote = connection.ops.quote_name
+        table = quote(meta.db_table)
+        cart, product, quantity = (quote(meta.get_field(name).column)
+                                   for name in ('cart', 'product', 'quantity'))
+        cart_value = meta.get_field('cart').get_db_prep_value(cart_id, connection)
+
+        values = ', '.join(['(%s, %s, %s)'] * len(quantities))
+        params = []
+        for product_id, amount in quantities.items():
+            params += [cart_value, product_id, amount]
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} ({cart}, {product}, {quantity}) VALUES {values} '
+                f'ON CONFLICT ({cart}, {product}) DO UPDATE SET {quantity} = {table}.{quantity} + excluded.{quantity} '
+                f'RETURNING {quote(meta.pk.column)}, {product}, {quantity}',
+                params,
+            )
+            rows = cursor.fetchall()
+        return [self.model(id=pk, cart_id=cart_id, product_id=product_id, quantity=amount)
+                for pk, product_id, amount in rows]
+
+
 class CartItem(models.Model):
+    objects = CartItemManager()
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, verbose_name='Корзина',
                              related_name='items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name='Товар')
@@ -115,7 +211,36 @@ class CartItem(models.Model):
         unique_together = [['cart', 'product']]
 
 
+class InventoryReservation(models.Model):
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, verbose_name='Корзина',
+                             related_name='reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name='Товар',
+                                related_name='reservations')
+    quantity = models.PositiveIntegerField(verbose_name='Зарезервировано')
+    expires_at = models.DateTimeField(db_index=True, verbose_name='Резерв до')
+
+    class Meta:
+        verbose_name = 'Резерв товара'
+        verbose_name_plural = 'Резервы товаров'
+        unique_together = [['cart', 'product']]
+        indexes = [
+            # Сумма действующих резервов по товарам при оформлении заказа
+            models.Index(fields=['product', 'expires_at'], name='store_reserv_product_exp_idx'),
+        ]
+
+
+class OrderManager(models.Manager):
+    def with_totals(self):
+        return self.annotate(
+            total_price=Coalesce(Sum(F('items__quantity') * F('items__price')),
+                                 Value(Decimal(0)), output_field=TOTAL_FIELD),
+            items_count=Count('items'),
+        )
+
+
 class Order(models.Model):
+    objects = OrderManager()
+
     PAYMENT_STATUS_PENDING = 'P'
     PAYMENT_STATUS_COMPLETE = 'C'
     PAYMENT_STATUS_FAILED = 'F'
@@ -135,6 +260,11 @@ class Order(models.Model):
     class Meta:
         verbose_name = 'Заказ'
         verbose_name_plural = 'Заказы'
+        indexes = [
+            # Заказы покупателя и все заказы для сотрудника, новые сначала (keyset_ordering)
+            models.Index(fields=['customer', '-placed_at', '-id'], name='store_order_customer_idx'),
+            models.Index(fields=['-placed_at', '-id'], name='store_order_placed_at_idx'),
+        ]
 
 
 class OrderItem(models.Model):
@@ -162,4 +292,63 @@ class Review(models.Model):
 
     class Meta:
         verbose_name = 'Отзыв'
-        verbose_name_plural = 'Отзывы'
\ No newline at end of file
+        verbose_name_plural = 'Отзывы'
+        indexes = [
+            # Отзывы товара, новые сначала: список и последние отзывы в списке товаров
+            models.Index(fields=['product', '-date', '-id'], name='store_review_product_date_idx'),
+        ]
+
+class OutboxEvent(models.Model):
+    # Событие пишется в той же транзакции, что и изменение, и обрабатывается store.outbox.dispatch
+    topic = models.CharField(max_length=50, verbose_name='Тема')
+    payload = models.JSONField(default=dict, verbose_name='Данные')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создано')
+    # Раньше этого времени событие не берётся: аренда обработчика или пауза перед повтором
+    available_at = models.DateTimeField(default=timezone.now, verbose_name='Доступно с')
+    attempts = models.PositiveIntegerField(default=0, verbose_name='Попыток')
+    claimed_by = models.CharField(max_length=32, blank=True, verbose_name='Захвачено')
+    processed_at = models.DateTimeField(null=True, blank=True, verbose_name='Обработано')
+    error = models.TextField(blank=True, verbose_name='Ошибка')
+
+    class Meta:
+        verbose_name = 'Событие'
+        verbose_name_plural = 'События'
+        indexes = [
+            # Очередь необработанных событий; обработанные в индекс не попадают
+            models.Index(fields=['available_at', 'id'], condition=models.Q(processed_at__isnull=True),
+                         name='store_outbox_pending_idx'),
+        ]
+
+
+class CatalogImport(models.Model):
+    # Импорт каталога из POST /import_products/: состояние общее для всех процессов,
+    # выполняет обработчик outbox (manage.py dispatch_outbox)
+    STATE_PENDING = 'pending'
+    STATE_RUNNING = 'running'
+    STATE_DONE = 'done'
+    STATE_FAILED = 'failed'
+    STATE_CHOICES = [
+        (STATE_PENDING, 'Ожидает'),
+        (STATE_RUNNING, 'Выполняется'),
+        (STATE_DONE, 'Завершён'),
+        (STATE_FAILED, 'Ошибка'),
+    ]
+    path = models.CharField(max_length=255, verbose_name='Файл')
+    state = models.CharField(max_length=10, choices=STATE_CHOICES, default=STATE_PENDING, verbose_name='Состояние')
+    # True, пока импорт не завершён; ограничение не даёт запустить второй
+    is_active = models.BooleanField(default=True)
+    processed = models.PositiveIntegerField(default=0, verbose_name='Обработано')
+    created = models.PositiveIntegerField(default=0, verbose_name='Создано')
+    updated = models.PositiveIntegerField(default=0, verbose_name='Обновлено')
+    error = models.TextField(blank=True, verbose_name='Ошибка')
+    started_at = models.DateTimeField(auto_now_add=True, verbose_name='Запущен')
+    # Обновляется после каждой пачки: по нему видно, что выполняющий процесс жив
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Изменён')
+
+    class Meta:
+        verbose_name = 'Импорт каталога'
+        verbose_name_plural = 'Импорты каталога'
+        constraints = [
+            models.UniqueConstraint(fields=['is_active'], condition=models.Q(is_active=True),
+                                    name='store_catalog_import_single_active'),
+        ]
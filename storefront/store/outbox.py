@@ -0,0 +1,193 @@
+import time
+from datetime import timedelta
+from uuid import uuid4
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import OutboxEvent, Product
+from . import cache, search
+
+ORDER_CREATED = 'order.created'
+PAYMENT_STATUS_CHANGED = 'order.payment_status_changed'
+INVENTORY_CHANGED = 'inventory.changed'
+CATALOG_CHANGED = 'catalog.changed'
+CATALOG_IMPORT = 'catalog.import'
+
+# Тема -> функция от списка событий пачки; исключение - повтор всех событий этой темы в пачке
+handlers = {}
+
+
+def handler(topic):
+    def register(func):
+        handlers[topic] = func
+        return func
+    return register
+
+
+def get_setting(name, default):
+    return getattr(settings, f'STORE_OUTBOX_{name}', default)
+
+
+def record(topic, **payload):
+    # Вызывать внутри транзакции изменения: событие появится, только если она зафиксирована
+    return OutboxEvent.objects.create(topic=topic, payload=payload)
+
+
+def record_many(topic, payloads):
+    return OutboxEvent.objects.bulk_create([OutboxEvent(topic=topic, payload=payload) for payload in payloads])
+
+
+def get_pending(now):
+    return OutboxEvent.objects.filter(processed_at__isnull=True, available_at__lte=now,
+                                      attempts__lt=get_setting('MAX_ATTEMPTS', 5)).order_by('available_at', 'id')
+
+
+def claim(batch_size, token):
+    # Захват пачки: событие получает метку обработчика и аренду на LEASE секунд.
+    # Если обработчик упадёт, после аренды событие снова станет доступным
+    now = timezone.now()
+    claimed = {'claimed_by': token, 'available_at': now + timedelta(seconds=get_setting('LEASE', 60)),
+               'attempts': F('attempts') + 1}
+    connection = connections[router.db_for_write(OutboxEvent)]
+    if connection.features.has_select_for_update_skip_locked:
+        # Параллельные обработчики пропускают строки, уже заблокированные другими
+        with transaction.atomic(using=connection.alias):
+            ids = list(get_pending(now).select_for_update(skip_locked=True).values_list('id', flat=True)[:batch_size])
+            OutboxEvent.objects.filter(id__in=ids).update(**claimed)
+    else:
+        # SQLite: FOR UPDATE нет, но запись в БД идёт по одной - UPDATE с подзапросом атомарен
+        OutboxEvent.objects.filter(id__in=get_pending(now).values('id')[:batch_size]).update(**claimed)
+    return list(OutboxEvent.objects.filter(claimed_by=token).order_by('id'))
+
+
+def dispatch(batch_size=None):
+    # Обрабатывает одну пачку; возвращает статистику для dispatch_outbox
+    token = uuid4().hex
+    events = claim(batch_size or get_setting('BATCH_SIZE', 100), token)
+
+    by_topic = {}
+    for event in events:
+        by_topic.setdefault(event.topic, []).append(event)
+
+    processed, failed = [], []
+    for topic, topic_events in by_topic.items():
+        func = handlers.get(topic)
+        try:
+            if func is not None:
+                func(topic_events)
+        except Exception as error:
+            failed.extend((event, error) for event in topic_events)
+        else:
+            processed.extend(topic_events)
+
+    now = timezone.now()
+    OutboxEvent.objects.filter(id__in=[event.id for event in processed], claimed_by=token) \
+        .update(processed_at=now, claimed_by='', error='')
+    retry_delay = get_setting('RETRY_DELAY', 5)
+    for event, error in failed:
+        OutboxEvent.objects.filter(id=event.id, claimed_by=token).update(
+            claimed_by='', error=repr(error),
+            available_at=now + timedelta(seconds=retry_delay * 2 ** (event.attempts - 1)),
+        )
+
+    latencies = [(now - event.created_at).total_seconds() for event in processed]
+    return {
+        'claimed': len(events),
+        'processed': len(processed),
+        'failed': len(failed),
+        'latency_avg': sum(latencies) / len(latencies) if latencies else None,
+        'latency_max': max(latencies, default=None),
+    }
+
+
+def purge(batch_size=1000):
+    # Удаляет обработанные и брошенные (исчерпавшие попытки) события старше RETENTION секунд;
+    # брошенные иначе навсегда остаются в индексе очереди. Возвращает число удалённых
+    cutoff = timezone.now() - timedelta(seconds=get_setting('RETENTION', 7 * 24 * 60 * 60))
+    expired = OutboxEvent.objects.filter(
+        Q(processed_at__lt=cutoff) |
+        Q(processed_at__isnull=True, attempts__gte=get_setting('MAX_ATTEMPTS', 5), created_at__lt=cutoff)
+    )
+    deleted = 0
+    while True:
+        ids = list(expired.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += OutboxEvent.objects.filter(id__in=ids).delete()[0]
+
+
+def run(batch_size=None, interval=1.0, max_batches=None, idle_exit=False, progress=None):
+    # Цикл обработчика: пачки подряд, пока очередь не пуста, затем пауза interval.
+    # Раз в PURGE_INTERVAL секунд чистит старые события и истёкшие резервы корзин
+    from . import inventory
+    batches = 0
+    next_purge = time.monotonic()
+    while max_batches is None or batches < max_batches:
+        if time.monotonic() >= next_purge:
+            purge()
+            inventory.release_expired()
+            next_purge = time.monotonic() + get_setting('PURGE_INTERVAL', 60 * 60)
+        started = time.monotonic()
+        stats = dispatch(batch_size)
+        batches += 1
+        if stats['claimed']:
+            stats['rate'] = stats['claimed'] / max(time.monotonic() - started, 1e-6)
+            if progress is not None:
+                progress(stats)
+            continue
+        if idle_exit:
+            break
+        time.sleep(interval)
+    return batches
+
+
+@handler(INVENTORY_CHANGED)
+def invalidate_inventory(events):
+    product_ids = {product_id for event in events for product_id, _ in event.payload['items']}
+    cache.invalidate(cache.PRODUCTS, *product_ids)
+
+
+@handler(CATALOG_IMPORT)
+def run_catalog_imports(events):
+    # Импорт выполняется в процессе dispatch_outbox, а не в потоке веб-сервера
+    from . import importer
+    for event in events:
+        importer.run_import(event.payload['id'])
+
+
+@handler(CATALOG_CHANGED)
+def refresh_catalog(events):
+    # Повторная инвалидация кэша и индексация поиска идемпотентны - обработка догоняет
+    # изменения, чьи синхронные обработчики не отработали
+    ids = {'product': set(), 'collection': set(), 'promotion': set()}
+    for event in events:
+        ids[event.payload['model']].add(event.payload['id'])
+
+    products = Product.objects.filter(id__in=ids['product']) | \
+        Product.objects.filter(collection_id__in=ids['collection']) | \
+        Product.objects.filter(promotion_id__in=ids['promotion'])
+    products = list(products.only('id', 'title', 'description', 'collection_id'))
+    search.index_products(products)
+    for product_id in ids['product'] - {product.id for product in products}:
+        search.remove_product(product_id)
+
+    cache.invalidate(cache.PRODUCTS, *ids['product'], *[product.id for product in products])
+    cache.invalidate(cache.COLLECTIONS, *ids['collection'], *{product.collection_id for product in products})
+
+
+class AtomicWriteMixin:
+    # Изменение и события outbox из сигналов post_save/post_delete - одна транзакция
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            super().perform_create(serializer)
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            super().perform_update(serializer)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            super().perform_destroy(instance)
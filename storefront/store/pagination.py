@@ -1,5 +1,165 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import datetime
+import json
+from collections import OrderedDict
+
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
 
 class DefaultPagination(PageNumberPagination):
     page_size = 10
-    page_query_param = 'page'
\ No newline at end of file
+    page_query_param = 'page'
+
+
+class CursorEncoder(json.JSONEncoder):
+    # В отличие от DjangoJSONEncoder не обрезает микросекунды - иначе курсор по времени съедет
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.date, datetime.time)):
+            return o.isoformat()
+        return str(o)
+
+
+class KeysetPagination(BasePagination):
+    # Постраничный вывод без OFFSET и COUNT(*): курсор хранит значения полей
+    # сортировки последней строки, следующая страница - WHERE (поле, id) > курсор
+    page_size = 10
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Неверный курсор'
+
+    def get_ordering(self, queryset, view):
+        ordering = list(queryset.query.order_by) or list(getattr(view, 'keyset_ordering', None) or []) \
+            or list(queryset.model._meta.ordering)
+        ordering = [field for field in ordering if isinstance(field, str)]
+
+        # Добиваем сортировку по id, чтобы позиция была однозначной при одинаковых значениях
+        fields = [field.lstrip('-') for field in ordering]
+        if 'id' not in fields and 'pk' not in fields:
+            descending = ordering[0].startswith('-') if ordering else False
+            ordering.append('-id' if descending else 'id')
+        return [(field.lstrip('-'), field.startswith('-')) for field in ordering]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(queryset, view)
+        queryset = queryset.order_by(*[('-' if descending else '') + field
+                                       for field, descending in self.ordering])
+
+        self.count = self.get_count(queryset, request)
+
+        position, reverse = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.get_position_filter(position, reverse))
+        if reverse:
+            queryset = queryset.reverse()
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        has_next = has_more if not reverse else True
+        has_previous = position is not None if not reverse else has_more
+        self.next_position = self.get_position(results[-1]) if results and has_next else None
+        self.previous_position = self.get_position(results[0]) if results and has_previous else None
+        return results
+
+    def get_position_filter(self, position, reverse):
+        condition = Q()
+        equal = Q()
+        for (field, descending), value in zip(self.ordering, position):
+            lookup = 'lt' if descending != reverse else 'gt'
+            condition |= equal & Q(**{f'{field}__{lookup}': value})
+            equal &= Q(**{field: value})
+        return condition
+
+    def get_position(self, instance):
+        position = []
+        for field, _ in self.ordering:
+            # Строка .values() из FastReadMixin - словарь с полями сортировки
+            if isinstance(instance, dict):
+                position.append(instance[field])
+                continue
+            value = instance
+            for attr in field.split('__'):
+                value = getattr(value, attr)
+            position.append(value)
+        return position
+
+    def encode_cursor(self, position, reverse):
+        data = json.dumps({'p': position, 'r': reverse}, cls=CursorEncoder)
+        cursor = base64.urlsafe_b64encode(data.encode()).decode()
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            position, reverse = data['p'], bool(data['r'])
+            if len(position) != len(self.ordering):
+                raise ValueError
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def get_count(self, queryset, request):
+        # ?count=exact - точный COUNT(*), ?count=approx - оценка планировщика там, где она есть
+        mode = request.query_params.get(self.count_query_param)
+        if mode == 'approx':
+            estimate = self.get_estimated_count(queryset)
+            if estimate is not None:
+                return estimate
+        if mode in ('exact', 'approx'):
+            return queryset.count()
+        return None
+
+    def get_estimated_count(self, queryset):
+        if connections[queryset.db].vendor != 'postgresql':
+            return None
+        plan = json.loads(queryset.order_by().explain(format='json'))
+        return plan[0]['Plan']['Plan Rows']
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position, False)
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(self.previous_position, True)
+
+    def get_paginated_response(self, data):
+        response = OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+        ])
+        if self.count is not None:
+            response['count'] = self.count
+        response['results'] = data
+        return Response(response)
+
+
+class SelectablePaginationMixin:
+    # ?pagination=cursor (или уже полученный курсор) переключает список на KeysetPagination
+    keyset_pagination_class = KeysetPagination
+    keyset_ordering = None
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params if self.request else {}
+            if params.get('pagination') == 'cursor' or KeysetPagination.cursor_query_param in params:
+                pagination_class = self.keyset_pagination_class
+            else:
+                pagination_class = self.pagination_class
+            self._paginator = pagination_class() if pagination_class else None
+        return self._paginator
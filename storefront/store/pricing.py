@@ -0,0 +1,43 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+
+CENT = Decimal('0.01')
+
+
+def get_tax_rate():
+    return Decimal(str(getattr(settings, 'STORE_TAX_RATE', '1.1')))
+
+
+def get_effective_price(price, promotion):
+    if promotion is None:
+        return Decimal(price).quantize(CENT, ROUND_HALF_UP)
+    multiplier = 1 - Decimal(str(promotion.discount))
+    return (Decimal(price) * multiplier).quantize(CENT, ROUND_HALF_UP)
+
+
+def get_price_with_tax(price):
+    return (Decimal(price) * get_tax_rate()).quantize(CENT, ROUND_HALF_UP)
+
+
+def apply_prices(product):
+    product.effective_price = get_effective_price(product.price, product.promotion)
+    product.price_with_tax = get_price_with_tax(product.price)
+
+
+def reprice(queryset, batch_size=1000):
+    # Пересчёт теми же функциями, что и при сохранении товара, и запись пачками bulk_update:
+    # округление ROUND_HALF_UP в одном месте, а не отдельно в SQL (на SQLite - через float)
+    products = queryset.select_related('promotion').only('id', 'price', 'promotion__discount').order_by('pk')
+    manager = queryset.model._base_manager.db_manager(queryset.db)
+    batch = []
+    count = 0
+    for product in products.iterator(chunk_size=batch_size):
+        apply_prices(product)
+        batch.append(product)
+        if len(batch) == batch_size:
+            count += manager.bulk_update(batch, ['effective_price', 'price_with_tax'])
+            batch = []
+    if batch:
+        count += manager.bulk_update(batch, ['effective_price', 'price_with_tax'])
+    return count
@@ -0,0 +1,254 @@
+import logging
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import Case, FloatField, IntegerField, When
+from django.db.models.expressions import RawSQL
+
+from .models import Product
+
+FTS_TABLE = 'store_product_fts'
+POSTGRES_CONFIG = 'simple'
+# Сколько лучших совпадений отдаёт запасной индекс в памяти
+FALLBACK_LIMIT = 1000
+# Совпадение в названии весит больше, чем в описании
+TITLE_WEIGHT = 10
+
+WORD_RE = re.compile(r'\w+')
+
+logger = logging.getLogger(__name__)
+
+
+def tokenize(text):
+    return WORD_RE.findall((text or '').lower())
+
+
+def get_connection():
+    return connections[router.db_for_write(Product)]
+
+
+_backends = {}
+
+
+def get_backend(connection=None):
+    connection = connection or get_connection()
+    if connection.alias not in _backends:
+        if connection.vendor == 'postgresql':
+            _backends[connection.alias] = PostgresBackend
+        elif connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names():
+            _backends[connection.alias] = SqliteBackend
+        else:
+            if not settings.DEBUG:
+                logger.warning('Полнотекстовый поиск в БД недоступен: индекс в памяти процесса '
+                               'подходит только для разработки')
+            _backends[connection.alias] = MemoryBackend
+    return _backends[connection.alias]
+
+
+def search(queryset, text):
+    terms = tokenize(text)
+    if not terms:
+        return queryset
+    return get_backend(connections[queryset.db]).search(queryset, terms)
+
+
+def index_product(product):
+    get_backend().index(product)
+
+
+def index_products(products):
+    get_backend().index_many(products)
+
+
+def remove_product(product_id):
+    get_backend().remove(product_id)
+
+
+def rebuild():
+    get_backend().rebuild()
+
+
+class SqliteBackend:
+    # FTS5 с rowid = id товара; запрос - AND всех слов, последнее слово - префикс
+
+    @staticmethod
+    def build_query(terms):
+        words = [f'"{term}"' for term in terms]
+        words[-1] += '*'
+        return ' '.join(words)
+
+    @classmethod
+    def search(cls, queryset, terms):
+        # Ранг - аннотация, а не extra(select=...): по ней фильтрует курсорная пагинация
+        table = queryset.model._meta.db_table
+        return queryset.annotate(
+            search_rank=RawSQL(f'bm25({FTS_TABLE}, {TITLE_WEIGHT}, 1)', [], output_field=FloatField()),
+        ).extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = {table}.id', f'{FTS_TABLE} MATCH %s'],
+            params=[cls.build_query(terms)],
+        ).order_by('search_rank', 'id')
+
+    @classmethod
+    def index(cls, product):
+        cls.index_many([product])
+
+    @staticmethod
+    def index_many(products):
+        with get_connection().cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                               [[product.id] for product in products])
+            cursor.executemany(f'INSERT INTO {FTS_TABLE} (rowid, title, description) VALUES (%s, %s, %s)',
+                               [[product.id, product.title, product.description or '']
+                                for product in products])
+
+    @staticmethod
+    def remove(product_id):
+        with get_connection().cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+
+    @staticmethod
+    def rebuild():
+        with get_connection().cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(f"INSERT INTO {FTS_TABLE} (rowid, title, description) "
+                           f"SELECT id, title, COALESCE(description, '') FROM {Product._meta.db_table}")
+
+
+class PostgresBackend:
+    # GIN-индекс по выражению get_vector(), поэтому отдельно индексировать ничего не нужно
+
+    @staticmethod
+    def get_vector():
+        from django.contrib.postgres.search import SearchVector
+        return SearchVector('title', config=POSTGRES_CONFIG, weight='A') + \
+            SearchVector('description', config=POSTGRES_CONFIG, weight='D')
+
+    @classmethod
+    def search(cls, queryset, terms):
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+        query = SearchQuery(' & '.join(f'{term}:*' for term in terms),
+                            config=POSTGRES_CONFIG, search_type='raw')
+        vector = cls.get_vector()
+        return queryset.annotate(search_vector=vector, search_rank=SearchRank(vector, query)) \
+            .filter(search_vector=query).order_by('-search_rank', 'id')
+
+    @staticmethod
+    def index(product):
+        pass
+
+    @staticmethod
+    def index_many(products):
+        pass
+
+    @staticmethod
+    def remove(product_id):
+        pass
+
+    @staticmethod
+    def rebuild():
+        pass
+
+
+class MemoryBackend:
+    # Запасной инвертированный индекс в памяти процесса для БД без полнотекстового поиска -
+    # только для тестов и разработки. У каждого процесса своя копия: изменения товаров из
+    # других процессов и bulk-операции в ней не видны до перезапуска
+    lock = threading.Lock()
+    postings = None
+    documents = None
+    vocabulary = None
+
+    @classmethod
+    def ensure_loaded(cls):
+        if cls.postings is None:
+            cls.rebuild()
+
+    @classmethod
+    def rebuild(cls):
+        with cls.lock:
+            cls.postings = defaultdict(dict)
+            cls.documents = {}
+            for product_id, title, description in Product.objects.values_list('id', 'title', 'description'):
+                cls._add(product_id, title, description)
+            cls.vocabulary = None
+
+    @classmethod
+    def _add(cls, product_id, title, description):
+        tokens = [(token, TITLE_WEIGHT) for token in tokenize(title)] + \
+            [(token, 1) for token in tokenize(description)]
+        cls.documents[product_id] = {token for token, _ in tokens}
+        for token, weight in tokens:
+            frequencies = cls.postings[token]
+            frequencies[product_id] = frequencies.get(product_id, 0) + weight
+
+    @classmethod
+    def _remove(cls, product_id):
+        for token in cls.documents.pop(product_id, ()):
+            cls.postings[token].pop(product_id, None)
+            if not cls.postings[token]:
+                del cls.postings[token]
+
+    @classmethod
+    def index(cls, product):
+        if cls.postings is None:
+            return
+        with cls.lock:
+            cls._remove(product.id)
+            cls._add(product.id, product.title, product.description)
+            cls.vocabulary = None
+
+    @classmethod
+    def index_many(cls, products):
+        for product in products:
+            cls.index(product)
+
+    @classmethod
+    def remove(cls, product_id):
+        if cls.postings is None:
+            return
+        with cls.lock:
+            cls._remove(product_id)
+            cls.vocabulary = None
+
+    @classmethod
+    def expand(cls, prefix):
+        if cls.vocabulary is None:
+            cls.vocabulary = sorted(cls.postings)
+        start = bisect_left(cls.vocabulary, prefix)
+        words = []
+        for word in cls.vocabulary[start:]:
+            if not word.startswith(prefix):
+                break
+            words.append(word)
+        return words
+
+    @classmethod
+    def rank(cls, terms):
+        cls.ensure_loaded()
+        with cls.lock:
+            scores = None
+            for index, term in enumerate(terms):
+                words = cls.expand(term) if index == len(terms) - 1 else [term]
+                term_scores = defaultdict(int)
+                for word in words:
+                    for product_id, frequency in cls.postings.get(word, {}).items():
+                        term_scores[product_id] += frequency
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {product_id: score + term_scores[product_id]
+                              for product_id, score in scores.items() if product_id in term_scores}
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [product_id for product_id, _ in ranked[:FALLBACK_LIMIT]]
+
+    @classmethod
+    def search(cls, queryset, terms):
+        product_ids = cls.rank(terms)
+        order = Case(*[When(id=product_id, then=position) for position, product_id in enumerate(product_ids)],
+                     default=len(product_ids), output_field=IntegerField())
+        return queryset.filter(id__in=product_ids).annotate(search_rank=order).order_by('search_rank')
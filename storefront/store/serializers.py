@@ -1,8 +1,10 @@
 from rest_framework import serializers
 from .models import Product, Collection, Review, CartItem, Cart, Customer, Order, OrderItem, ProductImage, Promotion
-from decimal import Decimal
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.db import transaction
 from .signals import order_created
+from . import events, fast, images, inventory, outbox
+from .fast import FastSerializer
 
 from tags.models import Tag, TaggedItem
 from likes.models import LikedItem
@@ -34,44 +36,73 @@ class ReviewSerializer(serializers.ModelSerializer):
         return Review.objects.create(product_id=product_id, customer_id=customer_id, **validated_data)
 
 class ProductImageSerializer(serializers.ModelSerializer):
+    variants = serializers.SerializerMethodField()
+
+    def get_variants(self, product_image):
+        return images.variant_urls(images.get_storage())(product_image.content_hash, self.context)
+
+    def validate_image(self, image):
+        return images.strip_metadata(image)
+
     def create(self, validated_data):
         product_id = self.context['product_id']
         return ProductImage.objects.create(product_id=product_id, **validated_data)
 
     class Meta:
         model = ProductImage
-        fields = ['id', 'image']
+        fields = ['id', 'image', 'variants']
+
+class ImageFileField(serializers.ImageField):
+    # ImageField DRF бросает django ValidationError, и ListField теряет номер файла с ошибкой
+    def to_internal_value(self, data):
+        try:
+            return super().to_internal_value(data)
+        except DjangoValidationError as error:
+            raise serializers.ValidationError(error.messages)
+
+
+class AddProductImagesSerializer(serializers.Serializer):
+    # Пакетная загрузка: файлы проверяются и перекодируются по одному, сохраняются одной транзакцией
+    images = serializers.ListField(
+        child=ImageFileField(validators=ProductImage._meta.get_field('image').validators),
+        allow_empty=False,
+    )
+
+    def validate_images(self, files):
+        return [images.strip_metadata(file) for file in files]
+
+    def save(self, **kwargs):
+        with transaction.atomic():
+            return [ProductImage.objects.create(product_id=self.context['product_id'], image=file)
+                    for file in self.validated_data['images']]
+
 
 class ProductSerializer(serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
     class Meta:
         model = Product
         fields = ['id', 'title', 'price', 'price_with_discount', 'price_with_tax', 'description',
-                  'slug', 'inventory', 'images', 'collection', 'promotion', 'reviews']
+                  'slug', 'inventory', 'images', 'collection', 'promotion', 'reviews_count', 'reviews',
+                  'tags', 'like_count']
+
+    # Ожидает prefetch tagged_items__tag с сортировкой по метке и аннотации из ProductViewSet.
+    # is_liked зависит от пользователя - его добавляет ProductViewSet.personalize поверх кэша
+    tags = serializers.SerializerMethodField()
+    like_count = serializers.IntegerField(read_only=True)
+
+    def get_tags(self, product):
+        return [tagged_item.tag.label for tagged_item in product.tagged_items.all()]
 
-    price_with_tax = serializers.SerializerMethodField(method_name='calculate_tax')
-    price_with_discount = serializers.SerializerMethodField(method_name='calculate_discount')
+    price_with_tax = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    price_with_discount = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True,
+                                                   source='effective_price')
     collection = CollectionSerializer()
     reviews = ReviewSerializer(many=True)
+    reviews_count = serializers.IntegerField(read_only=True)
     promotion = PromotionSerializer()
     # price = serializers.SerializerMethodField(method_name='price_with_discount')
     # price_without_discount = serializers.SerializerMethodField(method_name='get_price_without_discount')
 
-
-
-    # def get_price_without_discount(self, product):
-    #     return product.price
-    def calculate_discount(self, product):
-        if product.promotion:
-            price = float(product.price)
-            discount = product.promotion.discount
-            # return round(float(product.price) - (float(product.price) * product.promotion.discount))
-            return price - (price * discount)
-        return product.price
-
-    def calculate_tax(self, product):
-        return round(product.price * Decimal(1.1), 2)
-
     def create(self, validated_data):
         product = Product(**validated_data)
         product.other = 1
@@ -90,22 +121,8 @@ class SimpleProductSerializer(serializers.ModelSerializer):
 
     promotion = PromotionSerializer()
 
-    price_with_discount = serializers.SerializerMethodField(method_name='calculate_discount')
-
-
-    def calculate_discount(self, product):
-        if product.promotion:
-            # return round(float(product.price) - (float(product.price) * product.promotion.discount))
-            price = float(product.price)
-            discount = product.promotion.discount
-            return price - (price * discount)
-        return product.price
-
-    #
-    # def price_with_discount(self, product):
-    #     if product.promotion:
-    #         return round(float(product.price) - (float(product.price) * product.promotion.discount))
-    #     return product.price
+    price_with_discount = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True,
+                                                   source='effective_price')
 
 
 class CartItemSerializer(serializers.ModelSerializer):
@@ -113,11 +130,9 @@ class CartItemSerializer(serializers.ModelSerializer):
     total_price = serializers.SerializerMethodField(method_name='get_total_price')
 
     def get_total_price(self, cart_item: CartItem):
-        if cart_item.product.promotion:
-            price = float(cart_item.product.price)
-            discount = cart_item.product.promotion.discount
-            return cart_item.quantity * (price - price * discount)
-        return cart_item.quantity * cart_item.product.price
+        if hasattr(cart_item, 'line_total'):
+            return cart_item.line_total
+        return cart_item.quantity * cart_item.product.effective_price
 
     class Meta:
         model = CartItem
@@ -130,23 +145,26 @@ class CartSerializer(serializers.ModelSerializer):
     total_price = serializers.SerializerMethodField(method_name='get_total_price')
 
     def get_total_price(self, cart: Cart):
+        # Без аннотации with_totals() (например, только что созданная корзина) считаем по строкам
+        if hasattr(cart, 'total_price'):
+            return cart.total_price
+        return sum(item.quantity * item.product.effective_price for item in cart.items.all())
 
-        # return sum(item.quantity * item.product.price for item in cart.items.all())
 
-        lst = []
-        for item in cart.items.all():
-            if item.product.promotion:
-                price = float(item.product.price)
-                discount = item.product.promotion.discount
-                lst.append(float(price - price * discount) * float(item.quantity))
-            else:
-                lst.append(float(item.product.price))
-        return sum(lst)
+    class Meta:
+        model = Cart
+        fields = ['id', 'total_price', 'items']
 
 
+class CartSummarySerializer(serializers.ModelSerializer):
+    id = serializers.UUIDField(read_only=True)
+    total_price = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    total_quantity = serializers.IntegerField(read_only=True)
+    items_count = serializers.IntegerField(read_only=True)
+
     class Meta:
         model = Cart
-        fields = ['id', 'total_price', 'items']
+        fields = ['id', 'total_price', 'total_quantity', 'items_count']
 
 
 class AddCartItemSerializer(serializers.ModelSerializer):
@@ -165,35 +183,50 @@ class AddCartItemSerializer(serializers.ModelSerializer):
         if quantity == 0:
             raise serializers.ValidationError('Нельзя добавить 0 товаров')
 
-        try:
-            cart_item = CartItem.objects.get(cart_id=cart_id, product_id=product_id)
+        with transaction.atomic():
+            self.instance, = CartItem.objects.add(cart_id, {product_id: quantity})
 
-            if (cart_item.quantity + quantity) < 0:
-                cart_item.quantity = 0
-            else:
-                cart_item.quantity += quantity
+            if not inventory.reserve(cart_id, product_id, self.instance.quantity):
+                raise serializers.ValidationError('Недостаточно товаров на складе')
 
-            cart_item.save()
+        return self.instance
 
-            # if cart_item.quantity <= 0:
-            #     cart_item.delete()
+    class Meta:
+        model = CartItem
+        fields = ['id', 'product_id', 'quantity']
 
-            self.instance = cart_item
 
-        except:
-            if self.validated_data['quantity'] < 0:
-                self.validated_data['quantity'] = 0
-            cart_item = CartItem.objects.create(cart_id=cart_id, **self.validated_data)
+class CartItemInputSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
 
-            # if cart_item.quantity <= 0:
-            #     cart_item.delete()
-            self.instance = cart_item
 
-        return self.instance
+class AddCartItemsSerializer(serializers.Serializer):
+    items = CartItemInputSerializer(many=True, allow_empty=False)
 
-    class Meta:
-        model = CartItem
-        fields = ['id', 'product_id', 'quantity']
+    def validate_items(self, items):
+        quantities = {}
+        for item in items:
+            quantities[item['product_id']] = quantities.get(item['product_id'], 0) + item['quantity']
+
+        found = set(Product.objects.filter(pk__in=quantities).values_list('id', flat=True))
+        missing = [product_id for product_id in quantities if product_id not in found]
+        if missing:
+            raise serializers.ValidationError(f'Нет товаров с id: {", ".join(map(str, missing))}')
+        return quantities
+
+    def save(self, **kwargs):
+        cart_id = self.context['cart_id']
+        quantities = self.validated_data['items']
+
+        with transaction.atomic():
+            cart_items = CartItem.objects.add(cart_id, quantities)
+
+            for cart_item in cart_items:
+                if not inventory.reserve(cart_id, cart_item.product_id, cart_item.quantity):
+                    raise serializers.ValidationError(f'Недостаточно товаров на складе: {cart_item.product_id}')
+
+        return cart_items
 
 
 class UpdateCartSerializer(serializers.ModelSerializer):
@@ -240,6 +273,8 @@ class OrderSerializer(serializers.ModelSerializer):
 
 
     def get_total_price(self, order):
+        if hasattr(order, 'total_price'):
+            return order.total_price
         return sum(item.quantity * item.price for item in order.items.all())
 
 
@@ -247,7 +282,101 @@ class OrderSerializer(serializers.ModelSerializer):
         model = Order
         fields = ['id', 'customer', 'placed_at', 'payment_status', 'total_price', 'items']
 
+
+class OrderSummarySerializer(serializers.ModelSerializer):
+    total_price = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    items_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ['id', 'placed_at', 'payment_status', 'total_price', 'items_count']
+
+# Быстрые сериализаторы только для чтения (store.fast): тот же JSON, что у классов выше
+
+class FastPromotionSerializer(FastSerializer):
+    fields = ['id', 'title', 'description', 'discount']
+
+
+class FastCollectionSerializer(FastSerializer):
+    fields = ['id', 'title', 'product_count']
+    optional = ['product_count']
+
+
+class FastReviewSerializer(FastSerializer):
+    fields = ['id', 'name', 'date', 'description']
+    converters = {'date': fast.as_date}
+
+
+class FastProductImageSerializer(FastSerializer):
+    fields = ['id', 'image', 'variants']
+    sources = {'variants': 'content_hash'}
+    converters = {'image': fast.file_url(images.get_storage()),
+                  'variants': images.variant_urls(images.get_storage())}
+
+
+class FastProductSerializer(FastSerializer):
+    fields = ['id', 'title', 'price', 'price_with_discount', 'price_with_tax', 'description',
+              'slug', 'inventory', 'images', 'collection', 'promotion', 'reviews_count', 'reviews',
+              'tags', 'like_count']
+    sources = {'price_with_discount': 'effective_price'}
+    nested = {'collection': FastCollectionSerializer, 'promotion': FastPromotionSerializer}
+    many = {'images': FastProductImageSerializer, 'reviews': FastReviewSerializer}
+    # Теги заполняются в to_representation одним запросом на всю страницу
+    computed = {'tags': lambda data: []}
+    optional = ['reviews_count', 'like_count']
+
+    def to_representation(self, rows, queryset):
+        data = super().to_representation(rows, queryset)
+        tags = TaggedItem.objects.get_tags_for_many(Product, [item['id'] for item in data])
+        for item in data:
+            item['tags'] = tags[item['id']]
+        return data
+
+
+class FastSimpleProductSerializer(FastSerializer):
+    fields = ['id', 'title', 'price', 'price_with_discount', 'inventory', 'promotion']
+    sources = {'price_with_discount': 'effective_price'}
+    nested = {'promotion': FastPromotionSerializer}
+
+
+class FastCartItemSerializer(FastSerializer):
+    # Ожидает queryset с CartItem.objects.with_line_totals()
+    fields = ['id', 'product', 'quantity', 'total_price']
+    sources = {'total_price': 'line_total'}
+    nested = {'product': FastSimpleProductSerializer}
+
+
+class FastCartSerializer(FastSerializer):
+    # Ожидает queryset с Cart.objects.with_totals()
+    fields = ['id', 'total_price', 'items']
+    converters = {'id': fast.as_string}
+    many = {'items': FastCartItemSerializer}
+
+
+class FastOrderItemSerializer(FastSerializer):
+    fields = ['id', 'product', 'quantity', 'price', 'total_price']
+    nested = {'product': FastSimpleProductSerializer}
+    computed = {'total_price': lambda item: item['quantity'] * item['price']}
+
+
+class FastOrderSerializer(FastSerializer):
+    # Ожидает queryset с Order.objects.with_totals()
+    fields = ['id', 'customer', 'placed_at', 'payment_status', 'total_price', 'items']
+    sources = {'customer': 'customer_id'}
+    converters = {'placed_at': fast.as_datetime}
+    many = {'items': FastOrderItemSerializer}
+
+
 class UpdateOrderSerializer(serializers.ModelSerializer):
+    def update(self, instance, validated_data):
+        with transaction.atomic():
+            old_status = instance.payment_status
+            order = super().update(instance, validated_data)
+            if order.payment_status != old_status:
+                outbox.record(outbox.PAYMENT_STATUS_CHANGED, order_id=order.id,
+                              old=old_status, new=order.payment_status)
+            return order
+
     class Meta:
         model = Order
         fields = ['payment_status']
@@ -264,41 +393,38 @@ class CreateOrderSerializer(serializers.ModelSerializer):
     def save(self, **kwargs):
         with transaction.atomic():
             cart_id = self.validated_data['cart_id']
-            customer = Customer.objects.get(user_id=self.context['user_id'])
-            order = Order.objects.create(customer=customer)
+            customer = self.context['customer']
+            if not customer:
+                raise serializers.ValidationError('Покупатель не найден')
 
-            cart_items = CartItem.objects.select_related('product').filter(cart_id=cart_id)
+            quantities = dict(CartItem.objects.filter(cart_id=cart_id)
+                              .values_list('product_id', 'quantity'))
+            products = inventory.lock_products(quantities)
+            available = inventory.get_available(products, exclude_cart_id=cart_id)
 
             error_items = ''
-            for item in cart_items:
-                if item.quantity > item.product.inventory:
-                    error_items += f'{item}({item.quantity-item.product.inventory}), '
+            for product in products:
+                if quantities[product.id] > available[product.id]:
+                    error_items += f'{product}({quantities[product.id] - available[product.id]}), '
 
             if error_items != '':
                 raise serializers.ValidationError(f'Недостаточно товаров на складе: {error_items}')
 
-            # with open('lol.txt', mode='a', encoding='UTF-8') as data:
-            #     data.write(f'{item}({item.quantity - item.product.inventory})\n')
-
-
-
-
-            for item in cart_items:
-                if item.product.promotion:
-                    price = float(item.product.price) - (float(item.product.price) * item.product.promotion.discount)
-                else:
-                    price = float(item.product.price)
-                OrderItem.objects.create(order=order, product=item.product,
-                                         quantity=item.quantity, price=price)
+            order = Order.objects.create(customer=customer)
 
-                product = Product.objects.get(id=item.product.id)
-                product.inventory -= item.quantity
-                product.save()
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=product, quantity=quantities[product.id],
+                          price=product.effective_price)
+                for product in products
+            ])
 
+            if not inventory.decrement_inventory(quantities):
+                raise serializers.ValidationError('Недостаточно товаров на складе')
 
             Cart.objects.filter(pk=cart_id).delete()
 
-            order_created.send_robust(self.__class__, order=order)
+            outbox.record(outbox.ORDER_CREATED, order_id=order.id, customer_id=customer.id)
+            events.send(order_created, self.__class__, order=order)
             return order
 
     class Meta:
@@ -318,7 +444,8 @@ class LikedItemSerializer(serializers.ModelSerializer):
 
     def save(self, **kwargs):
         request = self.context['request']
-        liked_item = LikedItem.objects.create(user=request.user, **self.validated_data)
+        # Повторный лайк возвращает существующий вместо ошибки уникальности
+        liked_item, created = LikedItem.objects.get_or_create(user_id=request.user.id, **self.validated_data)
 
         return liked_item
 
@@ -1,3 +1,5 @@
 from django.dispatch import Signal
 
-order_created = Signal()
\ No newline at end of file
+order_created = Signal()
+# Аргумент image_id; получатели вызываются через store.events после коммита
+product_image_saved = Signal()
\ No newline at end of file
@@ -1,9 +1,122 @@
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch import receiver
-from store.models import Customer
+from django.utils import timezone
+from store.models import Customer, Product, ProductImage, Review, Promotion, Collection
+from store import cache, events, images, outbox, pricing, search
+from store.signals import product_image_saved
+from store.middleware import forget_customer
+from likes import counters
+from likes.models import LikedItem
+from tags.models import TaggedItem
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_customer_for_new_user(sender, **kwargs):
     if kwargs['created']:
-        Customer.objects.create(user=kwargs['instance'])
\ No newline at end of file
+        Customer.objects.create(user=kwargs['instance'])
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product(sender, instance, **kwargs):
+    cache.invalidate(cache.PRODUCTS, instance.pk)
+    cache.invalidate(cache.COLLECTIONS, instance.collection_id)
+
+
+@receiver([post_save, post_delete], sender=Customer)
+def forget_cached_customer(sender, instance, **kwargs):
+    forget_customer(instance.user_id)
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    search.index_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_index(sender, instance, **kwargs):
+    search.remove_product(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=ProductImage)
+@receiver([post_save, post_delete], sender=Review)
+def invalidate_product_children(sender, instance, **kwargs):
+    # Картинки и отзывы входят в ответ товара - для сортировки по last_update он изменился
+    Product.objects.filter(pk=instance.product_id).update(last_update=timezone.now())
+    cache.invalidate(cache.PRODUCTS, instance.product_id)
+
+
+@receiver(post_save, sender=Promotion)
+def reprice_promotion_products(sender, instance, **kwargs):
+    pricing.reprice(Product.objects.filter(promotion=instance))
+
+
+@receiver([post_save, post_delete], sender=Promotion)
+def invalidate_promotion(sender, instance, **kwargs):
+    product_ids = Product.objects.filter(promotion=instance).values_list('id', flat=True)
+    cache.invalidate(cache.PRODUCTS, *product_ids)
+
+
+@receiver([post_save, post_delete], sender=Collection)
+def invalidate_collection(sender, instance, **kwargs):
+    product_ids = Product.objects.filter(collection=instance).values_list('id', flat=True)
+    cache.invalidate(cache.COLLECTIONS, instance.pk)
+    cache.invalidate(cache.PRODUCTS, *product_ids)
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Collection)
+@receiver([post_save, post_delete], sender=Promotion)
+def record_catalog_change(sender, instance, **kwargs):
+    outbox.record(outbox.CATALOG_CHANGED, model=sender._meta.model_name, id=instance.pk)
+
+
+@receiver([post_save, post_delete], sender=TaggedItem)
+@receiver([post_save, post_delete], sender=LikedItem)
+def invalidate_product_relations(sender, instance, **kwargs):
+    # Теги входят в ответ товара и списка. Лайк меняет только like_count товара: списки
+    # с его счётчиком сбросятся при записи пачки счётчиков, is_liked в кэш не попадает
+    if instance.content_type_id != ContentType.objects.get_for_model(Product).id:
+        return
+    if sender is TaggedItem:
+        Product.objects.filter(pk=instance.object_id).update(last_update=timezone.now())
+        cache.invalidate(cache.PRODUCTS, instance.object_id)
+    else:
+        cache.invalidate(cache.PRODUCTS, instance.object_id, lists=False)
+
+
+def invalidate_like_counts(keys):
+    # Счётчики пишутся пачкой позже самого лайка - сбрасываем кэш товаров ещё раз, вместе
+    # со списками (like_count и сортировка по нему). Пачка пишется не чаще LIKES_COUNTER_FLUSH_INTERVAL,
+    # так что списки сбрасываются раз за пачку, а не на каждый лайк
+    product_type_id = ContentType.objects.get_for_model(Product).id
+    product_ids = [object_id for content_type_id, object_id in keys if content_type_id == product_type_id]
+    if product_ids:
+        cache.invalidate(cache.PRODUCTS, *product_ids)
+
+
+counters.flush_listeners.append(invalidate_like_counts)
+
+
+@receiver(pre_save, sender=ProductImage)
+def hash_product_image(sender, instance, **kwargs):
+    # Новый файл ещё не сохранён в хранилище (_committed = False) - считаем хэш при загрузке
+    if instance.image and not instance.image._committed:
+        instance.content_hash = images.hash_file(instance.image)
+
+
+@receiver(post_save, sender=ProductImage)
+def schedule_image_variants(sender, instance, **kwargs):
+    if instance.content_hash:
+        events.send(product_image_saved, sender, image_id=instance.pk)
+
+
+@receiver(post_delete, sender=ProductImage)
+def delete_image_variants(sender, instance, **kwargs):
+    content_hash = instance.content_hash
+    if content_hash:
+        transaction.on_commit(lambda: images.delete_variants(content_hash))
+
+
+product_image_saved.connect(images.generate_variants, dispatch_uid='store.images.generate_variants')
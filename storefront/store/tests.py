@@ -1,3 +1,1413 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.dispatch import Signal
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from PIL import Image
+from rest_framework.test import APIClient, APITestCase
+
+from core.models import User
+from likes import counters
+from likes.models import LikeCounter, LikedItem
+from tags.models import Tag, TaggedItem
+from . import cache, events, images, importer, inventory, outbox, pagination, pricing, search, uploads, views
+from .models import Cart, CartItem, CatalogImport, Collection, InventoryReservation, Order, OrderItem, \
+    OutboxEvent, Product, ProductImage, Promotion, Review
+from .signals import order_created
+
+
+def create_product(collection, promotion=None, reviews=0, images=0):
+    product = Product.objects.create(title='Товар', price=100, inventory=10,
+                                     collection=collection, promotion=promotion)
+    Review.objects.bulk_create([
+        Review(product=product, name='Имя', description='Отзыв') for _ in range(reviews)
+    ])
+    ProductImage.objects.bulk_create([
+        ProductImage(product=product, image='store/images/test.png') for _ in range(images)
+    ])
+    return product
+
+
+def add_tags(product, *labels):
+    for label in labels:
+        TaggedItem.objects.create(tag=Tag.objects.get_or_create(label=label)[0], content_object=product)
+
+
+NO_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                            'LOCATION': 'store-tests'}}
+
+
+@override_settings(CACHES=NO_CACHE)
+class ProductQueryCountTest(APITestCase):
+    def setUp(self):
+        self.collection = Collection.objects.create(title='Категория')
+        self.promotion = Promotion.objects.create(title='Акция', discount=0.1)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_list_query_count_does_not_depend_on_page_size(self):
+        create_product(self.collection, self.promotion, reviews=1, images=1)
+        small_page = self.count_queries('/products/')
+
+        for _ in range(15):
+            create_product(self.collection, self.promotion, reviews=3, images=2)
+        full_page = self.count_queries('/products/')
+
+        self.assertEqual(small_page, full_page)
+
+    def test_list_limits_reviews_per_product(self):
+        create_product(self.collection, reviews=8)
+
+        response = self.client.get('/products/')
+
+        product = response.data['results'][0]
+        self.assertEqual(product['reviews_count'], 8)
+        self.assertEqual(len(product['reviews']), 5)
+
+    def test_detail_query_count_does_not_depend_on_reviews(self):
+        product = create_product(self.collection, self.promotion, reviews=1, images=1)
+        few_reviews = self.count_queries(f'/products/{product.id}/')
+
+        create_product(self.collection, reviews=0)
+        Review.objects.bulk_create([
+            Review(product=product, name='Имя', description='Отзыв') for _ in range(20)
+        ])
+        many_reviews = self.count_queries(f'/products/{product.id}/')
+
+        self.assertEqual(few_reviews, many_reviews)
+
+
+@override_settings(CACHES=NO_CACHE)
+class CheckoutTest(APITestCase):
+    def setUp(self):
+        self.collection = Collection.objects.create(title='Категория')
+        self.promotion = Promotion.objects.create(title='Акция', discount=0.5)
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com',
+                                             password='password')
+        self.client.force_authenticate(self.user)
+
+    def create_cart(self, size, quantity=2):
+        cart = Cart.objects.create()
+        for index in range(size):
+            product = create_product(self.collection, self.promotion if index % 2 else None)
+            CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+        return cart
+
+    def checkout(self, cart):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post('/orders/', {'cart_id': str(cart.id)})
+        return response, len(context.captured_queries)
+
+    def test_checkout_query_count_does_not_depend_on_cart_size(self):
+        _, small_cart = self.checkout(self.create_cart(2))
+        _, large_cart = self.checkout(self.create_cart(30))
+
+        self.assertEqual(small_cart, large_cart)
+
+    def test_checkout_decrements_inventory_and_keeps_last_update(self):
+        cart = self.create_cart(2, quantity=3)
+        products = list(Product.objects.order_by('id'))
+
+        response, _ = self.checkout(cart)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(Cart.objects.filter(pk=cart.pk).exists())
+        for product in products:
+            refreshed = Product.objects.get(pk=product.pk)
+            self.assertEqual(refreshed.inventory, 7)
+            self.assertEqual(refreshed.last_update, product.last_update)
+        prices = sorted(item.price for item in OrderItem.objects.all())
+        self.assertEqual(prices, [Decimal('50'), Decimal('100')])
+
+    def test_checkout_rejects_cart_exceeding_inventory(self):
+        cart = self.create_cart(1, quantity=11)
+
+        response, _ = self.checkout(cart)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Product.objects.get().inventory, 10)
+        self.assertFalse(Order.objects.exists())
+
+
+class ConcurrentCheckoutTest(TransactionTestCase):
+    buyers = 12
+    inventory = 5
+
+    def setUp(self):
+        collection = Collection.objects.create(title='Категория')
+        self.product = Product.objects.create(title='Хит', price=100, inventory=self.inventory,
+                                              collection=collection)
+        self.users = []
+        self.carts = []
+        for index in range(self.buyers):
+            self.users.append(User.objects.create_user(username=f'buyer{index}',
+                                                       email=f'buyer{index}@example.com'))
+            cart = Cart.objects.create()
+            CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+            self.carts.append(cart)
+
+    def test_concurrent_checkouts_do_not_oversell(self):
+        barrier = threading.Barrier(self.buyers)
+        statuses = []
+        latencies = []
+
+        def checkout(user, cart):
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                barrier.wait()
+                started = time.perf_counter()
+                response = client.post('/orders/', {'cart_id': str(cart.id)})
+                latencies.append(time.perf_counter() - started)
+                statuses.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=args)
+                   for args in zip(self.users, self.carts)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(statuses.count(201), self.inventory, statuses)
+        self.assertEqual(statuses.count(400), self.buyers - self.inventory)
+        self.assertEqual(Product.objects.get().inventory, 0)
+        self.assertEqual(Order.objects.count(), self.inventory)
+        latencies.sort()
+        self.assertLess(latencies[int(len(latencies) * 0.99)], 5)
+
+
+@override_settings(STORE_CART_RESERVATION_TIMEOUT=60)
+class CartReservationTest(APITestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Категория')
+        self.product = Product.objects.create(title='Хит', price=100, inventory=3,
+                                              collection=collection)
+
+    def add_item(self, cart, quantity):
+        return self.client.post(f'/carts/{cart.id}/items/',
+                                {'product_id': self.product.id, 'quantity': quantity})
+
+    def test_reserved_items_are_not_available_to_other_carts(self):
+        first, second = Cart.objects.create(), Cart.objects.create()
+
+        self.assertEqual(self.add_item(first, 2).status_code, 201)
+        self.assertEqual(self.add_item(second, 2).status_code, 400)
+        self.assertEqual(self.add_item(second, 1).status_code, 201)
+
+    def test_deleting_cart_item_releases_reservation(self):
+        first, second = Cart.objects.create(), Cart.objects.create()
+        self.add_item(first, 3)
+        item = CartItem.objects.get(cart=first)
+
+        self.client.delete(f'/carts/{first.id}/items/{item.id}/')
+
+        self.assertEqual(self.add_item(second, 3).status_code, 201)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ProductCacheTest(APITestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.collection = Collection.objects.create(title='Категория')
+        self.product = create_product(self.collection, reviews=1)
+        self.url = f'/products/{self.product.id}/'
+
+    def count_queries(self, url, **headers):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, **headers)
+        return response, len(context.captured_queries)
+
+    def test_repeated_requests_are_served_from_cache(self):
+        for url in [self.url, '/products/', '/collections/']:
+            self.count_queries(url)
+            response, queries = self.count_queries(url)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(queries, 0)
+
+    def test_review_invalidates_product_detail_and_list(self):
+        self.client.get(self.url)
+        self.client.get('/products/')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(product=self.product, name='Имя', description='Новый')
+
+        self.assertEqual(self.client.get(self.url).data['reviews_count'], 2)
+        self.assertEqual(self.client.get('/products/').data['results'][0]['reviews_count'], 2)
+
+    def test_promotion_change_invalidates_its_products(self):
+        promotion = Promotion.objects.create(title='Акция', discount=0.1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.product.pk).update(promotion=promotion)
+            cache.invalidate(cache.PRODUCTS, self.product.pk)
+        self.client.get(self.url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            promotion.discount = 0.5
+            promotion.save()
+
+        self.assertEqual(self.client.get(self.url).data['promotion']['discount'], 0.5)
+
+    def test_checkout_invalidates_inventory(self):
+        self.client.get(self.url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.decrement_inventory({self.product.id: 4})
+
+        self.assertEqual(self.client.get(self.url).data['inventory'], 6)
+
+    @override_settings(STORE_RESPONSE_VERSION_TIMEOUT=300)
+    def test_version_keys_expire(self):
+        response_cache = caches['default']
+        with mock.patch.object(response_cache, 'add', wraps=response_cache.add) as cache_add:
+            self.assertEqual(self.client.get('/products/999999/').status_code, 404)
+        cache_add.assert_called_once_with(cache.version_key(cache.PRODUCTS, '999999'), mock.ANY, timeout=300)
+
+    def test_conditional_requests_get_not_modified(self):
+        response = self.client.get(self.url)
+
+        by_etag, queries = self.count_queries(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+        self.assertEqual(by_etag.status_code, 304)
+        self.assertEqual(queries, 0)
+        self.assertNotIn('Last-Modified', response)
+
+    def test_bulk_update_is_not_hidden_by_if_modified_since(self):
+        response = self.client.get(self.url)
+        since = http_date(time.time() + 60)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.decrement_inventory({self.product.id: 4})
+
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=since).data['inventory'], 6)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    @override_settings(ALLOWED_HOSTS=['internal.example', 'public.example'])
+    def test_absolute_urls_are_cached_per_host(self):
+        for index in range(10):
+            create_product(self.collection)
+        internal = self.client.get('/products/', HTTP_HOST='internal.example')
+        public = self.client.get('/products/', HTTP_HOST='public.example', secure=True)
+        self.assertTrue(internal.data['next'].startswith('http://internal.example/'))
+        self.assertTrue(public.data['next'].startswith('https://public.example/'))
+
+    def test_json_stream_format(self):
+        # Непостраничный список идёт потоком мимо кэша, постраничный кэшируется как обычно
+        for url in ['/collections/', '/products/']:
+            expected = self.client.get(url).content
+            for _ in range(2):
+                response = self.client.get(url, {'format': 'json-stream'})
+                self.assertEqual(response.status_code, 200)
+                content = b''.join(response.streaming_content) if response.streaming else response.content
+                self.assertEqual(json.loads(content), json.loads(expected))
+
+
+@override_settings(CACHES=NO_CACHE)
+class KeysetPaginationTest(APITestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Категория')
+        # Одинаковые цены, чтобы проверить добивку сортировки по id
+        for index in range(25):
+            Product.objects.create(title=f'Товар {index:02}', price=100 + index % 3,
+                                   inventory=10, collection=collection)
+
+    def walk(self, url):
+        ids = []
+        while url:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(any('__count' in query['sql'] for query in context.captured_queries))
+            ids += [product['id'] for product in response.data['results']]
+            url = response.data['next']
+        return ids, response
+
+    def test_pages_follow_ordering_with_ties(self):
+        ids, _ = self.walk('/products/?pagination=cursor&ordering=-price')
+
+        expected = list(Product.objects.order_by('-price', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_previous_link_returns_previous_page(self):
+        first = self.client.get('/products/?pagination=cursor').data
+        second = self.client.get(first['next']).data
+
+        previous = self.client.get(second['previous']).data
+
+        self.assertEqual(previous['results'], first['results'])
+        self.assertIsNone(first['previous'])
+
+    def test_count_is_optional(self):
+        response = self.client.get('/products/?pagination=cursor')
+        counted = self.client.get('/products/?pagination=cursor&count=exact')
+
+        self.assertNotIn('count', response.data)
+        self.assertEqual(counted.data['count'], 25)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/products/?cursor=garbage')
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_page_number_pagination_is_still_default(self):
+        response = self.client.get('/products/')
+
+        self.assertEqual(response.data['count'], 25)
+
+
+@override_settings(CACHES=NO_CACHE)
+class ProductSearchTest(APITestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Категория')
+        self.phone = Product.objects.create(title='Смартфон Samsung', description='Телефон, смартфон',
+                                            price=100, inventory=1, collection=collection)
+        self.laptop = Product.objects.create(title='Ноутбук', description='Samsung, 16GB',
+                                             price=200, inventory=1, collection=collection)
+        self.tv = Product.objects.create(title='Телевизор LG', price=300, inventory=1,
+                                         collection=collection)
+
+    def search(self, text):
+        response = self.client.get('/products/', {'search': text})
+        return [product['id'] for product in response.data['results']]
+
+    def test_search_ranks_by_relevance(self):
+        self.assertEqual(self.search('samsung смартфон'), [self.phone.id])
+        self.assertEqual(self.search('samsung'), [self.phone.id, self.laptop.id])
+
+    def test_last_word_matches_prefix(self):
+        self.assertEqual(self.search('телеви'), [self.tv.id])
+
+    def test_index_follows_product_changes(self):
+        self.tv.title = 'Телевизор Samsung'
+        self.tv.save()
+        self.laptop.delete()
+
+        self.assertIn(self.tv.id, self.search('samsung'))
+        self.assertNotIn(self.laptop.id, self.search('samsung'))
+
+    def test_cursor_pagination(self):
+        for index in range(3):
+            Product.objects.create(title=f'Samsung {index}', price=10, inventory=1,
+                                   collection=self.phone.collection)
+        with mock.patch.object(pagination.KeysetPagination, 'page_size', 3):
+            first = self.client.get('/products/', {'search': 'samsung', 'pagination': 'cursor'}).data
+            second = self.client.get(first['next']).data
+        ids = [product['id'] for product in first['results'] + second['results']]
+        self.assertEqual(len(ids), 5)
+        self.assertEqual(len(set(ids)), 5)
+        self.assertIsNone(second['next'])
+
+    def test_memory_backend(self):
+        search.MemoryBackend.rebuild()
+        queryset = Product.objects.all()
+
+        found = search.MemoryBackend.search(queryset, search.tokenize('samsung тел'))
+
+        self.assertEqual([product.id for product in found], [self.phone.id])
+
+
+@override_settings(CACHES=NO_CACHE)
+class CatalogImportTest(APITestCase):
+    catalog = {
+        'Телефоны': [
+            {'Наименование товара': 'Смартфон', 'Цена товара': 100,
+             'Характеристики': {'Экран': {'Диагональ': '6"', 'Тип': 'OLED'}}},
+            {'Наименование товара': 'Кнопочный', 'Цена товара': 20, 'Характеристики': {}},
+        ],
+        'Пустая': [],
+        'Ноутбуки': [
+            {'Наименование товара': 'Ноутбук', 'Цена товара': 500.5,
+             'Характеристики': {'Память': {'ОЗУ': 16}}},
+        ],
+    }
+
+    def run_import(self, catalog, **kwargs):
+        file = io.StringIO(json.dumps(catalog, ensure_ascii=False, indent=2))
+        # Маленький кусок чтения, чтобы значения резались на границах
+        reader = importer.CatalogReader(file, chunk_size=7)
+        return list(reader), importer.import_catalog(
+            io.StringIO(json.dumps(catalog, ensure_ascii=False)), **kwargs)
+
+    def test_reader_streams_all_products(self):
+        items, _ = self.run_import(self.catalog)
+
+        self.assertEqual([(collection, item['Наименование товара']) for collection, item in items],
+                         [('Телефоны', 'Смартфон'), ('Телефоны', 'Кнопочный'), ('Ноутбуки', 'Ноутбук')])
+
+    def test_import_is_idempotent(self):
+        _, first = self.run_import(self.catalog, batch_size=2)
+        self.catalog['Телефоны'][0]['Цена товара'] = 150
+        _, second = self.run_import(self.catalog, batch_size=2)
+
+        self.assertEqual((first['created'], first['updated']), (3, 0))
+        self.assertEqual((second['created'], second['updated']), (0, 3))
+        self.assertEqual(Product.objects.count(), 3)
+        self.assertEqual(Collection.objects.count(), 2)
+        phone = Product.objects.get(title='Смартфон')
+        self.assertEqual(phone.price, 150)
+        self.assertEqual(phone.description, 'Экран:\n\tДиагональ: 6"\n\tТип: OLED\n')
+        self.assertEqual(self.client.get('/products/', {'search': 'смарт'}).data['count'], 1)
+
+    def test_import_command_defaults_to_import_file(self):
+        path = os.path.join(tempfile.mkdtemp(), 'catalog.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, 'w', encoding='UTF-8') as file:
+            json.dump(self.catalog, file, ensure_ascii=False)
+
+        out = io.StringIO()
+        with self.settings(STORE_IMPORT_FILE=path):
+            call_command('import_products', stdout=out)
+        self.assertIn('Импорт завершён: 3 товаров', out.getvalue())
+
+    def test_import_endpoint_runs_through_outbox(self):
+        path = os.path.join(tempfile.mkdtemp(), 'catalog.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, 'w', encoding='UTF-8') as file:
+            json.dump(self.catalog, file, ensure_ascii=False)
+        self.client.force_authenticate(User.objects.create_user(
+            username='admin', email='admin@example.com', is_staff=True))
+
+        with self.settings(STORE_IMPORT_FILE=path):
+            self.assertEqual(self.client.post('/import_products/').data, {
+                'state': 'pending', 'processed': 0, 'created': 0, 'updated': 0})
+            # Блокировка в БД: второй импорт не запускается, пока первый не завершён
+            self.assertEqual(self.client.post('/import_products/').status_code, 409)
+
+            outbox.dispatch()
+            self.assertEqual(self.client.get('/import_products/').data, {
+                'state': 'done', 'processed': 3, 'created': 3, 'updated': 0})
+            self.assertEqual(self.client.post('/import_products/').status_code, 202)
+
+            # Импорт, который давно не двигается, считается прерванным
+            CatalogImport.objects.filter(is_active=True).update(state=CatalogImport.STATE_RUNNING,
+                                         updated_at=timezone.now() - timedelta(hours=1))
+            self.assertEqual(self.client.post('/import_products/').status_code, 202)
+            self.assertEqual(CatalogImport.objects.filter(state=CatalogImport.STATE_FAILED).count(), 1)
+
+
+@override_settings(CACHES=NO_CACHE)
+class PricingTest(APITestCase):
+    def setUp(self):
+        self.collection = Collection.objects.create(title='Категория')
+        self.promotion = Promotion.objects.create(title='Акция', discount=0.25)
+        self.cheap = Product.objects.create(title='Дешёвый', price=Decimal('99.99'), inventory=1,
+                                            collection=self.collection, promotion=self.promotion)
+        self.expensive = Product.objects.create(title='Дорогой', price=120, inventory=1,
+                                                collection=self.collection)
+
+    def test_prices_are_stored_on_save(self):
+        self.assertEqual(self.cheap.effective_price, Decimal('74.99'))
+        self.assertEqual(self.cheap.price_with_tax, Decimal('109.99'))
+        self.assertEqual(self.expensive.effective_price, Decimal('120.00'))
+
+    def test_promotion_change_reprices_in_bulk(self):
+        self.promotion.discount = 0.5
+        self.promotion.save()
+
+        self.cheap.refresh_from_db()
+        self.assertEqual(self.cheap.effective_price, Decimal('50.00'))
+
+    def test_bulk_reprice_rounds_like_save(self):
+        # Половина копейки округляется вверх одинаково при сохранении и при пересчёте пачкой
+        promotion = Promotion.objects.create(title='Скидка', discount=0.07)
+        prices = [Decimal('0.05'), Decimal('0.15'), Decimal('1.05'), Decimal('2.35'), Decimal('10.45'),
+                  Decimal('99.95'), Decimal('0.5'), Decimal('12.5')]
+        for price in prices:
+            Product.objects.create(title=f'Товар {price}', price=price, inventory=1,
+                                   collection=self.collection, promotion=promotion)
+        Product.objects.update(effective_price=0, price_with_tax=0)
+
+        self.assertEqual(pricing.reprice(Product.objects.all()), len(prices) + 2)
+        for product in Product.objects.select_related('promotion'):
+            self.assertEqual((product.effective_price, product.price_with_tax),
+                             (pricing.get_effective_price(product.price, product.promotion),
+                              pricing.get_price_with_tax(product.price)), product.price)
+
+    def test_filter_and_order_by_effective_price(self):
+        Product.objects.filter(pk=self.expensive.pk).update(promotion=self.promotion)
+        pricing.reprice(Product.objects.filter(pk=self.expensive.pk))
+
+        ordered = self.client.get('/products/', {'ordering': '-effective_price'}).data['results']
+        filtered = self.client.get('/products/', {'effective_price__lt': 80}).data['results']
+
+        self.assertEqual([product['price_with_discount'] for product in ordered],
+                         [Decimal('90.00'), Decimal('74.99')])
+        self.assertEqual([product['id'] for product in filtered], [self.cheap.id])
+
+
+@override_settings(CACHES=NO_CACHE)
+class CartTotalsTest(APITestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Категория')
+        promotion = Promotion.objects.create(title='Акция', discount=0.1)
+        self.cart = Cart.objects.create()
+        for index, price in enumerate(['10.10', '0.35', '99.99']):
+            product = Product.objects.create(title=f'Товар {index}', price=Decimal(price), inventory=100,
+                                             collection=collection, promotion=promotion if index else None)
+            CartItem.objects.create(cart=self.cart, product=product, quantity=index + 2)
+
+    def test_retrieve_totals_are_exact(self):
+        response = self.client.get(f'/carts/{self.cart.id}/')
+
+        # 2 * 10.10 + 3 * 0.32 + 4 * 89.99
+        self.assertEqual(response.data['total_price'], Decimal('381.12'))
+        self.assertEqual([item['total_price'] for item in response.data['items']],
+                         [Decimal('20.20'), Decimal('0.96'), Decimal('359.96')])
+
+    def test_summary_is_a_single_query(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f'/carts/{self.cart.id}/summary/')
+
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertEqual(response.data, {'id': str(self.cart.id), 'total_price': Decimal('381.12'),
+                                         'total_quantity': 9, 'items_count': 3})
+
+    def test_empty_cart_summary(self):
+        cart = Cart.objects.create()
+
+        response = self.client.get(f'/carts/{cart.id}/summary/')
+
+        self.assertEqual(response.data['total_price'], Decimal('0'))
+        self.assertEqual(response.data['items_count'], 0)
+
+
+@override_settings(CACHES=NO_CACHE)
+class AddToCartTest(APITestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Категория')
+        self.products = [create_product(collection) for _ in range(3)]
+        self.cart = Cart.objects.create()
+        self.url = f'/carts/{self.cart.id}/items/'
+
+    def test_add_is_an_upsert(self):
+        with CaptureQueriesContext(connection) as context:
+            first = self.client.post(self.url, {'product_id': self.products[0].id, 'quantity': 2})
+        # Проверка товара и сам upsert, без учёта SAVEPOINT
+        queries = [query for query in context.captured_queries if 'SAVEPOINT' not in query['sql']]
+        second = self.client.post(self.url, {'product_id': self.products[0].id, 'quantity': 3})
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.data, {'id': first.data['id'], 'product_id': self.products[0].id,
+                                       'quantity': 5})
+        self.assertEqual(CartItem.objects.get().quantity, 5)
+        self.assertEqual(len(queries), 2)
+
+    def test_unknown_product(self):
+        response = self.client.post(self.url, {'product_id': 0, 'quantity': 1})
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_add(self):
+        CartItem.objects.create(cart=self.cart, product=self.products[0], quantity=1)
+        items = [{'product_id': product.id, 'quantity': 2} for product in self.products]
+        items.append({'product_id': self.products[1].id, 'quantity': 1})
+
+        response = self.client.post(f'{self.url}batch/', {'items': items}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        quantities = dict(CartItem.objects.values_list('product_id', 'quantity'))
+        self.assertEqual(quantities, {self.products[0].id: 3, self.products[1].id: 3,
+                                      self.products[2].id: 2})
+
+    def test_batch_rejects_unknown_products(self):
+        response = self.client.post(f'{self.url}batch/', {'items': [{'product_id': 0, 'quantity': 1}]},
+                                    format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(CartItem.objects.exists())
+
+
+@override_settings(CACHES=NO_CACHE)
+class OrderListTest(APITestCase):
+    def setUp(self):
+        self.collection = Collection.objects.create(title='Категория')
+        self.promotion = Promotion.objects.create(title='Акция', discount=0.1)
+        self.admin = User.objects.create_user(username='admin', email='admin@example.com', is_staff=True)
+        self.customer = User.objects.create_user(username='buyer', email='buyer@example.com').customer
+
+    def create_order(self, lines=3):
+        order = Order.objects.create(customer=self.customer)
+        for index in range(lines):
+            product = create_product(self.collection, self.promotion if index % 2 else None)
+            OrderItem.objects.create(order=order, product=product, quantity=index + 1, price=product.price)
+        return order
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, len(context.captured_queries)
+
+    def test_list_query_count_does_not_depend_on_orders(self):
+        self.client.force_authenticate(self.admin)
+        self.create_order(lines=2)
+        _, few = self.count_queries('/orders/')
+
+        for _ in range(5):
+            self.create_order()
+        response, many = self.count_queries('/orders/')
+
+        self.assertEqual(few, many)
+        self.assertEqual(response.data[-1]['total_price'], Decimal('600'))
+
+    def test_streamed_list(self):
+        self.client.force_authenticate(self.admin)
+        for lines in range(1, 6):
+            self.create_order(lines)
+        expected = self.client.get('/orders/').content
+
+        with mock.patch.object(views.OrderViewSet, 'stream_batch_size', 2):
+            response = self.client.get('/orders/?format=json-stream')
+        self.assertTrue(response.streaming)
+        self.assertEqual(b''.join(response.streaming_content), expected)
+
+    def test_summary_view(self):
+        self.client.force_authenticate(self.customer.user)
+        order = self.create_order()
+
+        response, queries = self.count_queries('/orders/?view=summary')
+
+        self.assertEqual(queries, 2)
+        self.assertEqual(dict(response.data[0]), {
+            'id': order.id, 'placed_at': response.data[0]['placed_at'],
+            'payment_status': 'P', 'total_price': Decimal('600'), 'items_count': 3,
+        })
+
+
+@override_settings(CACHES=NO_CACHE)
+class CustomerLookupTest(APITestCase):
+    def setUp(self):
+        self.product = create_product(Collection.objects.create(title='Категория'))
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com')
+        self.review = Review.objects.create(product=self.product, customer_id=self.user.customer.id,
+                                            name='Отзыв', description='Текст')
+        self.client.force_authenticate(self.user)
+
+    def count_customer_queries(self, method, url, **kwargs):
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url, **kwargs)
+        queries = [query['sql'] for query in context.captured_queries if 'store_customer' in query['sql']]
+        return response, len(queries)
+
+    def test_customer_resolved_once_per_request(self):
+        response, queries = self.count_customer_queries(
+            'put', f'/products/{self.product.id}/reviews/{self.review.id}/',
+            data={'name': 'Новое имя', 'description': 'Текст'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, 1)
+
+    @override_settings(CACHES=LOCMEM_CACHE, STORE_CUSTOMER_CACHE_TIMEOUT=60)
+    def test_shared_cache_is_dropped_on_save(self):
+        caches['default'].clear()
+        self.count_customer_queries('get', '/customers/me/')
+        response, queries = self.count_customer_queries('get', '/customers/me/')
+        self.assertEqual(queries, 0)
+
+        self.user.customer.phone = '123'
+        self.user.customer.save()
+        response, queries = self.count_customer_queries('get', '/customers/me/')
+        self.assertEqual(queries, 1)
+        self.assertEqual(response.data['phone'], '123')
+
+
+@override_settings(CACHES=NO_CACHE)
+class FastSerializerTest(APITestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Категория')
+        promotion = Promotion.objects.create(title='Акция', description='Описание', discount=0.15)
+        products = [create_product(collection, reviews=7, images=2),
+                    create_product(collection, promotion, reviews=1),
+                    create_product(collection, promotion)]
+        products[1].price = Decimal('99.99')
+        products[1].save()
+
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com', is_staff=True)
+        add_tags(products[0], 'б', 'а')
+        LikedItem.objects.create(user=self.user, content_object=products[1])
+        self.cart = Cart.objects.create()
+        CartItem.objects.add(self.cart.id, {products[0].id: 2, products[1].id: 3})
+        self.order = Order.objects.create(customer=self.user.customer)
+        for index, product in enumerate(products):
+            OrderItem.objects.create(order=self.order, product=product, quantity=index + 1,
+                                     price=product.effective_price)
+        self.client.force_authenticate(self.user)
+
+    def assertSameOutput(self, viewset, url):
+        fast = self.client.get(url)
+        with mock.patch.object(viewset, 'fast_serializer_class', None):
+            regular = self.client.get(url)
+        self.assertEqual(fast.status_code, regular.status_code)
+        self.assertEqual(fast.content, regular.content)
+        return fast
+
+    def test_products(self):
+        product = Product.objects.first()
+        self.assertSameOutput(views.ProductViewSet, '/products/')
+        self.assertSameOutput(views.ProductViewSet, '/products/?pagination=cursor&ordering=-price')
+        self.assertSameOutput(views.ProductViewSet, '/products/?search=товар')
+        self.assertSameOutput(views.ProductViewSet, f'/products/{product.id}/')
+        self.assertSameOutput(views.ProductViewSet, '/products/0/')
+
+    def test_collections(self):
+        self.assertSameOutput(views.CollectionViewSet, '/collections/')
+
+    def test_cart(self):
+        self.assertSameOutput(views.CartViewSet, f'/carts/{self.cart.id}/')
+        self.assertSameOutput(views.CartViewSet, '/carts/not-a-uuid/')
+        self.assertSameOutput(views.CartItemViewSet, f'/carts/{self.cart.id}/items/')
+
+    def test_orders(self):
+        response = self.assertSameOutput(views.OrderViewSet, '/orders/')
+        self.assertEqual(len(response.data[0]['items']), 3)
+        self.assertSameOutput(views.OrderViewSet, '/orders/?pagination=cursor')
+        self.assertSameOutput(views.OrderViewSet, f'/orders/{self.order.id}/')
+
+    def test_list_does_not_build_model_instances(self):
+        with mock.patch.object(Product, '__init__', side_effect=AssertionError):
+            response = self.client.get('/products/')
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(CACHES=NO_CACHE)
+class ExplainQueriesTest(APITestCase):
+    def test_endpoints_use_indexes(self):
+        collection = Collection.objects.create(title='Категория')
+        for _ in range(3):
+            create_product(collection, reviews=2, images=1)
+        user = User.objects.create_user(username='buyer', email='buyer@example.com')
+        order = Order.objects.create(customer=user.customer)
+        OrderItem.objects.create(order=order, product=Product.objects.first(), quantity=1, price=100)
+        CartItem.objects.add(Cart.objects.create().id, {Product.objects.first().id: 1})
+
+        out = io.StringIO()
+        call_command('explain_queries', '--fail-on-scan', stdout=out)
+        self.assertIn(f'/carts/{Cart.objects.get().id}/items/ [200]', out.getvalue())
+        self.assertIn('/orders/?pagination=cursor [200]', out.getvalue())
+
+    def test_scan_is_flagged(self):
+        from store.management.commands.explain_queries import explain
+        queryset = Product.objects.filter(inventory=0).order_by()
+        sql, params = queryset.query.sql_with_params()
+
+        _, scans = explain(connection, sql, params)
+        self.assertEqual(scans, ['store_product'])
+
+
+@override_settings(CACHES=NO_CACHE, STORE_EVENT_WORKERS=0)
+class OrderEventsTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com')
+        self.client.force_authenticate(self.user)
+        self.product = create_product(Collection.objects.create(title='Категория'))
+        self.received = []
+        receiver = lambda sender, order, **kwargs: self.received.append(order.id)
+        order_created.connect(receiver, weak=False)
+        self.addCleanup(order_created.disconnect, receiver)
+
+    def checkout(self, quantity):
+        cart = Cart.objects.create()
+        CartItem.objects.create(cart=cart, product=self.product, quantity=quantity)
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post('/orders/', {'cart_id': str(cart.id)})
+        return response, callbacks
+
+    def test_receivers_run_after_commit(self):
+        response, callbacks = self.checkout(1)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.received, [])
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.received, [response.data['id']])
+
+    def test_rolled_back_order_sends_nothing(self):
+        response, callbacks = self.checkout(11)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(callbacks, [])
+
+
+class EventDispatcherTest(SimpleTestCase):
+    def test_get_receivers(self):
+        signal = Signal()
+        calls = []
+        receiver = lambda sender, **kwargs: calls.append('sync')
+        signal.connect(receiver, weak=False)
+        self.assertEqual(events.get_receivers(signal, None), [receiver])
+
+        # Django 5.0+: пара (синхронные, асинхронные)
+        async def async_receiver(sender, **kwargs):
+            calls.append('async')
+
+        with mock.patch('django.VERSION', (5, 0, 0, 'final', 0)), \
+                mock.patch.object(signal, '_live_receivers', return_value=([receiver], [async_receiver])):
+            receivers = events.get_receivers(signal, None)
+        for item in receivers:
+            item(signal=signal, sender=None)
+        self.assertEqual(calls, ['sync', 'async'])
+
+    def test_retries_timeouts_and_metrics(self):
+        signal = Signal()
+        dispatcher = events.Dispatcher(workers=2, retries=2, timeout=0.1, retry_delay=0.01)
+        calls = {'flaky': 0, 'slow': 0}
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def flaky(sender, **kwargs):
+            calls['flaky'] += 1
+            if calls['flaky'] < 3:
+                raise ValueError('сбой')
+
+        def slow(sender, **kwargs):
+            calls['slow'] += 1
+            release.wait(0.3)
+
+        def broken(sender, **kwargs):
+            raise ValueError('сбой')
+
+        with self.assertLogs('store.events', 'WARNING') as logs:
+            for receiver in (flaky, slow, broken):
+                dispatcher.submit(events.Job(signal, receiver, None, {}))
+            dispatcher.join()
+
+        metrics = dispatcher.get_metrics()
+        # Вызов, превысивший таймаут, не повторяется, пока выполняется, и учитывается по завершении
+        self.assertEqual(calls, {'flaky': 3, 'slow': 1})
+        self.assertEqual(metrics['enqueued'], 3)
+        self.assertEqual(metrics['processed'], 2)
+        self.assertEqual(metrics['failed'], 1)
+        self.assertEqual(metrics['retried'], 4)
+        self.assertEqual(metrics['timed_out'], 1)
+        self.assertEqual(metrics['overdue'], 0)
+        self.assertEqual(metrics['queue_depth'], 0)
+        self.assertGreater(metrics['latency_max'], 0)
+        self.assertEqual(len(logs.records), 6)
+
+    def test_timeout_excludes_wait_in_pool(self):
+        # Один поток обработчика и два потока пула: вторая задача ждёт, пока пул занят
+        signal = Signal()
+        dispatcher = events.Dispatcher(workers=1, retries=0, timeout=0.2, retry_delay=0.01)
+        blockers = threading.Event()
+        self.addCleanup(blockers.set)
+        for _ in range(2):
+            dispatcher.executor.submit(blockers.wait, 0.3)
+        calls = []
+        dispatcher.submit(events.Job(signal, lambda sender, **kwargs: calls.append(time.sleep(0.1)), None, {}))
+        dispatcher.join()
+
+        metrics = dispatcher.get_metrics()
+        self.assertEqual((len(calls), metrics['processed'], metrics['timed_out']), (1, 1, 0))
+
+
+@override_settings(CACHES=NO_CACHE)
+class OutboxTest(APITestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(username='admin', email='admin@example.com', is_staff=True)
+        self.product = create_product(Collection.objects.create(title='Категория'))
+        OutboxEvent.objects.all().delete()
+
+    def topics(self):
+        return list(OutboxEvent.objects.order_by('id').values_list('topic', flat=True))
+
+    def test_business_changes_record_events(self):
+        self.client.force_authenticate(self.staff)
+        cart = Cart.objects.create()
+        CartItem.objects.create(cart=cart, product=self.product, quantity=2)
+        order_id = self.client.post('/orders/', {'cart_id': str(cart.id)}).data['id']
+        self.client.put(f'/orders/{order_id}/', {'payment_status': 'C'})
+        self.client.patch(f'/products/{self.product.id}/', {'price': 150})
+
+        self.assertEqual(self.topics(), [outbox.INVENTORY_CHANGED, outbox.ORDER_CREATED,
+                                         outbox.PAYMENT_STATUS_CHANGED, outbox.CATALOG_CHANGED])
+        events = list(OutboxEvent.objects.order_by('id').values_list('payload', flat=True))
+        self.assertEqual(events[0], {'items': [[self.product.id, -2]]})
+        self.assertEqual(events[2], {'order_id': order_id, 'old': 'P', 'new': 'C'})
+        self.assertEqual(events[3], {'model': 'product', 'id': self.product.id})
+
+    def test_rolled_back_checkout_records_nothing(self):
+        self.client.force_authenticate(self.staff)
+        cart = Cart.objects.create()
+        CartItem.objects.create(cart=cart, product=self.product, quantity=11)
+        self.assertEqual(self.client.post('/orders/', {'cart_id': str(cart.id)}).status_code, 400)
+        self.assertEqual(self.topics(), [])
+
+    def test_dispatch_in_batches_with_retries(self):
+        received = []
+
+        def flaky(events):
+            raise ValueError('сбой')
+
+        outbox.record_many('test.ok', [{'n': n} for n in range(5)])
+        outbox.record('test.flaky')
+        with mock.patch.dict(outbox.handlers, {'test.ok': lambda events: received.append(len(events)),
+                                               'test.flaky': flaky}):
+            first = outbox.dispatch(batch_size=4)
+            second = outbox.dispatch(batch_size=4)
+            third = outbox.dispatch(batch_size=4)
+
+        self.assertEqual(received, [4, 1])
+        self.assertEqual((first['processed'], second['processed'], second['failed']), (4, 1, 1))
+        self.assertEqual(third['claimed'], 0)
+        self.assertEqual(OutboxEvent.objects.filter(processed_at__isnull=True).count(), 1)
+        failed = OutboxEvent.objects.get(topic='test.flaky')
+        self.assertEqual((failed.attempts, failed.claimed_by), (1, ''))
+        self.assertIn('сбой', failed.error)
+        self.assertGreater(failed.available_at, failed.created_at)
+
+    def test_claimed_events_are_not_claimed_twice(self):
+        outbox.record_many('test.ok', [{'n': n} for n in range(3)])
+        first = outbox.claim(2, 'first')
+        second = outbox.claim(2, 'second')
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.assertFalse({event.id for event in first} & {event.id for event in second})
+
+    def test_purge(self):
+        old = timezone.now() - timedelta(days=30)
+        processed, dead, pending, recent = outbox.record_many('test.ok', [{'n': n} for n in range(4)])
+        OutboxEvent.objects.filter(id=processed.id).update(processed_at=old)
+        OutboxEvent.objects.filter(id=dead.id).update(created_at=old, attempts=5)
+        OutboxEvent.objects.filter(id=pending.id).update(created_at=old, attempts=1)
+        OutboxEvent.objects.filter(id=recent.id).update(processed_at=timezone.now())
+
+        with self.settings(STORE_OUTBOX_RETENTION=24 * 60 * 60):
+            self.assertEqual(outbox.purge(batch_size=1), 2)
+        self.assertEqual(set(OutboxEvent.objects.values_list('id', flat=True)), {pending.id, recent.id})
+
+    def test_run_releases_expired_reservations(self):
+        now = timezone.now()
+        expired, active = Cart.objects.create(), Cart.objects.create()
+        InventoryReservation.objects.create(cart=expired, product=self.product, quantity=1,
+                                            expires_at=now - timedelta(minutes=1))
+        InventoryReservation.objects.create(cart=active, product=self.product, quantity=1,
+                                            expires_at=now + timedelta(minutes=10))
+
+        outbox.run(idle_exit=True)
+        self.assertEqual(list(InventoryReservation.objects.values_list('cart_id', flat=True)), [active.id])
+
+    def test_dispatch_command(self):
+        outbox.record(outbox.CATALOG_CHANGED, model='product', id=self.product.id)
+        out = io.StringIO()
+        call_command('dispatch_outbox', '--once', stdout=out)
+        self.assertIn('Обработано: 1, ошибок: 0', out.getvalue())
+        self.assertFalse(OutboxEvent.objects.filter(processed_at__isnull=True).exists())
+
+
+def make_png(width=800, height=600, name='photo.png'):
+    output = io.BytesIO()
+    Image.new('RGBA', (width, height), (200, 30, 30, 128)).save(output, 'PNG')
+    return SimpleUploadedFile(name, output.getvalue(), content_type='image/png')
+
+
+def use_temp_media(test):
+    media_root = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, media_root)
+    storage = images.get_storage()
+    # Хранилище поля создано при импорте моделей - подменяем его каталог
+    patcher = mock.patch.object(storage, 'location', media_root)
+    patcher.start()
+    test.addCleanup(patcher.stop)
+    return storage
+
+
+@override_settings(CACHES=NO_CACHE, STORE_EVENT_WORKERS=0)
+class ImageVariantsTest(APITestCase):
+    def setUp(self):
+        self.storage = use_temp_media(self)
+        self.product = create_product(Collection.objects.create(title='Категория'))
+
+    def upload(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ProductImage.objects.create(product=self.product, image=make_png())
+
+    def test_variants_are_generated_after_upload(self):
+        product_image = self.upload()
+
+        self.assertEqual(len(product_image.content_hash), 16)
+        for variant, size in images.get_variants().items():
+            for extension in images.FORMATS:
+                name = images.variant_name(product_image.content_hash, variant, extension)
+                with self.storage.open(name) as file, Image.open(file) as image:
+                    self.assertEqual(image.format, images.FORMATS[extension])
+                    self.assertLessEqual(image.width, size[0])
+        with self.storage.open(images.variant_name(product_image.content_hash, 'thumbnail', 'webp')) as file:
+            self.assertEqual(Image.open(file).size, (150, 113))
+
+        response = self.client.get(f'/products/{self.product.id}/')
+        variants = response.data['images'][0]['variants']
+        self.assertEqual(set(variants), {'thumbnail', 'list', 'detail'})
+        self.assertTrue(variants['list']['webp'].endswith(
+            f'/media/store/images/variants/{product_image.content_hash}/list.'
+            f"{images.variant_fingerprint('list', 'webp')}.webp"))
+
+    def test_variant_settings_change_the_name(self):
+        product_image = self.upload()
+        name = images.variant_name(product_image.content_hash, 'list', 'webp')
+
+        with self.settings(STORE_IMAGE_QUALITY=50):
+            self.assertNotEqual(images.variant_name(product_image.content_hash, 'list', 'webp'), name)
+            # Старое имя не создаётся заново с новыми настройками
+            self.storage.delete(name)
+            self.assertEqual(self.client.get(f'/media/{name}').status_code, 404)
+        with self.settings(STORE_IMAGE_VARIANTS={**images.get_variants(), 'list': (300, 300)}):
+            resized = images.variant_name(product_image.content_hash, 'list', 'webp')
+            self.assertNotEqual(resized, name)
+            self.assertEqual(self.client.get(f'/media/{resized}').status_code, 200)
+            with self.storage.open(resized) as file:
+                self.assertEqual(Image.open(file).width, 300)
+
+    def test_concurrent_generation_keeps_fixed_names(self):
+        product_image = self.upload()
+        directory = os.path.dirname(self.storage.path(
+            images.variant_name(product_image.content_hash, 'list', 'webp')))
+        files = sorted(os.listdir(directory))
+        # Оба запроса увидели, что варианта нет, и записали его
+        with mock.patch.object(self.storage, 'exists', return_value=False):
+            images.generate(product_image)
+            images.generate(product_image)
+        self.assertEqual(sorted(os.listdir(directory)), files)
+        self.assertEqual(len(files), len(images.get_variants()) * len(images.FORMATS))
+
+    def test_variants_are_deleted_with_image(self):
+        product_image = self.upload()
+        duplicate = self.upload()
+        name = images.variant_name(product_image.content_hash, 'list', 'webp')
+
+        # Та же картинка у другой записи - варианты ещё нужны
+        with self.captureOnCommitCallbacks(execute=True):
+            duplicate.delete()
+        self.assertTrue(self.storage.exists(name))
+
+        # Вариант под прежними настройками тоже удаляется
+        with self.settings(STORE_IMAGE_QUALITY=50):
+            images.generate(product_image)
+        with self.captureOnCommitCallbacks(execute=True):
+            product_image.delete()
+        self.assertFalse(self.storage.exists(name))
+        self.assertFalse(os.path.exists(os.path.dirname(self.storage.path(name))))
+
+    def test_missing_variant_is_generated_on_request(self):
+        # Без выполнения on_commit фоновая генерация не запускается
+        product_image = ProductImage.objects.create(product=self.product, image=make_png())
+        name = images.variant_name(product_image.content_hash, 'list', 'jpeg')
+        self.assertFalse(self.storage.exists(name))
+
+        response = self.client.get(f'/media/{name}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertTrue(self.storage.exists(name))
+        self.assertFalse(self.storage.exists(images.variant_name(product_image.content_hash, 'list', 'webp')))
+
+        unknown = images.variant_name('0123456789abcdef', 'list', 'webp')
+        self.assertEqual(self.client.get(f'/media/{unknown}').status_code, 404)
+        self.assertEqual(self.client.get(f'/media/store/images/variants/{product_image.content_hash}/list.webp')
+                         .status_code, 404)
+        self.assertEqual(self.client.get(f'/media/store/images/variants/{product_image.content_hash}/'
+                                         f'huge.00000000.webp').status_code, 404)
+
+
+@override_settings(CACHES=NO_CACHE)
+class ImageUploadTest(APITestCase):
+    def setUp(self):
+        self.storage = use_temp_media(self)
+        self.product = create_product(Collection.objects.create(title='Категория'))
+        self.client.force_authenticate(User.objects.create_user(username='admin', email='admin@example.com',
+                                                                is_staff=True))
+        self.url = f'/products/{self.product.id}/images/'
+
+    def test_upload_strips_metadata(self):
+        exif = Image.Exif()
+        exif[0x010F] = 'Камера'
+        exif[0x0112] = 6
+        output = io.BytesIO()
+        Image.new('RGB', (40, 20), 'red').save(output, 'JPEG', exif=exif)
+
+        response = self.client.post(self.url, {'image': SimpleUploadedFile('photo.jpg', output.getvalue())},
+                                    format='multipart')
+        self.assertEqual(response.status_code, 201)
+        with ProductImage.objects.get().image.open('rb') as file, Image.open(file) as image:
+            self.assertEqual(image.size, (20, 40))
+            self.assertFalse(image.getexif())
+
+    def test_oversized_file_is_rejected_while_streaming(self):
+        received = []
+        receive = uploads.LimitedUploadHandler.receive_data_chunk
+
+        def count(handler, raw_data, start):
+            received.append(len(raw_data))
+            return receive(handler, raw_data, start)
+
+        data = SimpleUploadedFile('big.png', b'0' * 2 * 1024 * 1024)
+        with mock.patch.object(uploads.LimitedUploadHandler, 'receive_data_chunk', count):
+            response = self.client.post(self.url, {'image': data}, format='multipart')
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response.data['error'], 'Файл не может быть более 500KB!')
+        self.assertLess(sum(received), 600 * 1024)
+        self.assertFalse(ProductImage.objects.exists())
+
+    def test_limits_apply_only_to_product_images(self):
+        data = SimpleUploadedFile('big.png', b'0' * 2 * 1024 * 1024)
+        with mock.patch.object(uploads.LimitedUploadHandler, 'new_file') as new_file:
+            response = self.client.post('/collections/', {'title': 'Новая', 'file': data}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        new_file.assert_not_called()
+
+    @override_settings(STORE_IMAGE_MAX_PIXELS=10_000)
+    def test_dimensions_and_format_are_checked_before_decoding(self):
+        image = make_png(200, 100)
+        with mock.patch.object(Image.Image, 'load', side_effect=AssertionError):
+            response = self.client.post(self.url, {'image': image}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['image'], ['Изображение не может быть больше 10000 пикселей'])
+
+        output = io.BytesIO()
+        Image.new('RGB', (10, 10)).save(output, 'BMP')
+        response = self.client.post(self.url, {'image': SimpleUploadedFile('photo.bmp', output.getvalue())},
+                                    format='multipart')
+        self.assertEqual(response.data['image'], ['Формат BMP не поддерживается'])
+
+    def test_batch_upload(self):
+        files = [make_png(50, 50, f'photo{index}.png') for index in range(3)]
+        response = self.client.post(f'{self.url}batch/', {'images': files}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual(ProductImage.objects.filter(product=self.product).count(), 3)
+
+        files = [make_png(50, 50), SimpleUploadedFile('notes.png', b'not an image')]
+        response = self.client.post(f'{self.url}batch/', {'images': files}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.data['images']), [1])
+        self.assertEqual(ProductImage.objects.count(), 3)
+
+        with self.settings(STORE_UPLOAD_MAX_FILES=2):
+            files = [make_png(50, 50, f'photo{index}.png') for index in range(3)]
+            response = self.client.post(f'{self.url}batch/', {'images': files}, format='multipart')
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(ProductImage.objects.count(), 3)
+
+
+@override_settings(CACHES=NO_CACHE, LIKES_COUNTER_FLUSH_INTERVAL=0)
+class ProductTagsLikesTest(APITestCase):
+    def setUp(self):
+        self.collection = Collection.objects.create(title='Категория')
+        self.user = User.objects.create_user(username='buyer', email='buyer@example.com')
+        self.other = User.objects.create_user(username='other', email='other@example.com')
+
+    def create_products(self, count):
+        products = [create_product(self.collection) for _ in range(count)]
+        with self.captureOnCommitCallbacks(execute=True):
+            for product in products:
+                add_tags(product, 'новинка', 'акция')
+                LikedItem.objects.create(user=self.other, content_object=product)
+            LikedItem.objects.create(user=self.user, content_object=products[0])
+            # Лайк другого типа объекта с тем же id не считается
+            LikedItem.objects.like(self.user.id, self.collection)
+        return products
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, len(context.captured_queries)
+
+    def test_list_fields_and_query_count(self):
+        self.client.force_authenticate(self.user)
+        product = self.create_products(1)[0]
+        response, small_page = self.count_queries('/products/')
+        self.create_products(9)
+        _, full_page = self.count_queries('/products/')
+        self.assertEqual(small_page, full_page)
+
+        data = response.data['results'][0]
+        self.assertEqual(data['tags'], ['акция', 'новинка'])
+        self.assertEqual(data['like_count'], 2)
+        self.assertTrue(data['is_liked'])
+
+        self.client.force_authenticate(None)
+        data = self.client.get(f'/products/{product.id}/').data
+        self.assertEqual((data['like_count'], data['is_liked']), (2, False))
+
+    def test_batch_lookups(self):
+        products = self.create_products(3)
+        ids = [product.id for product in products] + [0]
+
+        with self.assertNumQueries(1):
+            tags = TaggedItem.objects.get_tags_for_many(Product, ids)
+        self.assertEqual(tags[products[0].id], ['акция', 'новинка'])
+        self.assertEqual(tags[0], [])
+
+        with self.assertNumQueries(1):
+            counts = LikedItem.objects.get_like_counts(Product, ids)
+        self.assertEqual(counts, {products[0].id: 2, products[1].id: 1, products[2].id: 1, 0: 0})
+        with self.assertNumQueries(1):
+            self.assertEqual(LikedItem.objects.get_liked_ids(self.user.id, Product, ids), {products[0].id})
+        self.assertEqual(LikedItem.objects.get_liked_ids(None, Product, ids), set())
+
+    @override_settings(CACHES=LOCMEM_CACHE)
+    def test_like_invalidates_cached_product(self):
+        caches['default'].clear()
+        product = create_product(self.collection)
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get(f'/products/{product.id}/').data['like_count'], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            LikedItem.objects.create(user=self.user, content_object=product)
+        data = self.client.get(f'/products/{product.id}/').data
+        self.assertEqual((data['like_count'], data['is_liked']), (1, True))
+
+        self.client.force_authenticate(self.other)
+        self.assertFalse(self.client.get(f'/products/{product.id}/').data['is_liked'])
+
+    @override_settings(CACHES=LOCMEM_CACHE, LIKES_COUNTER_FLUSH_INTERVAL=60)
+    def test_list_cache_is_shared_between_users(self):
+        caches['default'].clear()
+        # Счётчик остаётся в буфере: сам лайк списки не сбрасывает
+        self.addCleanup(counters.flush)
+        product = create_product(self.collection)
+        self.client.force_authenticate(self.user)
+        first = self.client.get('/products/')
+
+        # Общий ответ из кэша, для другого пользователя - только запрос его лайков
+        self.client.force_authenticate(self.other)
+        _, queries = self.count_queries('/products/')
+        self.assertEqual(queries, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            LikedItem.objects.like(self.other.id, product)
+        _, queries = self.count_queries('/products/')
+        self.assertEqual(queries, 1)
+        response = self.client.get('/products/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['results'][0]['is_liked'])
+
+        self.client.force_authenticate(self.user)
+        self.assertFalse(self.client.get('/products/').data['results'][0]['is_liked'])
+        self.assertEqual(self.client.get('/products/', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+
+@override_settings(CACHES=NO_CACHE, LIKES_COUNTER_FLUSH_INTERVAL=60)
+class LikeCountersTest(APITestCase):
+    def setUp(self):
+        self.collection = Collection.objects.create(title='Категория')
+        self.products = [create_product(self.collection) for _ in range(3)]
+        self.users = [User.objects.create_user(username=f'user{index}', email=f'user{index}@example.com')
+                      for index in range(3)]
+
+    def tearDown(self):
+        # Записать остаток буфера и остановить таймер, чтобы не задеть другие тесты
+        counters.flush()
+
+    def like(self, user, product, method='put'):
+        self.client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            return getattr(self.client, method)(f'/products/{product.id}/like/')
+
+    def test_like_is_idempotent(self):
+        product = self.products[0]
+        self.assertEqual(self.like(self.users[0], product).status_code, 201)
+        self.assertEqual(self.like(self.users[0], product).status_code, 200)
+        self.assertEqual(LikedItem.objects.count(), 1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            LikedItem.objects.create(user=self.users[0], content_object=product)
+
+        self.assertEqual(self.like(self.users[0], product, 'delete').status_code, 204)
+        self.assertEqual(self.like(self.users[0], product, 'delete').status_code, 204)
+        self.assertEqual(LikedItem.objects.count(), 0)
+        counters.flush()
+        self.assertEqual(LikedItem.objects.get_like_counts(Product, [product.id]), {product.id: 0})
+
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.put(f'/products/{product.id}/like/').status_code, 401)
+        self.client.force_authenticate(self.users[0])
+        self.assertEqual(self.client.put('/products/0/like/').status_code, 404)
+
+    def test_counts_are_flushed_in_batches(self):
+        for user in self.users:
+            for product in self.products[:2]:
+                self.like(user, product)
+        self.like(self.users[0], self.products[1], 'delete')
+        # До записи пачки счётчиков ещё нет
+        self.assertFalse(LikeCounter.objects.exists())
+
+        with self.assertNumQueries(4):  # SAVEPOINT, INSERT, UPDATE, RELEASE
+            self.assertEqual(counters.flush(), 2)
+        self.assertEqual(LikedItem.objects.get_like_counts(Product, [product.id for product in self.products]),
+                         {self.products[0].id: 3, self.products[1].id: 2, self.products[2].id: 0})
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(f'/products/{self.products[0].id}/').data['like_count'], 3)
+
+        self.like(self.users[1], self.products[0], 'delete')
+        self.assertEqual(counters.flush(), 1)
+        self.assertEqual(LikeCounter.objects.get(product=self.products[0]).count, 2)
+
+    @override_settings(LIKES_COUNTER_FLUSH_INTERVAL=0)
+    def test_order_by_like_count(self):
+        for user, product in [(self.users[0], self.products[1]), (self.users[1], self.products[1]),
+                              (self.users[0], self.products[2])]:
+            self.like(user, product)
+        response = self.client.get('/products/?ordering=-like_count')
+        self.assertEqual([product['id'] for product in response.data['results']],
+                         [self.products[1].id, self.products[2].id, self.products[0].id])
+        self.assertEqual([product['like_count'] for product in response.data['results']], [2, 1, 0])
+
+    @override_settings(CACHES=LOCMEM_CACHE)
+    def test_flush_refreshes_cached_lists(self):
+        self.like(self.users[0], self.products[1])
+        response = self.client.get('/products/?ordering=-like_count')
+        self.assertEqual([product['like_count'] for product in response.data['results']], [0, 0, 0])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            counters.flush()
+        response = self.client.get('/products/?ordering=-like_count')
+        self.assertEqual(response.data['results'][0]['id'], self.products[1].id)
+        self.assertEqual(response.data['results'][0]['like_count'], 1)
+
+    @override_settings(LIKES_COUNTER_FLUSH_INTERVAL=0)
+    def test_failed_flush_does_not_fail_like(self):
+        with mock.patch.object(LikeCounter.objects, 'bulk_create', side_effect=RuntimeError('сбой')), \
+                self.assertLogs('likes.counters', 'ERROR'):
+            response = self.like(self.users[0], self.products[0])
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(LikeCounter.objects.exists())
+
+        # Изменение осталось в буфере и записывается следующей пачкой
+        self.like(self.users[1], self.products[0])
+        self.assertEqual(LikeCounter.objects.get(product=self.products[0]).count, 2)
+
+    def test_rebuild(self):
+        self.like(self.users[0], self.products[0])
+        self.like(self.users[1], self.products[0])
+        # Изменения ещё в буфере, а счётчик другого товара разошёлся
+        self.assertTrue(counters._buffer)
+        LikeCounter.objects.create(content_type=ContentType.objects.get_for_model(Product),
+                                   object_id=self.products[1].id, count=5)
+
+        call_command('rebuild_like_counters', stdout=io.StringIO())
+        self.assertEqual(LikedItem.objects.get_like_counts(Product, [self.products[0].id, self.products[1].id]),
+                         {self.products[0].id: 2, self.products[1].id: 0})
+        # Буфер уже учтён пересчётом и не записывается повторно
+        self.assertEqual(counters.flush(), 0)
+        self.assertEqual(LikeCounter.objects.get(product=self.products[0]).count, 2)
@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+
+
+def get_max_file_size():
+    return getattr(settings, 'STORE_IMAGE_MAX_SIZE_KB', 500) * 1024
+
+
+def get_max_files():
+    return getattr(settings, 'STORE_UPLOAD_MAX_FILES', 10)
+
+
+class LimitedUploadHandler(FileUploadHandler):
+    # Ставится первым в request.upload_handlers (ProductImageViewSet): считает байты каждого файла по мере чтения запроса
+    # и обрывает загрузку, как только файл больше лимита или файлов слишком много.
+    # Остаток тела запроса не читается; причина - в request.upload_error
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.files = 0
+        self.received = 0
+
+    def reject(self, error):
+        self.request.upload_error = error
+        raise StopUpload(connection_reset=True)
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.files += 1
+        self.received = 0
+        if self.files > get_max_files():
+            self.reject(f'Можно загрузить не более {get_max_files()} файлов за раз')
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > get_max_file_size():
+            self.reject(f'Файл не может быть более {get_max_file_size() // 1024}KB!')
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+
+def get_upload_error(request):
+    # Вызывать после чтения request.data / request.FILES
+    return getattr(getattr(request, '_request', request), 'upload_error', None)
+
+
+def read_upload(request):
+    # Разбирает тело запроса через обработчики загрузки (LimitedUploadHandler) и возвращает
+    # ошибку лимита или None. Сами данные не нужны: их разбор кэшируется в request.data
+    # и потом достаётся сериализатору без повторного чтения
+    request.data
+    return get_upload_error(request)
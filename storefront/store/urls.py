@@ -1,5 +1,6 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import images, views
 from rest_framework_nested import routers
 
 # urlpatterns = [
@@ -28,12 +29,18 @@ router.register('tagged_items', views.TaggedItemItemViewSet, basename='tagged_it
 
 product_router = routers.NestedDefaultRouter(router, 'products', lookup='product')
 product_router.register('reviews', views.ReviewViewSet, basename='product-reviews')
+product_router.register('images', views.ProductImageViewSet, basename='product-images')
 
 carts_router = routers.NestedDefaultRouter(router, 'carts', lookup='cart')
 carts_router.register('items', views.CartItemViewSet, basename='cart-items')
 
 
 
-add_products = [path('test_add_products/', views.add_products, name='test_add_products')]
+# Ленивое создание уменьшенных картинок (store.images) по их адресу в MEDIA_URL
+image_variants = [path(f'{settings.MEDIA_URL.lstrip("/")}{images.VARIANTS_DIR}/<path:name>',
+                       views.serve_image_variant, name='image_variant')]
 
-urlpatterns = router.urls + product_router.urls + carts_router.urls + add_products
\ No newline at end of file
+import_products = [path('import_products/', views.import_products, name='import_products'),
+                   path('event_metrics/', views.event_metrics, name='event_metrics')]
+
+urlpatterns = router.urls + product_router.urls + carts_router.urls + import_products + image_variants
\ No newline at end of file
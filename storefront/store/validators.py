@@ -1,7 +1,36 @@
+import warnings
+
+from django.conf import settings
 from django.core.exceptions import ValidationError
+from PIL import Image
+
+# Форматы, которые принимаются для картинок товаров
+IMAGE_FORMATS = {'JPEG', 'PNG', 'WEBP'}
+
 
 def validate_file_size(file):
-    max_size_kb = 500
+    max_size_kb = getattr(settings, 'STORE_IMAGE_MAX_SIZE_KB', 500)
 
     if file.size > max_size_kb * 1024:
-        raise ValidationError(f'Файл не может быть более {max_size_kb}KB!')
\ No newline at end of file
+        raise ValidationError(f'Файл не может быть более {max_size_kb}KB!')
+
+
+def validate_image_dimensions(file):
+    # Читаем только заголовок: формат и размеры известны без распаковки пикселей,
+    # поэтому "бомба" из маленького файла с огромным разрешением отсекается до декодирования
+    max_pixels = getattr(settings, 'STORE_IMAGE_MAX_PIXELS', 25_000_000)
+    position = file.tell()
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', Image.DecompressionBombWarning)
+            with Image.open(file) as image:
+                image_format, (width, height) = image.format, image.size
+    except (OSError, SyntaxError, Image.DecompressionBombError, Image.DecompressionBombWarning):
+        raise ValidationError('Файл не является изображением')
+    finally:
+        file.seek(position)
+
+    if image_format not in IMAGE_FORMATS:
+        raise ValidationError(f'Формат {image_format} не поддерживается')
+    if width * height > max_pixels:
+        raise ValidationError(f'Изображение не может быть больше {max_pixels} пикселей')
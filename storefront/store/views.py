@@ -1,39 +1,55 @@
-from django.db.models import Count
+from django.db.models import Count, F, OuterRef, Prefetch, Subquery, Value, Window
+from django.db.models.functions import Coalesce, RowNumber
 from django.shortcuts import get_object_or_404
-from .models import Product, Collection, OrderItem, Review, Cart, CartItem, Customer, Order, Promotion
-from django.http import HttpResponse
+from .models import Product, Collection, OrderItem, Review, Cart, CartItem, Customer, Order, Promotion, \
+    ProductImage
+from django.http import Http404, HttpResponse
+from django.db import transaction
+from django.conf import settings
 
 
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from .serializers import ProductSerializer, CollectionSerializer, ReviewSerializer, \
-    CartSerializer, CartItemSerializer, AddCartItemSerializer, UpdateCartSerializer, \
-    CustomerSerializer, OrderSerializer, UpdateOrderSerializer, CreateOrderSerializer, \
+    CartSerializer, CartSummarySerializer, CartItemSerializer, AddCartItemSerializer, \
+    AddCartItemsSerializer, UpdateCartSerializer, \
+    CustomerSerializer, OrderSerializer, OrderSummarySerializer, UpdateOrderSerializer, CreateOrderSerializer, \
     PromotionSerializer, LikedItemSerializer, TagSerializer, TaggedItemSerializer, \
-    AdminCustomerSerializer
+    AdminCustomerSerializer, FastCartItemSerializer, FastCartSerializer, FastCollectionSerializer, \
+    FastOrderSerializer, FastProductSerializer, ProductImageSerializer, AddProductImagesSerializer
 
 #     , LikedItemSerializer, TagSerializer, TaggedItemSerializer
 
 
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
-from rest_framework.filters import SearchFilter, OrderingFilter
-from .pagination import DefaultPagination
+from rest_framework.filters import OrderingFilter
+from .pagination import DefaultPagination, SelectablePaginationMixin
 from django_filters.rest_framework import DjangoFilterBackend
-from .filters import ProductFilter
+from .filters import ProductFilter, ProductSearchFilter
 
 from rest_framework.mixins import RetrieveModelMixin, DestroyModelMixin, CreateModelMixin
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.decorators import action
 
 from .permissions import IsAdminOrReadOnly, IsAdminOrPost, IsAdminOrOwner
+from . import events, images, inventory, importer, uploads
+from . import cache
+from .cache import CachedResponseMixin
+from .fast import FastReadMixin
+from .outbox import AtomicWriteMixin
+from .middleware import get_customer_id
+from core import media
 
 from tags.models import Tag, TaggedItem
-from likes.models import LikedItem
+from likes.models import LikedItem, LikeCounter
 
 from rest_framework.renderers import TemplateHTMLRenderer
 
-class CollectionViewSet(ModelViewSet):
+class CollectionViewSet(AtomicWriteMixin, CachedResponseMixin, ModelViewSet):
     serializer_class = CollectionSerializer
+    fast_serializer_class = FastCollectionSerializer
+    cache_namespace = cache.COLLECTIONS
     queryset = Collection.objects.annotate(products_count=Count('products')).all()
 
     permission_classes = [IsAdminOrReadOnly]
@@ -48,24 +64,61 @@ class CollectionViewSet(ModelViewSet):
                             status=status.HTTP_405_METHOD_NOT_ALLOWED)
         return super().destroy(self, request, *args, **kwargs)
 
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(AtomicWriteMixin, CachedResponseMixin, SelectablePaginationMixin, ModelViewSet):
     serializer_class = ProductSerializer
+    fast_serializer_class = FastProductSerializer
+    cache_namespace = cache.PRODUCTS
     queryset = Product.objects.all()
     pagination_class = DefaultPagination
-    # filterset_class = ProductFilter
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
-    search_fields = ['title', 'description']
-    ordering_fields = ['price', 'last_update']
+    filterset_class = ProductFilter
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter, OrderingFilter]
+    # like_count - самые популярные товары (?ordering=-like_count)
+    ordering_fields = ['title', 'price', 'effective_price', 'last_update', 'like_count']
 
     permission_classes = [IsAdminOrReadOnly]
 
+    # Сколько последних отзывов отдавать на каждый товар в списке (None - все)
+    list_reviews_limit = 5
+
     # renderer_classes = [TemplateHTMLRenderer]
     # template_name = 'index.html'
 
 
 
+    def get_reviews_prefetch(self):
+        reviews = Review.objects.order_by('-date', '-id')
+        if self.action == 'list' and self.list_reviews_limit is not None:
+            reviews = reviews.annotate(row_number=Window(
+                RowNumber(),
+                partition_by=F('product_id'),
+                order_by=[F('date').desc(), F('id').desc()]
+            )).filter(row_number__lte=self.list_reviews_limit)
+        return Prefetch('reviews', queryset=reviews)
+
+    def get_tags_prefetch(self):
+        return Prefetch('tagged_items', queryset=TaggedItem.objects.select_related('tag')
+                        .order_by('tag__label', 'tag_id'))
+
+    def get_like_annotations(self):
+        # Одна строка LikeCounter вместо подсчёта лайков; число запросов не зависит от размера страницы
+        like_count = LikeCounter.objects.filter(product=OuterRef('pk')).values('count')[:1]
+        return {'like_count': Coalesce(Subquery(like_count), Value(0))}
+
+    def personalize(self, request, data):
+        # is_liked - одним запросом по id товаров ответа; отпечаток - id лайкнутых из них
+        items = data['results'] if 'results' in data else [data]
+        liked_ids = LikedItem.objects.get_liked_ids(request.user.id, Product, [item['id'] for item in items])
+        items = [{**item, 'is_liked': item['id'] in liked_ids} for item in items]
+        data = {**data, 'results': items} if 'results' in data else items[0]
+        return data, ','.join(map(str, sorted(liked_ids)))
+
     def get_queryset(self):
-        queryset = Product.objects.all()
+        reviews_count = Review.objects.filter(product_id=OuterRef('pk')) \
+            .values('product_id').annotate(count=Count('id')).values('count')
+
+        queryset = Product.objects.select_related('collection', 'promotion') \
+            .prefetch_related('images', self.get_reviews_prefetch(), self.get_tags_prefetch()) \
+            .annotate(reviews_count=Coalesce(Subquery(reviews_count), Value(0)), **self.get_like_annotations())
         collection_id = self.request.query_params.get('collection_id')
         if collection_id is not None:
             queryset = queryset.filter(collection_id=collection_id)
@@ -80,22 +133,69 @@ class ProductViewSet(ModelViewSet):
                             status=status.HTTP_405_METHOD_NOT_ALLOWED)
         return super().destroy(self, request, *args, **kwargs)
 
+    @action(detail=True, methods=['PUT', 'DELETE'], permission_classes=[IsAuthenticated])
+    def like(self, request, pk):
+        # Идемпотентно: повторный PUT или DELETE не меняет ни лайк, ни счётчик
+        product = get_object_or_404(Product, pk=pk)
+        if request.method == 'DELETE':
+            LikedItem.objects.unlike(request.user.id, product)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        liked_item, created = LikedItem.objects.like(request.user.id, product)
+        return Response(LikedItemSerializer(liked_item).data,
+                        status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+
+class ProductImageViewSet(ModelViewSet):
+    http_method_names = ['get', 'post', 'delete']
+    serializer_class = ProductImageSerializer
+    permission_classes = [IsAdminOrReadOnly]
 
-class ReviewViewSet(ModelViewSet):
+    def get_queryset(self):
+        return ProductImage.objects.filter(product_id=self.kwargs['product_pk'])
+
+    def get_serializer_context(self):
+        return {'request': self.request, 'product_id': self.kwargs['product_pk']}
+
+    def initialize_request(self, request, *args, **kwargs):
+        # Ограничения только для картинок товаров: остальные загрузки (админка и др.) их не видят
+        request.upload_handlers.insert(0, uploads.LimitedUploadHandler(request))
+        return super().initialize_request(request, *args, **kwargs)
+
+    def check_upload(self, request):
+        # Товар проверяется до чтения тела: к несуществующему товару файлы не принимаются
+        get_object_or_404(Product.objects.only('id'), pk=self.kwargs['product_pk'])
+        error = uploads.read_upload(request)
+        if error is not None:
+            return Response({'error': error}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        return None
+
+    def create(self, request, *args, **kwargs):
+        return self.check_upload(request) or super().create(request, *args, **kwargs)
+
+    @action(detail=False, methods=['POST'])
+    def batch(self, request, product_pk=None):
+        error_response = self.check_upload(request)
+        if error_response is not None:
+            return error_response
+        serializer = AddProductImagesSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        product_images = serializer.save()
+        return Response(ProductImageSerializer(product_images, many=True, context=self.get_serializer_context()).data,
+                        status=status.HTTP_201_CREATED)
+
+
+class ReviewViewSet(SelectablePaginationMixin, ModelViewSet):
     serializer_class = ReviewSerializer
+    keyset_ordering = ['-date']
 
 
     def get_permissions(self):
-        if self.request.user.is_authenticated:
-            try:
-                customer_id = Customer.objects.get(user_id=self.request.user.id).id
-                if Review.objects.filter(id=self.kwargs['pk'],
-                                         product_id=self.kwargs['product_pk'],
-                                         customer_id=customer_id).exists():
-                    return [IsAdminOrOwner()]
-                return [IsAdminOrPost()]
-            except:
-                return [IsAdminOrPost()]
+        customer_id = get_customer_id(self.request)
+        if customer_id and 'pk' in self.kwargs:
+            if Review.objects.filter(id=self.kwargs['pk'],
+                                     product_id=self.kwargs['product_pk'],
+                                     customer_id=customer_id).exists():
+                return [IsAdminOrOwner()]
         return [IsAdminOrPost()]
 
 
@@ -103,13 +203,8 @@ class ReviewViewSet(ModelViewSet):
         return Review.objects.filter(product_id=self.kwargs['product_pk'])
 
     def get_serializer_context(self):
-        try:
-            customer_id = Customer.objects.get(user_id=self.request.user.id).id
-        except:
-            customer_id = 0
-
         return {
-            'customer_id': customer_id,
+            'customer_id': get_customer_id(self.request) or 0,
             'product_id': self.kwargs['product_pk']
         }
 
@@ -117,12 +212,21 @@ class ReviewViewSet(ModelViewSet):
 
 
 
-class CartViewSet(CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, GenericViewSet):
-    queryset = Cart.objects.prefetch_related('items__product').all()
+class CartViewSet(FastReadMixin, CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, GenericViewSet):
+    queryset = Cart.objects.with_totals().prefetch_related(
+        Prefetch('items', queryset=CartItem.objects.with_line_totals().select_related('product__promotion'))
+    )
     serializer_class = CartSerializer
+    fast_serializer_class = FastCartSerializer
 
-class CartItemViewSet(ModelViewSet):
+    @action(detail=True)
+    def summary(self, request, pk=None):
+        cart = get_object_or_404(Cart.objects.with_totals(), pk=pk)
+        return Response(CartSummarySerializer(cart).data)
+
+class CartItemViewSet(FastReadMixin, ModelViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete']
+    fast_serializer_class = FastCartItemSerializer
 
     def get_serializer_class(self):
         if self.request.method == 'POST':
@@ -135,8 +239,27 @@ class CartItemViewSet(ModelViewSet):
     def get_serializer_context(self):
         return {'cart_id': self.kwargs['cart_pk']}
 
+    @action(detail=False, methods=['POST'])
+    def batch(self, request, cart_pk=None):
+        serializer = AddCartItemsSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        cart_items = serializer.save()
+        return Response(AddCartItemSerializer(cart_items, many=True).data, status=status.HTTP_201_CREATED)
+
     def get_queryset(self):
-        return CartItem.objects.filter(cart_id=self.kwargs['cart_pk']).select_related('product')
+        return CartItem.objects.with_line_totals().filter(cart_id=self.kwargs['cart_pk']) \
+            .select_related('product__promotion')
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            cart_item = serializer.save()
+            if not inventory.reserve(cart_item.cart_id, cart_item.product_id, cart_item.quantity):
+                raise ValidationError('Недостаточно товаров на складе')
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            inventory.release(instance.cart_id, instance.product_id)
+            instance.delete()
 
 
 class CustomerViewSet(ModelViewSet):
@@ -154,7 +277,7 @@ class CustomerViewSet(ModelViewSet):
     def get_queryset(self):
         if self.request.user.is_staff:
             return Customer.objects.all()
-        return Customer.objects.filter(user=self.request.user)
+        return Customer.objects.filter(user_id=self.request.user.id)
 
     def get_serializer_context(self):
         return {
@@ -163,9 +286,8 @@ class CustomerViewSet(ModelViewSet):
 
     @action(detail=False, methods=['GET', 'PUT'], permission_classes=[IsAuthenticated])
     def me(self, request):
-        try:
-            customer = Customer.objects.get(user_id=request.user.id)
-        except:
+        customer = request.customer
+        if not customer:
             customer, created = Customer.objects.get_or_create(user_id=request.user.id)
 
         if request.method == 'GET':
@@ -185,18 +307,32 @@ class CustomerViewSet(ModelViewSet):
             return Response(serializer.data)
 
 
-class OrderViewSet(ModelViewSet):
+class OrderViewSet(FastReadMixin, SelectablePaginationMixin, ModelViewSet):
+    keyset_ordering = ['-placed_at']
     http_method_names = ['get', 'put', 'post', 'patch', 'delete', 'head', 'options']
+    fast_serializer_class = FastOrderSerializer
     # queryset = Order.objects.all()
 
+    def is_summary(self):
+        return self.action == 'list' and self.request.query_params.get('view') == 'summary'
+
+    def get_fast_serializer_class(self):
+        return None if self.is_summary() else super().get_fast_serializer_class()
+
+    def get_detail_queryset(self):
+        items = OrderItem.objects.select_related('product__promotion')
+        return Order.objects.with_totals().prefetch_related(Prefetch('items', queryset=items))
+
     def get_queryset(self):
         user = self.request.user
 
+        # В кратком списке строки заказа не загружаются вовсе - только агрегаты
+        queryset = Order.objects.with_totals() if self.is_summary() else self.get_detail_queryset()
+
         if user.is_staff:
-            return Order.objects.all()
+            return queryset
 
-        customer_id = Customer.objects.only('id').get(user_id=user.id)
-        return Order.objects.filter(customer_id=customer_id)
+        return queryset.filter(customer_id=get_customer_id(self.request))
 
 
 
@@ -206,11 +342,17 @@ class OrderViewSet(ModelViewSet):
             return [IsAdminUser()]
         return [IsAuthenticated()]
 
+    def place_order(self, request):
+        # Проверка, оформление и чтение заказа - одна транзакция, чтобы её можно было повторить
+        with transaction.atomic():
+            serializer = CreateOrderSerializer(data=request.data,
+                                               context={'customer': request.customer})
+            serializer.is_valid(raise_exception=True)
+            order = serializer.save()
+            return self.get_detail_queryset().get(pk=order.pk)
+
     def create(self, request, *args, **kwargs):
-        serializer = CreateOrderSerializer(data=request.data,
-                                           context={'user_id': request.user.id})
-        serializer.is_valid(raise_exception=True)
-        order = serializer.save()
+        order = inventory.retry_on_conflict(lambda: self.place_order(request))
 
         serializer = OrderSerializer(order)
 
@@ -222,10 +364,12 @@ class OrderViewSet(ModelViewSet):
             return CreateOrderSerializer
         elif self.request.method == 'PUT':
             return UpdateOrderSerializer
+        elif self.is_summary():
+            return OrderSummarySerializer
         return OrderSerializer
 
 
-class PromotionViewSet(ModelViewSet):
+class PromotionViewSet(AtomicWriteMixin, ModelViewSet):
     serializer_class = PromotionSerializer
     queryset = Promotion.objects.all()
 
@@ -241,7 +385,7 @@ class LikedItemViewSet(ModelViewSet):
     def get_queryset(self):
         if self.request.user.is_staff:
             return LikedItem.objects.all()
-        return LikedItem.objects.filter(user=self.request.user)
+        return LikedItem.objects.filter(user_id=self.request.user.id)
 
     def get_permissions(self):
         if self.request.user.is_authenticated:
@@ -266,32 +410,33 @@ class TaggedItemItemViewSet(ModelViewSet):
 
 
 
-from rest_framework.decorators import api_view
-from rest_framework.response import Response
+from rest_framework.decorators import api_view, permission_classes
+
+
+@api_view(['GET', 'POST'])
+@permission_classes([IsAdminUser])
+def import_products(request):
+    # POST ставит импорт каталога в очередь outbox (выполнит dispatch_outbox), GET - его состояние
+    if request.method == 'POST':
+        if importer.start_import(settings.STORE_IMPORT_FILE) is None:
+            return Response({'error': 'Импорт уже запущен'}, status=status.HTTP_409_CONFLICT)
+        return Response(importer.get_status(), status=status.HTTP_202_ACCEPTED)
+    return Response(importer.get_status())
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def event_metrics(request):
+    # Глубина очереди событий, счётчики обработки и задержка от коммита до обработки (в секундах)
+    return Response(events.get_metrics())
+
 
-import json
-
-
-@api_view()
-def add_products(request):
-    with open('TexnomartParser.json', mode='r', encoding='UTF-8') as file:
-        data = json.load(file)
-        for key, value in data.items():
-            Collection.objects.create(title=key)
-            for product in value:
-                title = product['Наименование товара']
-                price = product['Цена товара']
-                inventory = 100
-                collection = Collection.objects.get(title=key)
-                description = ''
-                for description_key, description_value in product['Характеристики'].items():
-                    description += f'{description_key}:\n'
-                    for k, v in description_value.items():
-                        description += f'\t{k}: {v}\n'
-
-                Product.objects.create(title=title,
-                                       description=description,
-                                       price=price, inventory=inventory,
-                                       collection=collection)
-
-    return Response({'status': 'ok'})
\ No newline at end of file
+def serve_image_variant(request, name):
+    # Вызывается, только если файла варианта нет среди раздаваемых веб-сервером медиафайлов:
+    # создаём его по имени и отдаём, дальше файл раздаётся как обычный медиафайл
+    match = images.VARIANT_NAME_RE.match(f'{images.VARIANTS_DIR}/{name}')
+    if match is None or match['format'] not in images.FORMATS:
+        raise Http404
+    if not images.get_storage().exists(match[0]) and images.generate_by_name(match[0]) is None:
+        raise Http404
+    return media.serve(request, match[0], images.get_storage().location)
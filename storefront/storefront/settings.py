@@ -9,6 +9,7 @@ https://docs.djangoproject.com/en/4.2/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
+import os
 from datetime import timedelta
 from pathlib import Path
 
@@ -59,7 +60,9 @@ MIDDLEWARE = [
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
+    'core.db.ReplicaRoutingMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'store.middleware.CustomerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -90,23 +93,137 @@ WSGI_APPLICATION = 'storefront.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# Всё берётся из окружения. По умолчанию - SQLite рядом с проектом (WAL и прагмы - core.db),
+# DB_ENGINE=postgresql - PostgreSQL с постоянными соединениями
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite3')
+
+if DB_ENGINE == 'postgresql':
+    DEFAULT_DATABASE = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('DB_NAME', 'django-rest'),
+        'USER': os.environ.get('DB_USER', 'postgres'),
+        'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+        'HOST': os.environ.get('DB_HOST', 'localhost'),
+        'PORT': os.environ.get('DB_PORT', '5432'),
+        # Соединение живёт между запросами и проверяется перед повторным использованием
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        # DB_POOLER=1 - соединения идут через пул (pgbouncer в режиме transaction),
+        # где серверные курсоры .iterator() работать не будут
+        'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('DB_POOLER', '') == '1',
+        'OPTIONS': {
+            'connect_timeout': int(os.environ.get('DB_CONNECT_TIMEOUT', 5)),
+        },
+    }
+else:
+    DEFAULT_DATABASE = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+        'OPTIONS': {
+            # Сколько секунд ждать снятия блокировки записи, прежде чем вернуть ошибку
+            'timeout': int(os.environ.get('DB_TIMEOUT', 20)),
+        },
+        # Тестовая БД в файле, а не в памяти: у общей in-memory БД SQLite другие
+        # блокировки, и параллельные тесты оформления заказа на ней не показательны
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    }
+
 DATABASES = {
+    'default': DEFAULT_DATABASE,
+}
+
+# Реплика для чтения каталога в GET-запросах (core.db.ReplicaRouter):
+# DB_REPLICA_HOST для PostgreSQL, DB_REPLICA_NAME - путь к копии для SQLite
+if os.environ.get('DB_REPLICA_HOST') or os.environ.get('DB_REPLICA_NAME'):
+    DATABASES['replica'] = {
+        **DEFAULT_DATABASE,
+        'NAME': os.environ.get('DB_REPLICA_NAME', DEFAULT_DATABASE['NAME']),
+        'HOST': os.environ.get('DB_REPLICA_HOST', DEFAULT_DATABASE.get('HOST', '')),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['core.db.ReplicaRouter']
+
+# Сколько секунд после записи читать данные пользователя только с основной БД (отставание реплики)
+CORE_REPLICA_STICKY_SECONDS = int(os.environ.get('DB_REPLICA_STICKY_SECONDS', 5))
+# Где хранить эту отметку: алиас общего для всех процессов кэша (не locmem) или None -
+# подписанная cookie CORE_REPLICA_PIN_COOKIE в ответе
+CORE_REPLICA_PIN_CACHE = None
+CORE_REPLICA_PIN_COOKIE = 'db_primary'
+
+# Прагмы для каждого нового соединения SQLite
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'temp_store': 'memory',
+    'cache_size': -64000,
+    'mmap_size': 128 * 1024 * 1024,
+}
+
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
     }
 }
 
-# DATABASES = {
-#     'default': {
-#         'ENGINE': 'django.db.backends.postgresql',
-#         'NAME': 'django-rest',
-#         'USER': 'postgres',
-#         'PASSWORD': 'root',
-#         'HOST': 'localhost',
-#         'PORT': '5432'
-#     }
-# }
+# Файл каталога для импорта (manage.py import_products / POST /import_products/)
+STORE_IMPORT_FILE = BASE_DIR / 'TexnomartParser.json'
+# Импорт без новых пачек дольше стольких секунд считается прерванным, и можно запустить новый
+STORE_IMPORT_STALE_AFTER = 10 * 60
+
+# Множитель цены с налогом
+STORE_TAX_RATE = '1.1'
+
+# Алиас кэша для ответов товаров и категорий
+STORE_RESPONSE_CACHE = 'default'
+# Сколько секунд хранить версию объекта или списка, по которой строится ключ ответа
+STORE_RESPONSE_VERSION_TIMEOUT = 24 * 60 * 60
+
+# Сколько секунд хранить покупателя в общем кэше по id пользователя (0 - только на время запроса)
+STORE_CUSTOMER_CACHE_TIMEOUT = 0
+
+# Получатели order_created вызываются после коммита в пуле потоков (0 - сразу в текущем потоке);
+# неудачный вызов повторяется до STORE_EVENT_RETRIES раз с паузой RETRY_DELAY * 2^n секунд
+STORE_EVENT_WORKERS = int(os.environ.get('STORE_EVENT_WORKERS', 4))
+STORE_EVENT_RETRIES = 3
+STORE_EVENT_RETRY_DELAY = 1
+# Сколько секунд ждать одного получателя, прежде чем считать вызов неудачным
+STORE_EVENT_TIMEOUT = 10
+
+# Таблица outbox (manage.py dispatch_outbox): размер пачки, аренда захваченной пачки в секундах,
+# пауза перед повтором RETRY_DELAY * 2^n секунд и число попыток, после которого событие оставляется
+STORE_OUTBOX_BATCH_SIZE = 100
+STORE_OUTBOX_LEASE = 60
+STORE_OUTBOX_RETRY_DELAY = 5
+STORE_OUTBOX_MAX_ATTEMPTS = 5
+# Сколько секунд хранить обработанные и брошенные события и как часто dispatch_outbox их удаляет
+STORE_OUTBOX_RETENTION = 7 * 24 * 60 * 60
+STORE_OUTBOX_PURGE_INTERVAL = 60 * 60
+
+# Уменьшенные варианты картинок товаров (WebP и JPEG): вариант -> наибольшие ширина и высота
+STORE_IMAGE_VARIANTS = {
+    'thumbnail': (150, 150),
+    'list': (400, 400),
+    'detail': (1200, 1200),
+}
+STORE_IMAGE_QUALITY = 80
+# Ограничения загрузки картинок товаров: размер файла (проверяется по мере чтения запроса
+# в ProductImageViewSet), число файлов в одном запросе и разрешение (по заголовку до декодирования)
+STORE_IMAGE_MAX_SIZE_KB = 500
+STORE_UPLOAD_MAX_FILES = 10
+STORE_IMAGE_MAX_PIXELS = 25_000_000
+
+# Счётчики лайков пишутся пачками: раз в столько секунд или когда в буфере столько объектов.
+# После падения процесса точные значения восстанавливает manage.py rebuild_like_counters
+LIKES_COUNTER_FLUSH_INTERVAL = 5
+LIKES_COUNTER_BUFFER_SIZE = 1000
 
 
 # Password validation
@@ -148,6 +265,16 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Раздавать MEDIA_URL из Django (core.media) - и без DEBUG, если перед Django нет отдельной раздачи
+CORE_MEDIA_SERVE = os.environ.get('MEDIA_SERVE', '1') == '1'
+# 'x-accel-redirect' (nginx) или 'x-sendfile' (Apache, lighttpd): файл отдаёт веб-сервер.
+# Для nginx нужен internal location CORE_MEDIA_ACCEL_PREFIX с alias на MEDIA_ROOT
+CORE_MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE') or None
+CORE_MEDIA_ACCEL_PREFIX = '/protected-media/'
+CORE_MEDIA_MAX_AGE = 60 * 60
+# Пути внутри MEDIA_ROOT, где имя файла содержит хэш содержимого: Cache-Control на год, immutable
+CORE_MEDIA_IMMUTABLE = [r'^store/images/variants/']
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -155,6 +282,19 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'COERCE_DECIMAL_TO_STRING': False,
+    # JSON через orjson, если он установлен (pip install orjson), иначе - стандартный json
+    'DEFAULT_RENDERER_CLASSES': (
+        'core.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'core.renderers.StreamingJSONRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'core.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
+    # core.authentication.StatelessJWTAuthentication берёт пользователя из полей токена
+    # без запроса к БД, если задан CORE_TOKEN_REVOCATION_CACHE; иначе отзыв проверяется по БД
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     )
@@ -162,9 +302,16 @@ REST_FRAMEWORK = {
 
 SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('JWT',),
-    'ACCESS_TOKEN_LIFETIME': timedelta(days=1)
+    'ACCESS_TOKEN_LIFETIME': timedelta(days=1),
+    'TOKEN_OBTAIN_SERIALIZER': 'core.serializers.TokenObtainPairSerializer',
 }
 
+# Алиас кэша с отметками об отзыве токенов. Кэш должен быть общим для всех процессов и не
+# вытеснять записи (отдельная база Redis с maxmemory-policy noeviction): вытесненная отметка
+# снова пускает отключённого пользователя. Locmem 'default' не подходит. None - отметка
+# хранится в User.tokens_revoked_at и проверяется запросом к БД на каждый запрос
+CORE_TOKEN_REVOCATION_CACHE = None
+
 AUTH_USER_MODEL = 'core.User'
 
 DJOSER = {
@@ -172,4 +319,6 @@ DJOSER = {
         'user_create': 'core.serializers.UserCreateSerializer',
         'current_user': 'core.serializers.UserSerializer',
     }
-}
\ No newline at end of file
+}
+# Сколько секунд товар, добавленный в корзину, зарезервирован за ней (None - без резерва)
+STORE_CART_RESERVATION_TIMEOUT = None
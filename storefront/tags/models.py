@@ -14,6 +14,16 @@ class TaggedItemManager(models.Manager):
             object_id=obj_id
         )
 
+    def get_tags_for_many(self, obj_type, obj_ids):
+        # {id объекта: [метки по алфавиту]} одним запросом; ContentType берётся из кэша Django
+        content_type = ContentType.objects.get_for_model(obj_type)
+        tags = {obj_id: [] for obj_id in obj_ids}
+        rows = self.filter(content_type=content_type, object_id__in=tags) \
+            .order_by('object_id', 'tag__label', 'tag_id').values_list('object_id', 'tag__label')
+        for obj_id, label in rows:
+            tags[obj_id].append(label)
+        return tags
+
 
 class Tag(models.Model):
     label = models.CharField(max_length=50)
@@ -28,3 +38,8 @@ class TaggedItem(models.Model):
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['content_type', 'object_id'], name='tags_tagged_object_idx'),
+        ]
+